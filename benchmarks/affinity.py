@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""CPU affinity benchmark.
+
+Drives events through worker processes using the in-memory queue connector,
+once without pinning worker processes to CPUs and once for every placement
+strategy, and reports latency percentiles for each. Tail latencies are what
+pinning should improve; results depend on the machine, so compare runs on
+the machine that matters.
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from nite.bench import Benchmark  # noqa
+
+
+COUNT = 20000
+COST = 0.0002
+RATE = 2000
+
+
+def main():
+    """Run the benchmark."""
+    # Keep a CPU for the main process, which triggers the events, if there's more than one
+    reserved = 1 if len(os.sched_getaffinity(0)) > 1 else 0
+    workers = max(1, len(os.sched_getaffinity(0)) - reserved)
+
+    scenarios = [
+        ('unpinned', None),
+        ('spread', {'strategy': 'spread', 'reserved': reserved}),
+        ('compact', {'strategy': 'compact', 'reserved': reserved}),
+    ]
+
+    header = ('placement', 'events/s', 'p50 (ms)', 'p99 (ms)', 'p999 (ms)', 'max (ms)')
+    print('%-10s %12s %10s %10s %10s %10s' % header)
+
+    for name, affinity in scenarios:
+        # Every scenario runs in a fresh process, so that the main process isn't left pinned for the next one
+        read, write = os.pipe()
+        pid = os.fork()
+
+        if not pid:
+            os.close(read)
+            result = Benchmark(workers=workers, count=COUNT, cost=COST, rate=RATE, demographics=['single'],
+                               affinity=affinity).run()['results']['single']
+            os.write(write, ('%f %f %f %f %f' % (result['events_per_second'], result['p50'], result['p99'],
+                                                 result['p999'], result['max'])).encode('utf-8'))
+            os._exit(0)
+
+        os.close(write)
+        with os.fdopen(read) as handle:
+            values = [float(value) for value in handle.read().split()]
+        os.waitpid(pid, 0)
+
+        print('%-10s %12.0f %10.2f %10.2f %10.2f %10.2f' % (name, values[0], values[1] * 1000, values[2] * 1000,
+                                                            values[3] * 1000, values[4] * 1000))
+
+
+if __name__ == '__main__':
+    main()
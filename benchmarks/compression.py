@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""Compression benchmark.
+
+Reports the compression ratio and CPU cost of every available codec, with
+and without a trained dictionary, for msgpack-serialized events of various
+sizes resembling the JSON-like blobs events tend to carry.
+"""
+import os
+import sys
+import time
+import random
+import msgpack
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from nite.codec import available_codecs, train_dictionary  # noqa
+
+
+SIZES = [256, 1024, 16384, 262144]
+ROUNDS = 0.25
+
+
+def payload(rng, size):
+    """Return a serialized event of roughly `size` bytes."""
+    records = []
+    body = {'event': 'benchmarks.compression.RecordsEvent', 'data': {'_uuid': '%032x' % rng.getrandbits(128),
+                                                                     'records': records}}
+
+    while len(msgpack.dumps(body, use_bin_type=True)) < size:
+        records.append({
+            'id': rng.randint(0, 10 ** 9),
+            'tenant': rng.choice(['acme', 'initech', 'umbrella', 'hooli']),
+            'status': rng.choice(['active', 'suspended', 'pending']),
+            'email': 'user%i@example.com' % rng.randint(0, 10 ** 6),
+            'score': rng.random(),
+            'tags': rng.sample(['alpha', 'beta', 'gamma', 'delta', 'epsilon'], 2),
+        })
+
+    return msgpack.dumps(body, use_bin_type=True)
+
+
+def measure(function, data):
+    """Return the average amount of seconds a call to `function(data)` takes, and its last result."""
+    calls = 0
+    result = None
+    started = time.process_time()
+
+    while time.process_time() - started < ROUNDS:
+        result = function(data)
+        calls += 1
+
+    return (time.process_time() - started) / calls, result
+
+
+def main():
+    """Run the benchmark."""
+    rng = random.Random(42)
+    print('%-6s %-5s %8s %8s %12s %12s' % ('codec', 'dict', 'size', 'ratio', 'comp MB/s', 'decomp MB/s'))
+
+    for name, Codec in sorted(available_codecs().items()):
+        codec = Codec()
+        dictionary = train_dictionary([payload(rng, 1024) for i in range(0, 200)], codec=name)
+
+        for size in SIZES:
+            data = payload(rng, size)
+
+            for label, used in (('no', None), ('yes', dictionary)):
+                compress_time, compressed = measure(lambda data: codec.compress(data, used), data)
+                decompress_time, restored = measure(lambda data: codec.decompress(data, used), compressed)
+                assert restored == data
+
+                print('%-6s %-5s %8i %8.2f %12.1f %12.1f' % (
+                    name, label, len(data), float(len(data)) / len(compressed),
+                    len(data) / compress_time / 1e6, len(data) / decompress_time / 1e6
+                ))
+
+
+if __name__ == '__main__':
+    main()
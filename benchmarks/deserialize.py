@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""Deserialization benchmark.
+
+Compares unserializing whole message bodies up front with reading only the
+envelope of an event, for payloads ranging from 100 B to 10 MB. Envelopes
+are read both with a known event name (as sent in the `x-nite-event`
+header) and without one, which requires walking the envelope.
+"""
+import os
+import sys
+import time
+import msgpack
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from nite.codec import EnvelopeReader, unpack  # noqa
+
+
+EVENT = 'benchmarks.deserialize.PayloadEvent'
+SIZES = [100, 1000, 10000, 100000, 1000000, 10000000]
+ROUNDS = 0.25
+
+
+def payload(size):
+    """Return a serialized event of roughly `size` bytes, consisting of strings and binary data."""
+    text = 'lorem ipsum dolor sit amet ' * (size // 108 + 1)
+    data = {
+        '_uuid': '0' * 32,
+        'title': text[:size // 4],
+        'items': [text[:16]] * (size // 64),
+        'attachment': b'\x00' * (size // 4),
+    }
+
+    return msgpack.packb({'event': EVENT, 'data': data}, use_bin_type=True)
+
+
+def measure(function):
+    """Return the average amount of seconds a call to `function()` takes."""
+    calls = 0
+    started = time.perf_counter()
+
+    while time.perf_counter() - started < ROUNDS:
+        function()
+        calls += 1
+
+    return (time.perf_counter() - started) / calls
+
+
+def main():
+    """Run the benchmark."""
+    reader = EnvelopeReader()
+    print('%10s %14s %14s %14s %14s' % ('size', 'eager (us)', 'header (us)', 'walked (us)', 'touched (us)'))
+
+    for size in SIZES:
+        body = memoryview(payload(size))
+
+        print('%10i %14.2f %14.2f %14.2f %14.2f' % (
+            len(body),
+            measure(lambda: unpack(body)) * 1e6,
+            measure(lambda: reader.read(body, EVENT)) * 1e6,
+            measure(lambda: reader.read(body)) * 1e6,
+            measure(lambda: unpack(reader.read(body, EVENT)[1])) * 1e6,
+        ))
+
+
+if __name__ == '__main__':
+    main()
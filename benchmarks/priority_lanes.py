@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""Priority lane benchmark.
+
+Simulates a single worker handling a saturating stream of bulk events while a
+trickle of urgent events arrives, and reports the latency of the urgent events
+with plain FIFO handling and with weighted priority lanes.
+
+Time is simulated, so results are deterministic and don't depend on the
+machine running the benchmark.
+"""
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from nite.dispatch import WeightedDispatcher  # noqa
+from nite.event import MessagePriority  # noqa
+from nite.util import percentile  # noqa
+
+
+SERVICE_TIME = 0.001
+BULK_RATE = 1500.0
+URGENT_RATE = 20.0
+DURATION = 60.0
+
+
+def arrivals(seed):
+    """Return a time-ordered list of (arrival time, priority) tuples."""
+    rng = random.Random(seed)
+    events = []
+
+    for priority, rate in ((MessagePriority.BULK, BULK_RATE), (MessagePriority.URGENT, URGENT_RATE)):
+        now = 0.0
+        while now < DURATION:
+            now += rng.expovariate(rate)
+            events.append((now, priority.value))
+
+    return sorted(events)
+
+
+def simulate(dispatcher, events, lane):
+    """Run the simulation and return latencies of urgent events and the amount of bulk events handled.
+
+    `lane` maps the priority of an event onto the dispatcher lane to buffer it in.
+    """
+    latencies = []
+    handled_bulk = 0
+    now = 0.0
+    index = 0
+
+    while now < DURATION:
+        # Deliver everything that has arrived so far
+        while index < len(events) and events[index][0] <= now:
+            dispatcher.put(lane(events[index][1]), events[index])
+            index += 1
+
+        item = dispatcher.pop()
+        if item is None:
+            now = events[index][0] if index < len(events) else DURATION
+            continue
+
+        now += SERVICE_TIME
+
+        if item[1] == MessagePriority.URGENT.value:
+            latencies.append(now - item[0])
+        else:
+            handled_bulk += 1
+
+    return latencies, handled_bulk
+
+
+def main():
+    """Run the benchmark."""
+    events = arrivals(42)
+    weights = {'BULK': 1, 'NORMAL': 4, 'HIGH': 16, 'URGENT': 64}
+
+    scenarios = [
+        # A FIFO is a dispatcher with a single lane
+        ('fifo', WeightedDispatcher(), lambda priority: 0),
+        ('lanes', WeightedDispatcher({MessagePriority[name].value: w for name, w in weights.items()}),
+         lambda priority: priority),
+    ]
+
+    print('%-8s %12s %12s %12s %14s' % ('mode', 'p50 (ms)', 'p99 (ms)', 'max (ms)', 'bulk handled'))
+
+    for name, dispatcher, lane in scenarios:
+        latencies, handled_bulk = simulate(dispatcher, events, lane)
+        latencies.sort()
+
+        print('%-8s %12.2f %12.2f %12.2f %14i' % (
+            name,
+            percentile(latencies, 0.5) * 1000,
+            percentile(latencies, 0.99) * 1000,
+            latencies[-1] * 1000,
+            handled_bulk
+        ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""Topology benchmark.
+
+Compares the per-event topology with the consolidated topology by counting
+what worker processes and the main process ask of the broker at startup:
+synchronous declarations (each costing a round trip), queues, bindings and
+consumers. Startup time is estimated from the configured round trip time,
+assuming worker processes start in parallel.
+"""
+import os
+import sys
+import collections
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from nite.event import EventManager  # noqa
+from nite.queue import AmqpQueueConnector  # noqa
+
+
+EVENTS = 200
+WORKERS = 32
+WORK_QUEUES = 4
+RTT = 0.0005
+
+
+class CountingChannel:
+
+    """Channel which counts the methods called on it instead of talking to a broker."""
+
+    def __init__(self, counts):
+        """Constructor."""
+        self.counts = counts
+        self.channel_id = 1
+
+    def close(self):
+        """Do nothing."""
+        pass
+
+    def __getattr__(self, name):
+        """Return a method which counts its calls."""
+        def method(*args, **kwargs):
+            self.counts[name] += 1
+
+        return method
+
+
+class CountingConnection:
+
+    """Connection which hands out counting channels."""
+
+    def __init__(self, counts):
+        """Constructor."""
+        self.counts = counts
+
+    def channel(self):
+        """Return a counting channel."""
+        return CountingChannel(self.counts)
+
+    def close(self):
+        """Do nothing."""
+        pass
+
+
+def measure(topology):
+    """Return the calls made by the main process and by a single worker process with a topology."""
+    events = EventManager()
+    events.handlers.update(('benchmarks.topology.Event%i' % i, {}) for i in range(0, EVENTS))
+
+    master, worker = collections.Counter(), collections.Counter()
+    connector = AmqpQueueConnector(events, 'fanout', 'topic', '/', 'localhost', 'guest', 'guest',
+                                   topology=topology, work_queues=WORK_QUEUES)
+
+    connector.create_connection = lambda: CountingConnection(master)
+    connector.declare_topology()
+
+    connector.connection = CountingConnection(worker)
+    connector.create_channel()
+
+    return master, worker
+
+
+def main():
+    """Run the benchmark."""
+    print('%d event types, %d worker processes, %.1fms round trips' % (EVENTS, WORKERS, RTT * 1000))
+    print('%-14s %10s %10s %10s %10s %12s' % ('topology', 'rpcs', 'queues', 'bind rpcs', 'consumers', 'startup (s)'))
+
+    for topology in ('per_event', 'consolidated'):
+        master, worker = measure(topology)
+        master_rpcs, worker_rpcs = sum(master.values()), sum(worker.values())
+
+        print('%-14s %10i %10i %10i %10i %12.3f' % (
+            topology,
+            master_rpcs + worker_rpcs * WORKERS,
+            master['queue_declare'] + worker['queue_declare'] - 1,
+            master['queue_bind'] + worker['queue_bind'] * WORKERS,
+            worker['basic_consume'] * WORKERS,
+            (master_rpcs + worker_rpcs) * RTT,
+        ))
+
+
+if __name__ == '__main__':
+    main()
@@ -6,6 +6,7 @@ import signal
 import sys
 import errno
 import time
+import json
 import threading
 from logging import getLogger
 from ballercfg import ConfigurationManager
@@ -15,11 +16,38 @@ from nite.logging import configure_logging
 from nite.event import EventManager
 from nite.worker import WorkerManager
 from nite.module import ModuleManager
+from nite.control import ControlServer, send_command
+from nite.cache import SharedCache
 
 
 logger = getLogger(__name__)
 
 
+def load_config():
+    """Load application configuration."""
+    return ConfigurationManager.load([
+        os.path.join(os.path.dirname(os.path.dirname(__file__)), 'config/*'),
+        os.path.expanduser('~') + '/.nite/config/*',
+        '/etc/nite/config/*'
+    ])
+
+
+def parse_speed(ctx, param, value):
+    """Parse a replay speed such as "1x", "2.5x" or "max" into a factor, which is 0 for "max"."""
+    if value == 'max':
+        return 0
+
+    try:
+        speed = float(value[:-1] if value.endswith('x') else value)
+    except ValueError:
+        speed = 0
+
+    if speed <= 0:
+        raise click.BadParameter('Speeds should look like "1x", "10x" or "max", not "%s"' % value)
+
+    return speed
+
+
 def show_version(ctx, param, value):
     """Print version information and exit."""
     if not value:
@@ -29,14 +57,119 @@ def show_version(ctx, param, value):
     ctx.exit()
 
 
-@click.command()
+@click.group(invoke_without_command=True)
 @click.option('--debug', '-d', is_flag=True, help='Show debug output.')
 @click.option('--daemonize', is_flag=True, help='Daemonize the process.')
 @click.option('--version', '-v', is_flag=True, help='Print version information and exit.',
               callback=show_version, expose_value=False, is_eager=True)
-def nite(debug, daemonize):
+@click.pass_context
+def nite(ctx, debug, daemonize):
     """NITE - Nigh Impervious Task Executor."""
-    NITECore(locals())
+    ctx.obj = {'debug': debug, 'daemonize': daemonize}
+
+    # Without a subcommand, just run NITE
+    if ctx.invoked_subcommand is None:
+        NITECore(ctx.obj)
+
+
+@nite.command()
+@click.option('--workers', '-w', type=int, help='Amount of worker processes, defaults to the CPU count.')
+@click.option('--count', '-n', default=10000, help='Amount of events to trigger per demographic.')
+@click.option('--size', '-s', default=256, help='Amount of payload bytes per event.')
+@click.option('--cost', '-c', default=0.0, help='Amount of seconds of CPU time handling an event takes.')
+@click.option('--rate', '-r', default=0.0, help='Amount of events to trigger per second, 0 for as many as possible.')
+@click.option('--demographic', '-D', multiple=True, type=click.Choice(['single', 'all']),
+              help='Demographic to benchmark, defaults to all of them. May be repeated.')
+@click.option('--affinity', '-a', type=click.Choice(['spread', 'compact']),
+              help='Pin worker processes to CPUs using this placement strategy.')
+@click.option('--output', '-o', type=click.Path(dir_okay=False), help='Save results as JSON to this file.')
+@click.option('--compare', type=click.Path(exists=True, dir_okay=False),
+              help='Compare results with results saved as JSON earlier.')
+@click.pass_context
+def bench(ctx, workers, count, size, cost, rate, demographic, affinity, output, compare):
+    """Benchmark event throughput and latency, without a broker."""
+    from nite.bench import Benchmark, report, save, load
+
+    configure_logging(debug=ctx.obj['debug'])
+
+    results = Benchmark(workers=workers, count=count, size=size, cost=cost, rate=rate, demographics=demographic,
+                        affinity={'strategy': affinity} if affinity else None).run()
+    print(report(results, load(compare) if compare else None))
+
+    if output:
+        save(results, output)
+
+
+@nite.command()
+@click.argument('command')
+@click.argument('arguments', nargs=-1)
+@click.option('--socket', '-S', 'path', default='/tmp/nite/control.sock', type=click.Path(exists=True),
+              help='Path of the control socket.')
+def control(command, arguments, path):
+    """Send a command to a running instance, such as "status" or "set_workers count=8".
+
+    Arguments are passed as key=value pairs. Values are parsed as JSON where
+    possible, and used as strings otherwise. Run "nite control help" for a
+    list of commands.
+    """
+    kwargs = {}
+
+    for argument in arguments:
+        if '=' not in argument:
+            raise click.BadParameter('Arguments should look like key=value, not "%s"' % argument)
+
+        key, value = argument.split('=', 1)
+
+        try:
+            kwargs[key] = json.loads(value)
+        except ValueError:
+            kwargs[key] = value
+
+    response = send_command(path, command, **kwargs)
+    print(json.dumps(response.get('result', response), indent=2, sort_keys=True, default=str))
+
+    if 'error' in response:
+        sys.exit(1)
+
+
+@nite.command()
+@click.argument('path', type=click.Path(exists=True, file_okay=False))
+@click.option('--speed', '-s', default='1x', callback=parse_speed,
+              help='Replay speed relative to the recording, such as "1x" or "10x", or "max" for as fast as possible.')
+@click.option('--threads', '-t', default=1, help='Amount of threads triggering recorded events in parallel.')
+@click.option('--max-rate', '-r', type=float, help='Trigger at most this many events per second.')
+@click.option('--limit', '-l', type=int, help='Stop after this many recorded events.')
+@click.pass_context
+def replay(ctx, path, speed, threads, max_rate, limit):
+    """Trigger events recorded by a queue connector again.
+
+    PATH is the directory events were recorded into, or the directory of the
+    segment log of a single process. Events are triggered through the queue
+    configured for this node, while no worker processes or modules are
+    started.
+    """
+    from nite.record import Replay, report
+
+    configure_logging(debug=ctx.obj['debug'])
+
+    config = load_config()
+    events = EventManager()
+
+    queue_type = config.get('nite.queue.type', 'amqp')
+    queue_config = dict(config.get('nite.queue.%s' % queue_type) or {})
+
+    # Don't record the replay itself
+    queue_config.pop('record', None)
+
+    events.queue = create_connector(type=queue_type, config=queue_config, events=events)
+    events.queue.start(produce_only=True)
+
+    try:
+        summary = Replay(events, path, speed=speed, threads=threads, max_rate=max_rate, limit=limit).run()
+    finally:
+        events.queue.stop()
+
+    print(report(summary))
 
 
 class NITECore:
@@ -103,6 +236,26 @@ class NITECore:
         """Set the worker manager."""
         self._workers = value
 
+    @property
+    def cache(self):
+        """Return the cache shared by all processes of this node."""
+        return self._cache
+
+    @cache.setter
+    def cache(self, value):
+        """Set the cache shared by all processes of this node."""
+        self._cache = value
+
+    @property
+    def control(self):
+        """Return the control socket server, or None."""
+        return self._control
+
+    @control.setter
+    def control(self, value):
+        """Set the control socket server, or None."""
+        self._control = value
+
     @property
     def terminate(self):
         """Return termination event."""
@@ -119,17 +272,16 @@ class NITECore:
         self.terminate = threading.Event()
 
         # Load configuration
-        self.config = ConfigurationManager.load([
-            'config/*',
-            os.path.expanduser('~') + '/.nite/config/*',
-            '/etc/nite/config/*'
-        ])
+        self.config = load_config()
 
         # Properly set up the logger using values from the configuration
         configure_logging(self.config.get('nite.logging'), debug=self.options['debug'])
 
         # Initialize event manager
-        self.events = EventManager()
+        self.events = EventManager(
+            timeout=self.config.get('nite.event.timeout'),
+            timeouts=self.config.get('nite.event.timeouts', {})
+        )
 
         # Initialize queue manager
         queue_type = self.config.get('nite.queue.type', 'amqp')
@@ -142,31 +294,65 @@ class NITECore:
         # Add queue manager reference to event manager
         self.events.queue = self.queue
 
+        # Modules share a cache with every worker process, so it has to exist before those are forked
+        self.cache = SharedCache(**self.config.get('nite.cache', {}))
+
         # Initialize module manager
         self.modules = ModuleManager(self)
         self.modules.start()
 
+        # Declare what worker processes share before they start
+        self.queue.declare_topology()
+
         # Start worker processes
-        self.workers = WorkerManager(queue=self.queue, worker_count=self.config.get('nite.event.worker_processes'))
+        self.workers = WorkerManager(
+            queue=self.queue,
+            worker_count=self.config.get('nite.event.worker_processes'),
+            pools=self.config.get('nite.event.pools', {}),
+            concurrency=self.config.get('nite.event.concurrency', {}),
+            stuck_timeout=self.config.get('nite.event.stuck_timeout'),
+            profile=self.config.get('nite.event.profile'),
+            affinity=self.config.get('nite.event.affinity'),
+            cache=self.cache
+        )
         self.workers.start()
 
         # Start produce-only queue for use by modules
         self.queue.start(produce_only=True)
 
+        # Allow inspecting and tuning things while running
+        self.control = None
+        if self.config.get('nite.control.enabled', False):
+            self.control = ControlServer(self, self.config.get('nite.control.path', '/tmp/nite/control.sock'))
+            self.control.start()
+
         logger.info('Started successfully')
 
-        # Run until we have to stop
+        # Run until we have to stop, keeping an eye on worker processes
         while not self.terminate.is_set():
             time.sleep(0.2)
+            self.workers.check()
 
     def stop(self):
         """Stop NITE."""
         logger.info('Attempting to stop')
         self.terminate.set()
 
-        self.queue.stop()
-        self.workers.stop()
-        self.modules.stop()
+        # Starting may have failed halfway, leaving some parts unstarted
+        if self.control is not None:
+            self.control.stop()
+
+        if self.events is not None:
+            self.events.timers.stop()
+
+        if self.queue is not None:
+            self.queue.stop()
+
+        if self.workers is not None:
+            self.workers.stop()
+
+        if self.modules is not None:
+            self.modules.stop()
 
         logger.info('Stopped successfully')
 
@@ -229,9 +415,11 @@ class NITECore:
         """Handle a signal sent to this process."""
         logger.debug('Received signal %s' % sig)
 
-        if sig is signal.SIGHUP:
+        if sig == signal.SIGHUP:
             self.stop()
             self.start()
+        elif sig == signal.SIGUSR1:
+            self.workers.toggle_profiling()
         else:
             self.stop()
 
@@ -240,6 +428,7 @@ class NITECore:
         signal.signal(signal.SIGTERM, self.handle_signal)
         signal.signal(signal.SIGINT, self.handle_signal)
         signal.signal(signal.SIGHUP, self.handle_signal)
+        signal.signal(signal.SIGUSR1, self.handle_signal)
 
     def __init__(self, options):
         """Constructor."""
@@ -259,5 +448,14 @@ class NITECore:
         # Register signal handlers
         self.register_signal_handlers()
 
+        # Nothing has been started yet
+        self.terminate = threading.Event()
+        self.events = None
+        self.queue = None
+        self.cache = None
+        self.modules = None
+        self.workers = None
+        self.control = None
+
         # Start application
         self.start()
@@ -0,0 +1,171 @@
+"""Affinity module."""
+import os
+import glob
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+#: Directory the kernel describes CPUs in.
+CPU_PATH = '/sys/devices/system/cpu'
+
+#: Directory the kernel lists the threads of this process in.
+TASK_PATH = '/proc/self/task'
+
+#: CPUs this process was allowed to run on before anything got pinned, or None if affinity isn't supported.
+ALLOWED_CPUS = os.sched_getaffinity(0) if hasattr(os, 'sched_getaffinity') else None
+
+
+def read_topology_value(cpu, name, default):
+    """Return an integer describing the topology of a CPU, or `default` if the kernel doesn't tell."""
+    try:
+        with open(os.path.join(CPU_PATH, 'cpu%i' % cpu, 'topology', name)) as handle:
+            return int(handle.read().strip())
+    except (OSError, ValueError):
+        return default
+
+
+def cpu_topology(cpus):
+    """Return a dict mapping CPUs onto the NUMA node, package (socket) and physical core they're part of."""
+    topology = {}
+
+    for cpu in cpus:
+        nodes = glob.glob(os.path.join(CPU_PATH, 'cpu%i' % cpu, 'node[0-9]*'))
+        node = int(os.path.basename(nodes[0])[len('node'):]) if nodes else 0
+
+        topology[cpu] = (
+            node,
+            read_topology_value(cpu, 'physical_package_id', 0),
+            read_topology_value(cpu, 'core_id', cpu),
+        )
+
+    return topology
+
+
+class CpuPlacement:
+
+    """This class decides which CPUs worker processes are pinned to.
+
+    With the `compact` strategy, worker processes fill up the CPUs of one
+    NUMA node before moving on to the next, keeping them close to each other
+    and to the memory they share. With the `spread` strategy, consecutive
+    worker processes go to different NUMA nodes and to different physical
+    cores before hyperthreads share a core, so they compete as little as
+    possible for caches and memory bandwidth. With the `list` strategy,
+    worker processes are pinned to the CPUs listed in `cpus`, in order.
+
+    The first `reserved` CPUs, or the CPUs listed in `reserved`, are kept
+    for the main process and its modules. Worker processes are pinned to a
+    single CPU each, or to all CPUs of the NUMA node of that CPU if `scope`
+    is `node`, which leaves the kernel free to move them within the node.
+    """
+
+    @property
+    def strategy(self):
+        """Return the name of the placement strategy."""
+        return self._strategy
+
+    @property
+    def master_cpus(self):
+        """Return the set of CPUs reserved for the main process, which is empty if none are."""
+        return self._master_cpus
+
+    @property
+    def worker_cpus(self):
+        """Return the list of CPUs available to worker processes, in the order they're handed out."""
+        return self._worker_cpus
+
+    def order(self, cpus, strategy):
+        """Return CPUs in the order a strategy hands them out."""
+        if strategy == 'list':
+            return list(cpus)
+
+        topology = cpu_topology(cpus)
+
+        if strategy == 'compact':
+            return sorted(cpus, key=lambda cpu: topology[cpu] + (cpu,))
+
+        # Number the hyperthreads of every physical core, so that every core gets a worker before any gets two
+        threads, seen = {}, {}
+        for cpu in sorted(cpus):
+            core = topology[cpu]
+            threads[cpu] = seen.get(core, 0)
+            seen[core] = threads[cpu] + 1
+
+        # Then take turns between NUMA nodes
+        nodes = {}
+        for cpu in sorted(cpus, key=lambda cpu: (threads[cpu], topology[cpu][1:], cpu)):
+            nodes.setdefault(topology[cpu][0], []).append(cpu)
+
+        ordered = []
+        for i in range(0, max(len(node) for node in nodes.values())):
+            ordered.extend(nodes[node][i] for node in sorted(nodes) if i < len(nodes[node]))
+
+        return ordered
+
+    def cpus_for(self, index):
+        """Return the set of CPUs to pin the worker process at an index to."""
+        cpu = self.worker_cpus[index % len(self.worker_cpus)]
+
+        if self._scope == 'node':
+            return set(self._nodes[self._topology[cpu][0]])
+
+        return {cpu}
+
+    def pin_master(self):
+        """Pin every thread of the main process to the CPUs reserved for it, if any are.
+
+        Affinity is kept per thread, and modules may have started threads of
+        their own already, so every thread of the process is pinned rather
+        than just the calling one. Threads started later inherit it.
+        """
+        if not self.master_cpus:
+            return
+
+        threads = [int(thread) for thread in os.listdir(TASK_PATH)] if os.path.isdir(TASK_PATH) else [0]
+
+        for thread in threads:
+            try:
+                os.sched_setaffinity(thread, self.master_cpus)
+            except ProcessLookupError:
+                # Threads which stopped meanwhile don't need pinning
+                pass
+
+        logger.debug('Pinned %i thread(s) of the main process to CPU(s) %s', len(threads),
+                     ', '.join(str(cpu) for cpu in sorted(self.master_cpus)))
+
+    def __init__(self, strategy='spread', cpus=None, reserved=0, scope='cpu'):
+        """Constructor."""
+        if not hasattr(os, 'sched_setaffinity'):
+            raise Exception('CPU affinity isn\'t supported on this platform')
+
+        if strategy not in ('spread', 'compact', 'list'):
+            raise Exception('Unknown CPU placement strategy "%s"' % strategy)
+
+        if strategy == 'list' and not cpus:
+            raise Exception('The "list" CPU placement strategy needs a list of "cpus"')
+
+        if scope not in ('cpu', 'node'):
+            raise Exception('Unknown CPU placement scope "%s"' % scope)
+
+        available = sorted(ALLOWED_CPUS)
+        ordered = self.order([cpu for cpu in cpus if cpu in available] if cpus else available, strategy)
+
+        # Reserve CPUs for the main process, taking them from the start of the compact order unless they're listed
+        if isinstance(reserved, int):
+            master = self.order(available, 'compact')[:reserved]
+        else:
+            master = [cpu for cpu in reserved if cpu in available]
+
+        self._strategy = strategy
+        self._scope = scope
+        self._master_cpus = set(master)
+        self._worker_cpus = [cpu for cpu in ordered if cpu not in self._master_cpus]
+        self._topology = cpu_topology(self._worker_cpus)
+        self._nodes = {}
+
+        for cpu in self._worker_cpus:
+            self._nodes.setdefault(self._topology[cpu][0], []).append(cpu)
+
+        if not self._worker_cpus:
+            raise Exception('No CPUs are left for worker processes')
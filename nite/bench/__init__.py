@@ -0,0 +1,192 @@
+"""Benchmark module."""
+import json
+import time
+import socket
+import logging
+import platform
+import multiprocessing
+from queue import Empty
+from nite.event import EventManager, EventDemographic
+from nite.queue import create_connector
+from nite.worker import WorkerManager
+from nite.util import percentile
+from nite.bench.events import create_event_type
+
+
+logger = logging.getLogger(__name__)
+
+#: Demographics events can be benchmarked for, by the name used on the command line.
+DEMOGRAPHICS = {
+    'single': EventDemographic.GLOBAL_SINGLE,
+    'all': EventDemographic.GLOBAL_ALL,
+}
+
+
+class Benchmark:
+
+    """This class drives synthetic events through worker processes and measures throughput and latency.
+
+    Events are triggered through the event manager of the main process like
+    any other event, and handled by worker processes, which report how long
+    every event took to arrive and be handled.
+    """
+
+    @property
+    def events(self):
+        """Return the event manager."""
+        return self._events
+
+    @property
+    def queue(self):
+        """Return the queue connector."""
+        return self._queue
+
+    @property
+    def workers(self):
+        """Return the worker manager."""
+        return self._workers
+
+    @property
+    def config(self):
+        """Return a dict containing the benchmark configuration."""
+        return self._config
+
+    def handle(self, event):
+        """Handle an event in a worker process, and report its latency."""
+        event.work()
+        self._results.put((event.demographic, time.time() - event.sent))
+
+    def run(self):
+        """Run the benchmark and return its results."""
+        self.workers.start()
+        self.queue.start(produce_only=True)
+
+        try:
+            # Make sure every worker process is up before measuring anything
+            self.measure('single', self.config['warmup'])
+
+            results = {}
+            for demographic in self.config['demographics']:
+                results[demographic] = self.measure(demographic, self.config['count'])
+        finally:
+            self.queue.stop()
+            self.workers.stop()
+            self.events.timers.stop()
+
+        return {
+            'timestamp': time.time(),
+            'host': socket.getfqdn(),
+            'python': platform.python_version(),
+            'config': self.config,
+            'results': results,
+        }
+
+    def measure(self, demographic, count):
+        """Trigger `count` events for a demographic and return their throughput and latency."""
+        interval = 1.0 / self.config['rate'] if self.config['rate'] else 0
+        started = time.time()
+
+        for i in range(0, count):
+            if interval:
+                time.sleep(max(0, started + i * interval - time.time()))
+
+            self.events.trigger(self._Event(demographic), DEMOGRAPHICS[demographic])
+
+        latencies = []
+        while len(latencies) < count:
+            try:
+                latencies.append(self._results.get(timeout=self.config['timeout'])[1])
+            except Empty:
+                logger.warning('Gave up on %i "%s" event(s) which weren\'t handled within %is',
+                               count - len(latencies), demographic, self.config['timeout'])
+                break
+
+        duration = max(time.time() - started, 1e-9)
+        latencies.sort()
+
+        if not latencies:
+            return {'events': 0, 'duration': duration}
+
+        return {
+            'events': len(latencies),
+            'duration': duration,
+            'events_per_second': len(latencies) / duration,
+            'mean': sum(latencies) / len(latencies),
+            'p50': percentile(latencies, 0.5),
+            'p99': percentile(latencies, 0.99),
+            'p999': percentile(latencies, 0.999),
+            'max': latencies[-1],
+        }
+
+    def __init__(self, workers=None, count=10000, size=256, cost=0.0, rate=0, demographics=None, warmup=100,
+                 timeout=30, affinity=None):
+        """Set up a benchmark.
+
+        `count` events carrying `size` payload bytes and costing `cost`
+        seconds of CPU time to handle are triggered for every demographic,
+        at `rate` events per second or as fast as possible if it is 0. Events
+        are handled by `workers` worker processes, which default to one per
+        CPU, and are pinned to CPUs as configured by `affinity` if passed.
+        """
+        self._config = {
+            'workers': workers or multiprocessing.cpu_count(),
+            'count': count,
+            'size': size,
+            'cost': cost,
+            'rate': rate,
+            'demographics': list(demographics or sorted(DEMOGRAPHICS)),
+            'warmup': warmup,
+            'timeout': timeout,
+            'affinity': affinity,
+        }
+
+        # Everything worker processes need has to be in place before they're forked
+        self._Event = create_event_type(size, cost)
+        self._results = multiprocessing.Queue()
+
+        self._events = EventManager()
+        self._events.register(self._Event, self.handle)
+
+        self._queue = create_connector(type='memory', config={}, events=self.events)
+        self._events.queue = self.queue
+
+        self._workers = WorkerManager(queue=self.queue, worker_count=self.config['workers'], affinity=affinity)
+
+
+def report(results, baseline=None):
+    """Return a human-readable report of benchmark results, compared to those of a baseline if passed."""
+    lines = ['%-8s %10s %12s %10s %10s %10s' % ('demo', 'events', 'events/s', 'p50 (ms)', 'p99 (ms)', 'p999 (ms)')]
+
+    for demographic, result in sorted(results['results'].items()):
+        if not result['events']:
+            lines.append('%-8s %10i' % (demographic, 0))
+            continue
+
+        lines.append('%-8s %10i %12.0f %10.2f %10.2f %10.2f' % (
+            demographic, result['events'], result['events_per_second'],
+            result['p50'] * 1000, result['p99'] * 1000, result['p999'] * 1000
+        ))
+
+        previous = (baseline or {}).get('results', {}).get(demographic)
+        if previous and previous.get('events'):
+            lines.append('%-8s %10s %+11.1f%% %+9.1f%% %+9.1f%% %+9.1f%%' % (
+                '', 'vs. base',
+                (result['events_per_second'] / previous['events_per_second'] - 1) * 100,
+                (result['p50'] / previous['p50'] - 1) * 100,
+                (result['p99'] / previous['p99'] - 1) * 100,
+                (result['p999'] / previous['p999'] - 1) * 100,
+            ))
+
+    return '\n'.join(lines)
+
+
+def save(results, path):
+    """Save benchmark results as JSON."""
+    with open(path, 'w') as handle:
+        json.dump(results, handle, indent=2, sort_keys=True)
+
+
+def load(path):
+    """Load benchmark results saved as JSON."""
+    with open(path) as handle:
+        return json.load(handle)
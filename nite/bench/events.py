@@ -0,0 +1,42 @@
+"""Benchmark events module."""
+import time
+from nite.event import BaseEvent
+
+
+class BenchEvent(BaseEvent):
+
+    """This class serves as a basis for synthetic events generated for benchmarks."""
+
+    #: Amount of payload bytes carried by events of this type.
+    size = 0
+
+    #: Amount of seconds handlers of events of this type keep a CPU busy for.
+    cost = 0.0
+
+    def work(self):
+        """Keep a CPU busy for as long as events of this type cost to handle."""
+        deadline = time.perf_counter() + self.cost
+
+        while time.perf_counter() < deadline:
+            pass
+
+    def __init__(self, demographic):
+        """Create and populate the event."""
+        super(BenchEvent, self).__init__()
+        self.demographic = demographic
+        self.payload = b'\x00' * self.size
+        self.sent = time.time()
+
+
+def create_event_type(size, cost):
+    """Create and return an event type carrying `size` payload bytes and costing `cost` seconds to handle.
+
+    Event types are added to this module, so that worker processes forked
+    afterwards can import them like any other event type.
+    """
+    name = 'BenchEvent%iB%ius' % (size, cost * 1e6)
+
+    if name not in globals():
+        globals()[name] = type(name, (BenchEvent,), {'size': size, 'cost': cost, '__module__': __name__})
+
+    return globals()[name]
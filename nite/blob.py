@@ -0,0 +1,251 @@
+"""Blob module."""
+import os
+import time
+import mmap
+import uuid
+import fcntl
+import struct
+import logging
+import contextlib
+from nite.util import instantiate
+
+
+logger = logging.getLogger(__name__)
+
+
+class BlobStores:
+
+    """This class helps map blob stores to their identifiers."""
+
+    spool = ['nite.blob', 'SpoolBlobStore']
+
+
+def create_blob_store(type, config=None):
+    """Initialize and return a blob store of a certain type."""
+    # If the blob store isn't mapped at all, throw an error.
+    if not hasattr(BlobStores, type):
+        raise Exception('A blob store with the type "%s" can\'t be created!' % type)
+
+    # Fetch loader data
+    loader_data = getattr(BlobStores, type)
+
+    # Instantiate the class with our args
+    return instantiate(loader_data[0], loader_data[1], **(config or {}))
+
+
+class AbstractBlobStore:
+
+    """This class provides a place to keep payloads which are too large to send through the queue.
+
+    Only a reference to a stored payload travels through the queue. Stored
+    payloads are reference-counted, and removed once every consumer has
+    released them.
+
+    """
+
+    @property
+    def node_local(self):
+        """Return whether or not stored payloads can only be read on the node which stored them."""
+        return self._node_local
+
+    @node_local.setter
+    def node_local(self, value):
+        """Set whether or not stored payloads can only be read on the node which stored them."""
+        self._node_local = value
+
+    def put(self, data, consumers=None, expires=None):
+        """Store a payload and return a reference to it.
+
+        `consumers` is the amount of times the payload will be released
+        before it can be removed, or None if that isn't known up front, in
+        which case the payload is kept until it is collected. Payloads which
+        won't be consumed after the UNIX timestamp `expires`, if passed, are
+        collected once it has passed, even if they haven't been released.
+
+        This is an abstract method. You should implement your own.
+
+        """
+        raise NotImplementedError('All (indirect) derivatives of `AbstractBlobStore` must implement a `put` method.')
+
+    def open(self, reference):
+        """Return a context manager providing a memoryview of a stored payload.
+
+        Entering it raises a `FileNotFoundError` if the payload was removed.
+
+        This is an abstract method. You should implement your own.
+
+        """
+        raise NotImplementedError('All (indirect) derivatives of `AbstractBlobStore` must implement an `open` method.')
+
+    def release(self, reference):
+        """Release a stored payload once a consumer is done with it.
+
+        This is an abstract method. You should implement your own.
+
+        """
+        raise NotImplementedError(
+            'All (indirect) derivatives of `AbstractBlobStore` must implement a `release` method.')
+
+    def collect(self):
+        """Remove stored payloads which are no longer needed and return how many were removed.
+
+        This is an abstract method. You should implement your own.
+
+        """
+        raise NotImplementedError(
+            'All (indirect) derivatives of `AbstractBlobStore` must implement a `collect` method.')
+
+    def __init__(self, node_local=True):
+        """Constructor."""
+        self.node_local = node_local
+
+
+class SpoolBlobStore(AbstractBlobStore):
+
+    """This class stores payloads as files in a spool directory, such as one on `/dev/shm`.
+
+    Every file starts with a reference count, which is updated under an
+    exclusive lock on the file, and the time the payload expires at, if it
+    does. Consumers map files into memory, so payloads are never copied into
+    the heap of the process as a whole.
+
+    Payloads with an unknown amount of consumers are collected once they're
+    older than `ttl` seconds. Payloads which are still waiting for consumers
+    are only collected once they expired `ttl` seconds ago, if they expire
+    at all.
+
+    By default, payloads are only stored for events sent to a node by its
+    own identifier, by that node itself, as no other node can read them. If
+    the spool directory is on storage shared between nodes, pass
+    `node_local=False` so that payloads of every event may be stored and
+    consumed by any node.
+    """
+
+    #: Reference count (-1 if unknown) and expiry timestamp (0 if none) of a payload.
+    HEADER = struct.Struct('<qd')
+
+    #: Reference count of a payload, at the start of the header.
+    COUNT = struct.Struct('<q')
+
+    @property
+    def path(self):
+        """Return the spool directory."""
+        return self._path
+
+    @path.setter
+    def path(self, value):
+        """Set the spool directory."""
+        self._path = value
+
+    @property
+    def ttl(self):
+        """Return the amount of seconds after which payloads are collected even if they haven't been released."""
+        return self._ttl
+
+    @ttl.setter
+    def ttl(self, value):
+        """Set the amount of seconds after which payloads are collected even if they haven't been released."""
+        self._ttl = value
+
+    def file(self, reference):
+        """Return the path of the file containing a payload."""
+        return os.path.join(self.path, os.path.basename(reference) + '.blob')
+
+    def put(self, data, consumers=None, expires=None):
+        """Store a payload and return a reference to it."""
+        reference = uuid.uuid4().hex
+        temporary = self.file(reference) + '.tmp'
+
+        # Write to a temporary file first, so that payloads never appear half-written
+        with open(temporary, 'wb') as handle:
+            handle.write(self.HEADER.pack(consumers if consumers is not None else -1, expires or 0))
+            handle.write(data)
+
+        os.rename(temporary, self.file(reference))
+
+        return reference
+
+    @contextlib.contextmanager
+    def open(self, reference):
+        """Return a context manager providing a memoryview of a stored payload."""
+        with open(self.file(reference), 'rb') as handle:
+            mapping = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+            view = memoryview(mapping)[self.HEADER.size:]
+
+            try:
+                yield view
+            finally:
+                view.release()
+
+                # Views which outlive this block keep the mapping around until they're gone
+                try:
+                    mapping.close()
+                except BufferError:
+                    logger.warning('Blob "%s" is still in use, it will be unmapped once it no longer is', reference)
+
+    def release(self, reference):
+        """Release a stored payload, removing it if it was its last consumer."""
+        try:
+            descriptor = os.open(self.file(reference), os.O_RDWR)
+        except FileNotFoundError:
+            logger.warning('Blob "%s" was released after it had already been removed', reference)
+            return
+
+        try:
+            fcntl.flock(descriptor, fcntl.LOCK_EX)
+            consumers = self.COUNT.unpack(os.pread(descriptor, self.COUNT.size, 0))[0]
+
+            # Payloads with an unknown amount of consumers are left for collection
+            if consumers < 0:
+                return
+
+            if consumers <= 1:
+                os.unlink(self.file(reference))
+            else:
+                os.pwrite(descriptor, self.COUNT.pack(consumers - 1), 0)
+        finally:
+            os.close(descriptor)
+
+    def collect(self):
+        """Remove payloads which are no longer needed and return how many were removed."""
+        removed = 0
+        threshold = time.time() - self.ttl
+
+        for name in os.listdir(self.path):
+            path = os.path.join(self.path, name)
+
+            try:
+                if self.collectable(path, threshold):
+                    os.unlink(path)
+                    removed += 1
+            except FileNotFoundError:
+                pass
+
+        if removed:
+            logger.info('Collected %i expired blob(s) from "%s"', removed, self.path)
+
+        return removed
+
+    def collectable(self, path, threshold):
+        """Return whether or not the payload in a file can be collected, if it was last needed before `threshold`."""
+        # Files which were left half-written are never going to be consumed
+        if path.endswith('.tmp'):
+            return os.stat(path).st_mtime < threshold
+
+        with open(path, 'rb') as handle:
+            fcntl.flock(handle.fileno(), fcntl.LOCK_SH)
+            consumers, expires = self.HEADER.unpack(handle.read(self.HEADER.size))
+
+        if expires:
+            return expires < threshold
+
+        # Payloads which are still waiting for consumers are kept, however old they are
+        return consumers < 0 and os.stat(path).st_mtime < threshold
+
+    def __init__(self, path='/dev/shm/nite', ttl=3600, node_local=True):
+        """Constructor."""
+        super(self.__class__, self).__init__(node_local=node_local)
+        self.path = path
+        self.ttl = ttl
+
+        os.makedirs(self.path, exist_ok=True)
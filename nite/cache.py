@@ -0,0 +1,279 @@
+"""Cache module."""
+import os
+import mmap
+import time
+import struct
+import hashlib
+import logging
+import contextlib
+import multiprocessing
+import msgpack
+
+
+logger = logging.getLogger(__name__)
+
+#: Placeholder for keys which aren't cached.
+MISSING = object()
+
+
+class SharedCache:
+
+    """This class provides a key/value cache in memory shared by the main process and all worker processes of a node.
+
+    The cache has to be created before worker processes are forked. Its
+    memory is divided into fixed-size slots, grouped into sets of `ways`
+    slots. A key can only be stored in a single set, picked by hashing it,
+    and the least recently used entry of a set is evicted to make room. Sets
+    are guarded by `stripes` locks, so processes only wait for each other
+    when they access keys which share a lock.
+
+    Keys are strings or bytes, and values anything msgpack can serialize.
+    Entries which don't fit into a single slot aren't cached, and remove the
+    entry previously cached for their key.
+
+    Processes which are killed while holding a lock never release it, so
+    the processes holding locks are recorded, and `recover()` has to be
+    called for processes which were killed. Processes killed right after
+    acquiring a lock, before they were recorded, leave it locked for good.
+    """
+
+    #: Key hash, expiry timestamp, last use timestamp, key length and value length of the entry in a slot.
+    HEADER = struct.Struct('<QddII')
+
+    #: Counters kept per lock stripe.
+    METRICS = ('hits', 'misses', 'sets', 'evictions', 'expirations', 'rejections')
+
+    @property
+    def slot_size(self):
+        """Return the amount of bytes per slot, including the header of the entry in it."""
+        return self._slot_size
+
+    @property
+    def ways(self):
+        """Return the amount of slots per set."""
+        return self._ways
+
+    @property
+    def sets(self):
+        """Return the amount of sets."""
+        return self._sets
+
+    @property
+    def ttl(self):
+        """Return the default amount of seconds entries are kept for, or None to keep them until evicted."""
+        return self._ttl
+
+    @property
+    def stats(self):
+        """Return a dict containing the cache metrics of all processes."""
+        stats = {name: 0 for name in self.METRICS}
+
+        for i, count in enumerate(self._counters):
+            stats[self.METRICS[i % len(self.METRICS)]] += count
+
+        lookups = stats['hits'] + stats['misses']
+        stats.update({
+            'hit_rate': float(stats['hits']) / lookups if lookups else None,
+            'slots': self.sets * self.ways,
+            'slot_size': self.slot_size,
+        })
+
+        return stats
+
+    def get(self, key, default=None):
+        """Return the value cached for a key, or `default` if it isn't cached."""
+        key, digest, index, stripe = self.locate(key)
+
+        with self.locked(stripe):
+            offset = self.find(key, digest, index, stripe, time.time())
+
+            if offset is None:
+                self.count(stripe, 'misses')
+                return default
+
+            header = list(self.HEADER.unpack_from(self._map, offset))
+            start = offset + self.HEADER.size + header[3]
+            data = self._map[start:start + header[4]]
+
+            header[2] = time.time()
+            self.HEADER.pack_into(self._map, offset, *header)
+            self.count(stripe, 'hits')
+
+        return msgpack.loads(data, raw=False)
+
+    def set(self, key, value, ttl=None):
+        """Cache a value for a key for `ttl` seconds, and return whether or not it fit."""
+        key, digest, index, stripe = self.locate(key)
+        data = msgpack.dumps(value, use_bin_type=True)
+        ttl = self.ttl if ttl is None else ttl
+
+        with self.locked(stripe):
+            now = time.time()
+            offset = self.find(key, digest, index, stripe, now)
+
+            # Values which don't fit replace whatever was cached before, rather than leaving it around
+            if self.HEADER.size + len(key) + len(data) > self.slot_size:
+                if offset is not None:
+                    self.HEADER.pack_into(self._map, offset, 0, 0, 0, 0, 0)
+
+                self.count(stripe, 'rejections')
+                return False
+
+            if offset is None:
+                offset = self.evict(index, stripe)
+
+            self.HEADER.pack_into(self._map, offset, digest, now + ttl if ttl else 0, now, len(key), len(data))
+            start = offset + self.HEADER.size
+            self._map[start:start + len(key) + len(data)] = key + data
+            self.count(stripe, 'sets')
+
+        return True
+
+    def get_or_set(self, key, factory, ttl=None):
+        """Return the value cached for a key, caching the value returned by `factory()` if there is none."""
+        value = self.get(key, MISSING)
+
+        if value is MISSING:
+            value = factory()
+            self.set(key, value, ttl)
+
+        return value
+
+    def delete(self, key):
+        """Remove a key from the cache, and return whether or not it was cached."""
+        key, digest, index, stripe = self.locate(key)
+
+        with self.locked(stripe):
+            offset = self.find(key, digest, index, stripe, time.time())
+
+            if offset is not None:
+                self.HEADER.pack_into(self._map, offset, 0, 0, 0, 0, 0)
+
+        return offset is not None
+
+    def clear(self):
+        """Remove every key from the cache."""
+        for stripe in range(0, len(self._locks)):
+            with self.locked(stripe):
+                self.wipe(stripe)
+
+    def wipe(self, stripe):
+        """Remove every key guarded by the lock of a stripe, which has to be held."""
+        for index in range(stripe, self.sets, len(self._locks)):
+            for way in range(0, self.ways):
+                self.HEADER.pack_into(self._map, self.offset(index, way), 0, 0, 0, 0, 0)
+
+    def recover(self, pid):
+        """Release the locks held by a process which was killed, and return how many it held.
+
+        Entries guarded by those locks may have been left half-written, so
+        they're removed as well.
+        """
+        recovered = 0
+
+        for stripe, holder in enumerate(self._holders):
+            if holder != pid:
+                continue
+
+            self.wipe(stripe)
+            self._holders[stripe] = 0
+            self._locks[stripe].release()
+            recovered += 1
+
+        if recovered:
+            logger.warning('Released %i cache lock(s) held by killed process %i', recovered, pid)
+
+        return recovered
+
+    @contextlib.contextmanager
+    def locked(self, stripe):
+        """Return a context manager holding the lock of a stripe, recording the process holding it."""
+        with self._locks[stripe]:
+            self._holders[stripe] = os.getpid()
+
+            try:
+                yield
+            finally:
+                self._holders[stripe] = 0
+
+    def locate(self, key):
+        """Return a key as bytes, along with its hash, the set it belongs in and the lock guarding that set."""
+        if not isinstance(key, bytes):
+            key = str(key).encode('utf-8')
+
+        # Hashes of 0 mark empty slots
+        digest = struct.unpack('<Q', hashlib.blake2b(key, digest_size=8).digest())[0] or 1
+        index = digest % self.sets
+
+        return key, digest, index, index % len(self._locks)
+
+    def offset(self, index, way):
+        """Return the offset of a slot."""
+        return (index * self.ways + way) * self.slot_size
+
+    def find(self, key, digest, index, stripe, now):
+        """Return the offset of the slot holding a key, or None if it isn't cached.
+
+        Entries which expired are removed along the way.
+        """
+        for way in range(0, self.ways):
+            offset = self.offset(index, way)
+            stored, expires, used, length, size = self.HEADER.unpack_from(self._map, offset)
+
+            if stored != digest:
+                continue
+
+            start = offset + self.HEADER.size
+            if self._map[start:start + length] != key:
+                continue
+
+            if expires and expires <= now:
+                self.HEADER.pack_into(self._map, offset, 0, 0, 0, 0, 0)
+                self.count(stripe, 'expirations')
+                return None
+
+            return offset
+
+        return None
+
+    def evict(self, index, stripe):
+        """Return the offset of a slot in a set to store a new entry in, evicting an entry if needed."""
+        now = time.time()
+        victim, oldest = None, None
+
+        for way in range(0, self.ways):
+            offset = self.offset(index, way)
+            stored, expires, used, length, size = self.HEADER.unpack_from(self._map, offset)
+
+            # Empty slots and slots holding expired entries are free
+            if not stored or (expires and expires <= now):
+                return offset
+
+            if oldest is None or used < oldest:
+                victim, oldest = offset, used
+
+        self.count(stripe, 'evictions')
+
+        return victim
+
+    def count(self, stripe, metric):
+        """Increment a counter of a lock stripe, whose lock has to be held."""
+        self._counters[stripe * len(self.METRICS) + self.METRICS.index(metric)] += 1
+
+    def __init__(self, size=67108864, slot_size=1024, ways=8, stripes=64, ttl=None):
+        """Create a cache of roughly `size` bytes, keeping entries for `ttl` seconds by default."""
+        if slot_size <= self.HEADER.size:
+            raise Exception('Cache slots should be larger than %i bytes' % self.HEADER.size)
+
+        self._slot_size = slot_size
+        self._ways = ways
+        self._sets = max(1, size // (slot_size * ways))
+        self._ttl = ttl
+
+        # Anonymous mappings are shared with forked processes, and only take up memory once they're written to
+        self._map = mmap.mmap(-1, self.sets * self.ways * self.slot_size)
+        self._locks = [multiprocessing.Lock() for i in range(0, min(stripes, self.sets))]
+        self._counters = multiprocessing.RawArray('Q', len(self._locks) * len(self.METRICS))
+        self._holders = multiprocessing.RawArray('i', len(self._locks))
+
+        logger.debug('Shared cache of %i sets of %i slots of %i bytes initialized', self.sets, self.ways, slot_size)
@@ -0,0 +1,321 @@
+"""Codec module."""
+import zlib
+import logging
+import msgpack
+import threading
+import collections
+from nite.util import stable_hash
+
+try:
+    import zstandard as zstd
+except ImportError:
+    zstd = None
+
+try:
+    import lz4.frame as lz4
+except ImportError:
+    lz4 = None
+
+
+logger = logging.getLogger(__name__)
+
+
+class ZlibCodec:
+
+    """This class compresses data using zlib, which is always available."""
+
+    name = 'zlib'
+
+    def compress(self, data, dictionary=None):
+        """Compress data, optionally using a dictionary."""
+        compressor = zlib.compressobj(self.level, **({'zdict': dictionary} if dictionary else {}))
+        return compressor.compress(data) + compressor.flush()
+
+    def decompress(self, data, dictionary=None):
+        """Decompress data, optionally using a dictionary."""
+        decompressor = zlib.decompressobj(**({'zdict': dictionary} if dictionary else {}))
+        return decompressor.decompress(data) + decompressor.flush()
+
+    def __init__(self, level=None):
+        """Constructor."""
+        self.level = 6 if level is None else level
+
+
+class ZstdCodec:
+
+    """This class compresses data using zstandard, if it is installed.
+
+    Compressors and decompressors can't be used by several threads at once,
+    so every thread creates its own, once per dictionary.
+    """
+
+    name = 'zstd'
+
+    def compress(self, data, dictionary=None):
+        """Compress data, optionally using a dictionary."""
+        compressors = getattr(self._local, 'compressors', None)
+        if compressors is None:
+            compressors = self._local.compressors = {}
+
+        if dictionary not in compressors:
+            dict_data = zstd.ZstdCompressionDict(dictionary) if dictionary else None
+            compressors[dictionary] = zstd.ZstdCompressor(level=self.level, dict_data=dict_data)
+
+        return compressors[dictionary].compress(data)
+
+    def decompress(self, data, dictionary=None):
+        """Decompress data, optionally using a dictionary."""
+        decompressors = getattr(self._local, 'decompressors', None)
+        if decompressors is None:
+            decompressors = self._local.decompressors = {}
+
+        if dictionary not in decompressors:
+            dict_data = zstd.ZstdCompressionDict(dictionary) if dictionary else None
+            decompressors[dictionary] = zstd.ZstdDecompressor(dict_data=dict_data)
+
+        return decompressors[dictionary].decompress(data)
+
+    def __init__(self, level=None):
+        """Constructor."""
+        self.level = 3 if level is None else level
+        self._local = threading.local()
+
+
+class Lz4Codec:
+
+    """This class compresses data using LZ4 frames, if lz4 is installed.
+
+    LZ4 frames don't support dictionaries, so dictionaries are ignored.
+    """
+
+    name = 'lz4'
+
+    def compress(self, data, dictionary=None):
+        """Compress data."""
+        return lz4.compress(data, compression_level=self.level)
+
+    def decompress(self, data, dictionary=None):
+        """Decompress data."""
+        return lz4.decompress(data)
+
+    def __init__(self, level=None):
+        """Constructor."""
+        self.level = 0 if level is None else level
+
+
+def available_codecs():
+    """Return a dict containing the classes of all codecs which can be used, by name."""
+    codecs = {ZlibCodec.name: ZlibCodec}
+
+    if zstd is not None:
+        codecs[ZstdCodec.name] = ZstdCodec
+
+    if lz4 is not None:
+        codecs[Lz4Codec.name] = Lz4Codec
+
+    return codecs
+
+
+def create_codec(name, level=None):
+    """Initialize and return a codec by its name."""
+    codecs = available_codecs()
+
+    if name not in codecs:
+        raise Exception('The codec "%s" is not available!' % name)
+
+    return codecs[name](level=level)
+
+
+def train_dictionary(samples, size=16384, codec='zlib'):
+    """Train and return a compression dictionary of at most `size` bytes from a list of sample payloads.
+
+    zstd dictionaries are trained using zstd itself. For other codecs the
+    dictionary is made up of the byte sequences occurring in most samples,
+    most common last, since zlib favours data at the end of a dictionary.
+    """
+    if codec == ZstdCodec.name and zstd is not None:
+        return zstd.train_dictionary(size, list(samples)).as_bytes()
+
+    chunk = 8
+    counts = collections.Counter()
+
+    for sample in samples:
+        counts.update(set(sample[i:i + chunk] for i in range(0, len(sample) - chunk + 1)))
+
+    dictionary = b''
+    for sequence, count in counts.most_common():
+        if count < 2 or len(dictionary) + chunk > size:
+            break
+
+        dictionary = sequence + dictionary
+
+    return dictionary
+
+
+class Compressor:
+
+    """This class compresses message bodies which are large enough to benefit from it.
+
+    Bodies smaller than `threshold` bytes, and bodies which don't get any
+    smaller, are sent as-is. Event types with a dictionary are compressed
+    using that dictionary, which helps a lot for small, repetitive payloads.
+    """
+
+    @property
+    def codec(self):
+        """Return the codec used to compress, or None if compression is disabled."""
+        return self._codec
+
+    @codec.setter
+    def codec(self, value):
+        """Set the codec used to compress, or None to disable compression."""
+        self._codec = value
+
+    @property
+    def threshold(self):
+        """Return the minimal body size in bytes to compress."""
+        return self._threshold
+
+    @threshold.setter
+    def threshold(self, value):
+        """Set the minimal body size in bytes to compress."""
+        self._threshold = value
+
+    @property
+    def dictionaries(self):
+        """Return compression dictionaries by event type."""
+        return self._dictionaries
+
+    @dictionaries.setter
+    def dictionaries(self, value):
+        """Set compression dictionaries by event type."""
+        self._dictionaries = value
+
+    def add_dictionary(self, event, dictionary):
+        """Use a dictionary to compress events of a type.
+
+        Dictionaries are identified by a hash of their contents, so consumers
+        can tell whether they have the same dictionary as the producer.
+        """
+        self.dictionaries[event] = dictionary
+        self._dictionary_ids[event] = '%016x' % stable_hash(dictionary)
+
+    def compress(self, event, body):
+        """Compress the body of a message containing an event.
+
+        Returns a tuple containing the (possibly) compressed body, the content
+        encoding used or None, and the identifier of the dictionary used or
+        None.
+        """
+        if self.codec is None or len(body) < self.threshold:
+            return body, None, None
+
+        dictionary = self.dictionaries.get(event)
+        compressed = self.codec.compress(body, dictionary)
+
+        if len(compressed) >= len(body):
+            return body, None, None
+
+        return compressed, self.codec.name, self._dictionary_ids.get(event)
+
+    def decompress(self, event, body, encoding, dictionary_id=None):
+        """Decompress the body of a message, using the encoding and dictionary it was compressed with."""
+        if not encoding:
+            return body
+
+        if encoding not in self._decoders:
+            self._decoders[encoding] = create_codec(encoding)
+
+        dictionary = None
+        if dictionary_id is not None:
+            if self._dictionary_ids.get(event) != dictionary_id:
+                raise Exception('The dictionary "%s" for "%s" is not available!' % (dictionary_id, event))
+
+            dictionary = self.dictionaries[event]
+
+        return self._decoders[encoding].decompress(body, dictionary)
+
+    def __init__(self, codec=None, threshold=1024, level=None, dictionaries=None):
+        """Constructor.
+
+        `dictionaries` maps event types onto paths of dictionary files.
+        """
+        self.codec = create_codec(codec, level) if codec else None
+        self.threshold = threshold
+        self.dictionaries = {}
+        self._dictionary_ids = {}
+        self._decoders = {}
+
+        for event, path in (dictionaries or {}).items():
+            with open(path, 'rb') as handle:
+                self.add_dictionary(event, handle.read())
+
+        if self.codec is not None:
+            self._decoders[self.codec.name] = self.codec
+
+
+class EnvelopeReader:
+
+    """This class reads the envelope of serialized events without unserializing their data.
+
+    Serialized events are maps containing the name of the `event` and its
+    `data`. Rather than unserializing all of it, the envelope reader returns
+    a memoryview of the still serialized data, which can be unserialized
+    only if and when it is needed.
+    """
+
+    def read(self, body, event=None):
+        """Return the event name and a memoryview of the serialized data of a serialized event.
+
+        If the name of the `event` is known up front, events serialized by
+        `BaseEvent.dump()` are recognized by their prefix, without parsing
+        anything. Anything else is walked with a reusable unpacker, which
+        skips over the data rather than unserializing it.
+        """
+        view = memoryview(body)
+
+        if event is not None:
+            if event not in self._prefixes:
+                self._prefixes[event] = b'\x82' + msgpack.packb('event') + msgpack.packb(event) + msgpack.packb('data')
+
+            prefix = self._prefixes[event]
+            if view[:len(prefix)] == prefix:
+                return event, view[len(prefix):]
+
+        unpacker = self._unpacker
+        base = unpacker.tell()
+        unpacker.feed(view)
+        start = end = None
+
+        try:
+            for i in range(0, unpacker.read_map_header()):
+                key = unpacker.unpack()
+
+                if key == 'data':
+                    start = unpacker.tell() - base
+                    unpacker.skip()
+                    end = unpacker.tell() - base
+                elif key == 'event':
+                    event = unpacker.unpack()
+                else:
+                    unpacker.skip()
+        except Exception:
+            # Whatever is left in the buffer would corrupt the next envelope
+            self._unpacker = self.create_unpacker()
+            raise
+
+        return event, view[start:end]
+
+    def create_unpacker(self):
+        """Create and return an unpacker for envelopes."""
+        return msgpack.Unpacker(raw=False, strict_map_key=False, max_buffer_size=0)
+
+    def __init__(self):
+        """Constructor."""
+        self._unpacker = self.create_unpacker()
+        self._prefixes = {}
+
+
+def unpack(data):
+    """Unserialize data, which may be any bytes-like object."""
+    return msgpack.unpackb(data, raw=False, strict_map_key=False)
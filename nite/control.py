@@ -0,0 +1,277 @@
+"""Control module."""
+import os
+import json
+import time
+import socket
+import logging
+import threading
+import socketserver
+from nite.event import EventPriority
+from nite.profiler import handler_name
+from nite.filter import FilteredHandler
+
+
+logger = logging.getLogger(__name__)
+
+
+class ControlRequestHandler(socketserver.StreamRequestHandler):
+
+    """This class answers the requests sent over a single connection to the control socket."""
+
+    def handle(self):
+        """Answer requests, one per line, until the client disconnects."""
+        for line in self.rfile:
+            if not line.strip():
+                continue
+
+            response = self.server.control.execute(line)
+            self.wfile.write(json.dumps(response, default=str).encode('utf-8') + b'\n')
+
+
+class ControlServer:
+
+    """This class lets a running NITE instance be inspected and tuned through a Unix socket.
+
+    Clients send a JSON object per line, containing the `command` to run
+    along with its arguments, and get a JSON object per line in return,
+    containing either the `result` or an `error`. Commands are methods of
+    this class prefixed with `command_`, so `{"command": "set_workers",
+    "count": 8}` calls `command_set_workers(count=8)`.
+
+    Changes which worker processes can't pick up while they run are applied
+    by replacing them one by one in the background, without restarting
+    anything else. Commands making such changes return right away, and the
+    `status` command shows whether worker processes are still being
+    replaced.
+    """
+
+    @property
+    def core(self):
+        """Return the NITE core being controlled."""
+        return self._core
+
+    @property
+    def path(self):
+        """Return the path of the control socket."""
+        return self._path
+
+    def start(self):
+        """Start listening on the control socket in a background thread.
+
+        Raises an exception if another instance is listening on it already.
+        """
+        os.makedirs(os.path.dirname(self.path), mode=0o700, exist_ok=True)
+
+        # A socket left behind by an instance which didn't stop cleanly would be in the way, one which is still
+        # being listened on belongs to an instance which is still running
+        if os.path.exists(self.path):
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+                try:
+                    probe.connect(self.path)
+                except OSError:
+                    os.unlink(self.path)
+                else:
+                    raise Exception('Another instance is listening on the control socket "%s"' % self.path)
+
+        # Only the user running NITE may connect, from the moment the socket is bound
+        umask = os.umask(0o177)
+
+        try:
+            self._server = socketserver.ThreadingUnixStreamServer(self.path, ControlRequestHandler)
+        finally:
+            os.umask(umask)
+
+        self._server.daemon_threads = True
+        self._server.control = self
+
+        self._thread = threading.Thread(target=self._server.serve_forever, name='NITE control socket', daemon=True)
+        self._thread.start()
+
+        logger.info('Listening for control commands on "%s"', self.path)
+
+    def stop(self):
+        """Stop listening on the control socket."""
+        if self._server is None:
+            return
+
+        self._server.shutdown()
+        self._server.server_close()
+        self._server = None
+
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    def execute(self, request):
+        """Execute a request, as a line of JSON, and return the response."""
+        try:
+            arguments = json.loads(request)
+            command = getattr(self, 'command_' + str(arguments.pop('command', '')), None)
+
+            if command is None:
+                raise Exception('Unknown command, send {"command": "help"} for a list of commands')
+
+            return {'result': command(**arguments)}
+        except Exception as e:
+            logger.warning('Control request failed: %s', e)
+            return {'error': str(e)}
+
+    def command_help(self):
+        """List available commands."""
+        return {
+            name[len('command_'):]: getattr(self, name).__doc__.split('\n')[0]
+            for name in dir(self) if name.startswith('command_')
+        }
+
+    def command_status(self):
+        """Summarize what this instance is up to."""
+        workers = self.command_workers()
+
+        return {
+            'node': self.core.queue.node_identifier,
+            'pid': os.getpid(),
+            'uptime': time.time() - self._started,
+            'workers': len(workers),
+            'alive': sum(1 for worker in workers if worker['alive']),
+            'in_flight': sum(1 for worker in workers if worker['event'] is not None),
+            'stuck': dict(self.core.workers.stuck),
+            'restarting': self.core.workers.restarting,
+            'profiling': self.core.workers.profiling,
+            'log_level': logging.getLevelName(logging.root.level),
+        }
+
+    def command_workers(self):
+        """List worker processes, along with the event they're handling."""
+        now = time.time()
+        workers = []
+
+        for process in list(self.core.workers.processes):
+            status = process.status
+            workers.append({
+                'name': process.name,
+                'pid': process.pid,
+                'alive': process.is_alive(),
+                'events': process.events,
+                'event': status.event,
+                'busy_for': now - status.busy_since if status.busy_since else None,
+                'heartbeat_age': now - status.heartbeat,
+            })
+
+        return workers
+
+    def command_handlers(self):
+        """List registered handlers by event, in the order they're executed."""
+        handlers = {}
+
+        for event, priorities in self.core.events.handlers.items():
+            for priority, registered in sorted(priorities.items()):
+                for handler in registered:
+                    handlers.setdefault(event, []).append({
+                        'priority': EventPriority(priority).name,
+                        'handler': handler_name(handler),
+                        'filters': {name: sorted(values, key=repr) for name, values in handler.filters.items()}
+                        if isinstance(handler, FilteredHandler) else None,
+                    })
+
+        return handlers
+
+    def command_queues(self):
+        """List the depths of the queues worker processes consume from."""
+        return self.core.queue.depths()
+
+    def command_pool(self):
+        """Show publish channel pool utilisation, if there is a pool."""
+        pool = getattr(self.core.queue, 'pool', None)
+
+        return pool.stats if pool is not None else None
+
+    def command_cache(self):
+        """Show shared cache metrics."""
+        return self.core.cache.stats
+
+    def command_pressure(self):
+        """Show the backpressure level and what it is made up of, if backpressure is enabled."""
+        backpressure = self.core.queue.backpressure
+
+        return backpressure.stats if backpressure is not None else None
+
+    def command_set_workers(self, count):
+        """Change the amount of worker processes in the default pool."""
+        if int(count) < 1:
+            raise Exception('There has to be at least one worker process')
+
+        self.core.workers.resize(int(count), wait=False)
+
+        return self.command_status()
+
+    def command_set_concurrency(self, event, count=None):
+        """Change the maximum amount of workers per pool consuming an event type, or lift it."""
+        self.core.workers.limit(event, int(count) if count is not None else None, wait=False)
+
+        return dict(self.core.workers.concurrency)
+
+    def command_set_prefetch(self, count, event=None):
+        """Change the amount of unacked messages per consumer, for all events or a single event type."""
+        config = self.core.queue.config
+
+        if 'prefetch' not in config:
+            raise Exception('This queue connector doesn\'t support prefetch limits')
+
+        if event is not None and config['topology'] == 'consolidated':
+            raise Exception('Prefetch limits per event type can\'t be used with the consolidated topology')
+
+        if event is None:
+            config['prefetch'] = int(count)
+        else:
+            config['event_prefetch'][event] = int(count)
+
+        # Worker processes only set prefetch limits while connecting
+        self.core.workers.restart(wait=False)
+
+        return {'prefetch': config['prefetch'], 'event_prefetch': config['event_prefetch']}
+
+    def command_set_log_level(self, level, logger=None):
+        """Change the log level, of a single logger of the main process or of every process."""
+        value = logging.getLevelName(str(level).upper())
+
+        if not isinstance(value, int):
+            raise Exception('Unknown log level "%s"' % level)
+
+        if logger is not None:
+            logging.getLogger(logger).setLevel(value)
+        else:
+            logging.root.setLevel(value)
+            self.core.workers.log_level.value = value
+
+        return logging.getLevelName(value)
+
+    def command_restart(self):
+        """Replace worker processes one by one, in the background."""
+        self.core.workers.restart(wait=False)
+
+        return self.command_status()
+
+    def command_profile(self):
+        """Start profiling worker processes, or stop profiling them and save the profile."""
+        path = self.core.workers.toggle_profiling()
+
+        return {'profiling': self.core.workers.profiling, 'path': path}
+
+    def __init__(self, core, path='/tmp/nite/control.sock'):
+        """Constructor."""
+        self._core = core
+        self._path = path
+        self._server = None
+        self._thread = None
+        self._started = time.time()
+
+
+def send_command(path, command, **arguments):
+    """Send a command to the control socket of a running NITE instance and return the response."""
+    arguments['command'] = command
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.connect(path)
+        connection.sendall(json.dumps(arguments).encode('utf-8') + b'\n')
+
+        with connection.makefile('rb') as response:
+            return json.loads(response.readline())
@@ -0,0 +1,110 @@
+"""Dispatch module."""
+import collections
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+class WeightedDispatcher:
+
+    """This class buffers items in lanes and hands them out in weighted round-robin order.
+
+    Lanes are identified by arbitrary hashable keys. Every time an item is
+    requested, the non-empty lane with the most accumulated credit wins and
+    pays back the combined weight of all competing lanes (smooth weighted
+    round-robin). A lane with twice the weight of another is served twice as
+    often while both are backlogged, but no backlogged lane is ever starved.
+    """
+
+    @property
+    def lanes(self):
+        """Return lanes."""
+        return self._lanes
+
+    @lanes.setter
+    def lanes(self, value):
+        """Set lanes."""
+        self._lanes = value
+
+    @property
+    def weights(self):
+        """Return lane weights."""
+        return self._weights
+
+    @weights.setter
+    def weights(self, value):
+        """Set lane weights."""
+        self._weights = value
+
+    @property
+    def default_weight(self):
+        """Return the weight of lanes without an explicit weight."""
+        return self._default_weight
+
+    @default_weight.setter
+    def default_weight(self, value):
+        """Set the weight of lanes without an explicit weight."""
+        self._default_weight = value
+
+    def weight(self, key):
+        """Return the weight of a lane."""
+        return self.weights.get(key, self.default_weight)
+
+    def put(self, key, item):
+        """Buffer an item in a lane."""
+        if key not in self.lanes:
+            self.lanes[key] = collections.deque()
+            self._credit[key] = 0
+
+        self.lanes[key].append(item)
+        self._size += 1
+
+    def pop(self):
+        """Remove and return the next item, or None if all lanes are empty."""
+        if not self._size:
+            return None
+
+        total = 0
+        selected = None
+
+        for key, lane in self.lanes.items():
+            if not lane:
+                continue
+
+            weight = self.weight(key)
+            total += weight
+            self._credit[key] += weight
+
+            if selected is None or self._credit[key] > self._credit[selected]:
+                selected = key
+
+        self._credit[selected] -= total
+        self._size -= 1
+
+        item = self.lanes[selected].popleft()
+
+        # Forget about empty lanes, so that idle lanes don't hoard credit
+        if not self.lanes[selected]:
+            del self.lanes[selected]
+            del self._credit[selected]
+
+        return item
+
+    def clear(self):
+        """Remove all buffered items."""
+        self.lanes.clear()
+        self._credit.clear()
+        self._size = 0
+
+    def __len__(self):
+        """Return the amount of buffered items."""
+        return self._size
+
+    def __init__(self, weights=None, default_weight=1):
+        """Constructor."""
+        self.lanes = collections.OrderedDict()
+        self.weights = weights or {}
+        self.default_weight = default_weight
+        self._credit = {}
+        self._size = 0
@@ -1,9 +1,18 @@
 """Event module."""
 import uuid
+import time
+import signal
 import inspect
 import logging
+import threading
+import contextlib
 from enum import Enum
 from datetime import datetime
+from nite.timer import TimerScheduler, CronSchedule
+from nite.topic import TopicTrie
+from nite.filter import FilteredHandler, HandlerIndex
+from nite.profiler import handler_name
+from nite.trace import UNTRACED
 
 
 logger = logging.getLogger(__name__)
@@ -29,6 +38,31 @@ class EventPriority(Enum):
     LOWEST = 5
 
 
+class MessagePriority(Enum):
+
+    """Enum for determining how urgently a published event should be delivered.
+
+    Unlike `EventPriority`, which orders the handlers of a single event, this
+    lets urgent events overtake backlogs of less urgent ones.
+    """
+
+    BULK = 0
+    NORMAL = 1
+    HIGH = 2
+    URGENT = 3
+
+
+class HandlerTimeout(BaseException):
+
+    """Raised inside the handlers of an event which took longer to handle than the timeout of its type.
+
+    Like `KeyboardInterrupt`, it isn't an `Exception`, so that handlers
+    catching every exception don't keep running past their timeout.
+    """
+
+    pass
+
+
 class EventManager:
 
     """This class manages event dispatching and handling."""
@@ -43,6 +77,91 @@ class EventManager:
         """Set event handlers."""
         self._handlers = value
 
+    @property
+    def topics(self):
+        """Return the trie matching event names to the names and patterns handlers are registered for."""
+        return self._topics
+
+    @topics.setter
+    def topics(self, value):
+        """Set the trie matching event names to the names and patterns handlers are registered for."""
+        self._topics = value
+
+    @property
+    def timers(self):
+        """Return the timer scheduler used for delayed and recurring events."""
+        return self._timers
+
+    @timers.setter
+    def timers(self, value):
+        """Set the timer scheduler used for delayed and recurring events."""
+        self._timers = value
+
+    @property
+    def timeout(self):
+        """Return the amount of seconds events may take to handle, unless their type has a timeout of its own."""
+        return self._timeout
+
+    @timeout.setter
+    def timeout(self, value):
+        """Set the amount of seconds events may take to handle, unless their type has a timeout of its own."""
+        self._timeout = value
+
+    @property
+    def timeouts(self):
+        """Return a dict mapping event types onto the amount of seconds they may take to handle."""
+        return self._timeouts
+
+    @timeouts.setter
+    def timeouts(self, value):
+        """Set a dict mapping event types onto the amount of seconds they may take to handle."""
+        self._timeouts = value
+
+    @property
+    def status(self):
+        """Return the object notified when handling starts and ends, or None."""
+        return self._status
+
+    @status.setter
+    def status(self, value):
+        """Set the object notified when handling starts and ends, or None.
+
+        Its `begin()` method is called with the name of the event being
+        handled beforehand, and its `end()` method afterwards.
+        """
+        self._status = value
+
+    @property
+    def profiler(self):
+        """Return the profiler measuring handler calls, or None."""
+        return self._profiler
+
+    @profiler.setter
+    def profiler(self, value):
+        """Set the profiler measuring handler calls, or None."""
+        self._profiler = value
+
+    @property
+    def tracer(self):
+        """Return the tracer recording handler calls as spans, or None."""
+        return self._tracer
+
+    @tracer.setter
+    def tracer(self, value):
+        """Set the tracer recording handler calls as spans, or None."""
+        self._tracer = value
+
+    @property
+    def pressure(self):
+        """Return the backpressure level of the queue, which is at least 1 while triggering events is held back.
+
+        Modules which produce events can use this to slow down by themselves
+        before being held back.
+        """
+        backpressure = self.queue.backpressure if self.queue is not None else None
+
+        return backpressure.level if backpressure is not None else 0.0
+
     @property
     def queue(self):
         """Return queue manager."""
@@ -53,7 +172,7 @@ class EventManager:
         """Set queue manager."""
         self._queue = value
 
-    def register(self, event, handler, priority=None):
+    def register(self, event, handler, priority=None, filters=None):
         """Register a handler for an event with a certain priority.
 
         If the `event` passed is a class, the class name and module name
@@ -61,11 +180,21 @@ class EventManager:
         for. If `event`is not a class however (for instance: a string),
         the value itself will be used as the event name.
 
+        Event names may contain wildcards to register a handler for a whole
+        family of events, such as `myapp.events.*`. As with AMQP topics, `*`
+        matches exactly one dot-separated word and `#` matches zero or more.
+
         The `handler` should be a reference to a function or method to
         execute during the handling of an event. This handler will be
         called with a single parameter, namely the reconstructed event.
 
         `priority` should be one of the values of `EventPriority`.
+
+        `filters` may map event attributes onto a value, or a set of values,
+        to only call the handler for events with matching attributes, as in
+        `filters={'tenant': {'acme', 'initech'}}`. Filtered handlers are
+        indexed by attribute value, so handlers which don't match an event
+        cost next to nothing.
         """
         # If event is a class, use its name as the event name, else use the value
         # of event itself.
@@ -85,11 +214,17 @@ class EventManager:
                 EventPriority.LOWEST.value: []
             }
 
+        if filters:
+            handler = FilteredHandler(handler, filters)
+
         # Add the handler to the collection of handlers
         self.handlers[event_name][priority.value].append(handler)
+        self.topics.add(event_name)
+        self._resolved = {}
         logger.debug('Registered a new event handler for "%s" with priority "%s"', event_name, priority)
 
-    def trigger(self, event, demographic=EventDemographic.GLOBAL_SINGLE, reply_to_event=None):
+    def trigger(self, event, demographic=EventDemographic.GLOBAL_SINGLE, reply_to_event=None, affinity=None,
+                priority=None, ttl=None, deadline=None, delay=None):
         """Trigger an event of type `event` against the chosen demographic.
 
         If `event` is not a dict and thus an instance of an event, it will be
@@ -108,31 +243,221 @@ class EventManager:
         If an event instance is passed as `reply_to_event`, the remote node
         will be notified of this and might be able to take special actions in
         the event of receiving a reply.
+
+        `affinity` can be any value identifying the entity an event is about,
+        such as a user ID. `GLOBAL_SINGLE` events sharing an affinity key will
+        be handled by the same worker, keeping per-entity caches warm.
+
+        `priority` should be one of the values of `MessagePriority`, and
+        defaults to `MessagePriority.NORMAL`.
+
+        Events which haven't been handled within `ttl` seconds, or by the time
+        `deadline` (a UNIX timestamp) has passed, are dropped without being
+        handled. If no `ttl` is passed, the `ttl` of the event class is used.
+
+        If a `delay` is passed, the queue will durably hold the event back for
+        that many seconds before delivering it. Use `trigger_after()` for
+        delays which don't have to survive a restart.
+
+        While the queue is saturated, the backpressure policy of the event
+        type decides whether this waits, raises a
+        `nite.pressure.BackpressureError` or sheds the event, in which case False is returned.
         """
         event_data = event if isinstance(event, dict) else event.dump()
 
+        # If no priority is set, default to normal.
+        if priority is None:
+            priority = MessagePriority.NORMAL
+
+        # If no TTL is set, default to the TTL of the event type.
+        if ttl is None and not isinstance(event, dict):
+            ttl = event.ttl
+
+        if ttl is not None:
+            deadline = min(deadline or float('inf'), time.time() + ttl)
+
         if demographic is EventDemographic.LOCAL:
+            if delay is not None:
+                raise Exception('Local events can\'t be delayed durably!')
+
             self.handle(event_data)
         else:
-            self.queue.publish(event_data, demographic, reply_to_event)
+            if self.queue.backpressure is not None and not self.queue.backpressure.admit(event_data['event']):
+                return False
+
+            self.queue.publish(event_data, demographic, reply_to_event, affinity=affinity, priority=priority,
+                               deadline=deadline, delay=delay)
+
+        return True
+
+    def trigger_after(self, delay, event, durable=False, **kwargs):
+        """Trigger an event after `delay` seconds.
+
+        Any extra keyword arguments are passed on to `trigger()`. If `event`
+        is callable (an event class, for instance), it will be called to
+        create the event when it is due.
+
+        Unless `durable` is set, the event is held back by a timer in the
+        current process, which is lost if the process stops. The `Timer`
+        returned can be used to cancel the event until it is due. Durable
+        delays are handed to the queue right away, and can't be cancelled.
+        """
+        if durable:
+            self.trigger(self.create_event(event), delay=max(0, delay), **kwargs)
+            return None
+
+        return self.timers.add(time.time() + delay, lambda: self.trigger(self.create_event(event), **kwargs))
+
+    def trigger_at(self, timestamp, event, durable=False, **kwargs):
+        """Trigger an event at UNIX timestamp `timestamp`.
+
+        See `trigger_after()` for details.
+        """
+        return self.trigger_after(timestamp - time.time(), event, durable=durable, **kwargs)
+
+    def schedule(self, recurrence, event, **kwargs):
+        """Trigger an event repeatedly and return the `Timer` responsible for it.
+
+        `recurrence` is either an interval in seconds or a crontab expression
+        such as `'*/5 * * * *'`, which is evaluated in UTC. If `event` is
+        callable (an event class, for instance), it will be called to create
+        a fresh event every time it is due.
+
+        Any extra keyword arguments are passed on to `trigger()`.
+        """
+        if isinstance(recurrence, str):
+            recurrence = CronSchedule(recurrence)
+            deadline = recurrence.next(time.time())
+        else:
+            deadline = time.time() + recurrence
+
+        return self.timers.add(deadline, lambda: self.trigger(self.create_event(event), **kwargs), recurrence)
+
+    def create_event(self, event):
+        """Return `event` itself, or the event created by calling it if it is callable."""
+        return event() if callable(event) else event
+
+    def resolve(self, event_name, subscriptions=None):
+        """Return a `HandlerIndex` of the handlers for an event, in the order they should be executed.
 
-    def handle(self, event):
-        """Handle the passed event."""
+        Handlers registered for the event name itself and for every pattern
+        matching it are merged, in descending priority. If a collection of
+        `subscriptions` (event names or patterns) is passed, only handlers
+        registered for those are included. Results are memoized.
+        """
+        key = (event_name, subscriptions)
+
+        try:
+            return self._resolved[key]
+        except KeyError:
+            pass
+
+        topics = [topic for topic in self.topics.match(event_name) if subscriptions is None or topic in subscriptions]
+        handlers = HandlerIndex([
+            handler
+            for priority in EventPriority
+            for topic in topics
+            for handler in self.handlers[topic][priority.value]
+        ])
+
+        self._resolved[key] = handlers
+        return handlers
+
+    def handle(self, event, subscriptions=None):
+        """Handle the passed event.
+
+        If a frozenset of `subscriptions` is passed, only the handlers
+        registered for those event names and patterns are executed. Queues
+        which receive an event once for every subscription matching it use
+        this to execute every handler exactly once.
+
+        If handling takes longer than the timeout of the event type, a
+        `HandlerTimeout` is raised inside the handler being executed.
+        """
         event_name = event.__class__.__module__ + '.' + event.__class__.__name__
-        if event_name not in self.handlers:
+        if event_name not in self.topics:
             # If this exception ever actually gets raised, something is seriously wrong.
             raise Exception('There are no handlers registered for the event "%s"' % event_name)
 
-        # Execute event listeners in descending priority.
-        for priority, handlers in self.handlers[event_name].items():
-            for handler in handlers:
-                handler(event)
+        # Events handled while handling another one, such as local events, are part of the outermost event
+        outermost = self.status is not None and not self._depth
+        if outermost:
+            self.status.begin(event_name)
+
+        self._depth += 1
+        try:
+            with self.time_limit(event_name, self.timeouts.get(event_name, self.timeout)):
+                # Execute event listeners in descending priority.
+                for handler in self.resolve(event_name, subscriptions).select(event):
+                    if self.profiler is None and self.tracer is None:
+                        handler(event)
+                    else:
+                        self.call(handler, event)
+        finally:
+            self._depth -= 1
+
+            if outermost:
+                self.status.end()
 
         return True
 
-    def __init__(self):
-        """Initialize the event manager."""
+    def call(self, handler, event):
+        """Call a handler with an event, through the profiler and inside a span of its own where needed."""
+        span = UNTRACED
+        current = self.tracer.current() if self.tracer is not None else None
+
+        # Naming handlers isn't free, so it's only done for spans which are recorded
+        if current is not None and current.sampled:
+            span = self.tracer.record('handler', {'handler': handler_name(handler)})
+
+        with span:
+            if self.profiler is None:
+                return handler(event)
+
+            return self.profiler.call(handler, event)
+
+    @contextlib.contextmanager
+    def time_limit(self, event_name, seconds):
+        """Return a context manager which raises a `HandlerTimeout` inside it once `seconds` have passed.
+
+        Time limits rely on SIGALRM, so they're only enforced in the main
+        thread, and nested time limits are covered by the outermost one.
+        """
+        if not seconds or threading.current_thread() is not threading.main_thread() or \
+                signal.getitimer(signal.ITIMER_REAL)[0]:
+            yield
+            return
+
+        def expire(signum, frame):
+            raise HandlerTimeout('Handling "%s" took longer than %.1fs' % (event_name, seconds))
+
+        previous = signal.signal(signal.SIGALRM, expire)
+        signal.setitimer(signal.ITIMER_REAL, seconds)
+
+        try:
+            yield
+        finally:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, previous)
+
+    def __init__(self, timeout=None, timeouts=None):
+        """Initialize the event manager.
+
+        `timeout` is the amount of seconds events may take to handle, and
+        `timeouts` maps event types onto timeouts of their own. Events
+        without a timeout may take as long as they like.
+        """
         self.handlers = {}
+        self.topics = TopicTrie()
+        self.timeout = timeout
+        self.timeouts = timeouts or {}
+        self.status = None
+        self.profiler = None
+        self.tracer = None
+        self.queue = None
+        self._resolved = {}
+        self._depth = 0
+        self.timers = TimerScheduler()
         logger.debug('Event manager initialized')
 
 
@@ -140,6 +465,9 @@ class BaseEvent:
 
     """This class serves as a basis for all NITE events."""
 
+    #: Amount of seconds after which unhandled events of this type are dropped, or None to never drop them.
+    ttl = None
+
     @property
     def uuid(self):
         """Return the UUID of this event."""
@@ -181,6 +509,8 @@ class BaseEvent:
         Feel free to override this method in a subclass.
 
         """
+        self.materialize()
+
         return {
             'event': self.__class__.__module__ + '.' + self.__class__.__name__,
             'data': self.__dict__
@@ -202,6 +532,41 @@ class BaseEvent:
 
         return event
 
+    @classmethod
+    def load_lazy(cls, loader):
+        """Create an event which is only populated once one of its attributes is accessed.
+
+        `loader` is called without arguments to get the data to populate the
+        event with, as passed to `load()`. If `load()` was overridden by a
+        subclass, the event is populated right away instead.
+        """
+        if cls.load.__func__ is not BaseEvent.load.__func__:
+            return cls.load(loader())
+
+        event = cls.__new__(cls)
+        event.__dict__['_loader'] = loader
+
+        return event
+
+    def materialize(self):
+        """Populate this event if it was loaded lazily and hasn't been populated yet."""
+        loader = self.__dict__.pop('_loader', None)
+
+        if loader is not None:
+            for key, value in loader().items():
+                # Attributes which were set after loading take precedence
+                if key not in self.__dict__:
+                    setattr(self, key, value)
+
+    def __getattr__(self, name):
+        """Populate a lazily loaded event when one of its missing attributes is accessed."""
+        if '_loader' not in self.__dict__:
+            raise AttributeError('%r object has no attribute %r' % (self.__class__.__name__, name))
+
+        self.materialize()
+
+        return getattr(self, name)
+
     def __init__(self):
         """Create and populate the event."""
         self._uuid = uuid.uuid4().hex
@@ -0,0 +1,120 @@
+"""Filter module."""
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+#: Placeholder for attributes an event doesn't have, which no filter matches.
+MISSING = object()
+
+
+def attribute(event, name):
+    """Return the value of an attribute of an event, or `MISSING` if it doesn't have it."""
+    try:
+        return getattr(event, name)
+    except AttributeError:
+        return MISSING
+
+
+class FilteredHandler:
+
+    """This class wraps an event handler which should only be called for events with certain attribute values.
+
+    Filters map attribute names onto either a single value the attribute
+    should be equal to, or a set, list or tuple of values it should be one
+    of. An event matches if all of its filters match.
+    """
+
+    @property
+    def handler(self):
+        """Return the wrapped handler."""
+        return self._handler
+
+    @property
+    def filters(self):
+        """Return a dict mapping attribute names onto frozensets of accepted values."""
+        return self._filters
+
+    def matches(self, event, skip=None):
+        """Return whether or not an event matches every filter, except the filter for the attribute `skip`."""
+        for name, values in self.filters.items():
+            if name == skip:
+                continue
+
+            try:
+                if attribute(event, name) not in values:
+                    return False
+            except TypeError:
+                # Unhashable values can't be equal to any of the (hashable) accepted values
+                return False
+
+        return True
+
+    def __call__(self, event):
+        """Call the wrapped handler if an event matches."""
+        if self.matches(event):
+            return self.handler(event)
+
+    def __init__(self, handler, filters):
+        """Constructor."""
+        if not filters:
+            raise Exception('A filtered handler needs at least one filter')
+
+        self._handler = handler
+        self._filters = {
+            name: frozenset(value) if isinstance(value, (set, frozenset, list, tuple)) else frozenset([value])
+            for name, value in filters.items()
+        }
+
+
+class HandlerIndex:
+
+    """This class selects the handlers to execute for an event, in order, without checking every handler.
+
+    Filtered handlers are indexed by the accepted values of their most
+    selective filter. Selecting handlers for an event takes a single lookup
+    per indexed attribute, after which only the remaining filters of the
+    handlers found need to be checked.
+    """
+
+    def select(self, event):
+        """Return the handlers to execute for an event, in order."""
+        if not self._index:
+            return self._handlers
+
+        selected = list(self._unfiltered)
+
+        for name, values in self._index.items():
+            try:
+                candidates = values.get(attribute(event, name), ())
+            except TypeError:
+                continue
+
+            for position, handler in candidates:
+                if handler.matches(event, skip=name):
+                    selected.append((position, handler.handler))
+
+        selected.sort(key=lambda entry: entry[0])
+
+        return [handler for position, handler in selected]
+
+    def __len__(self):
+        """Return the amount of indexed handlers."""
+        return self._size
+
+    def __init__(self, handlers):
+        """Index a list of handlers, in the order they should be executed."""
+        self._unfiltered = []
+        self._index = {}
+        self._size = len(handlers)
+
+        for position, handler in enumerate(handlers):
+            if not isinstance(handler, FilteredHandler):
+                self._unfiltered.append((position, handler))
+                continue
+
+            name = min(handler.filters, key=lambda name: (len(handler.filters[name]), name))
+            for value in handler.filters[name]:
+                self._index.setdefault(name, {}).setdefault(value, []).append((position, handler))
+
+        self._handlers = [handler for position, handler in self._unfiltered]
@@ -0,0 +1,229 @@
+"""Pressure module."""
+import logging
+import threading
+import collections
+
+
+logger = logging.getLogger(__name__)
+
+
+class BackpressureError(Exception):
+
+    """This exception is raised when an event can't be triggered because the queue is saturated."""
+
+    pass
+
+
+class Backpressure:
+
+    """This class keeps track of how hard the queue pushes back on publishing, and decides what to do about it.
+
+    The pressure level is the highest of three ratios: 1 while the broker
+    blocks a connection through flow control, the amount of outstanding
+    publishes (unconfirmed or spooled) over `max_outstanding`, and the depth
+    of the deepest queue over `max_depth`. Either limit can be disabled by
+    setting it to None.
+
+    Once the level reaches 1, triggering events is held back until it drops
+    below `resume_level` again, according to the policy of the event type:
+    `block` waits for at most `block_timeout` seconds before raising a
+    `BackpressureError`, `fail` raises one right away and `shed` drops the
+    event. Event types without a policy of their own follow `policy`.
+    """
+
+    POLICIES = ('block', 'fail', 'shed')
+
+    @property
+    def policy(self):
+        """Return the policy of event types without a policy of their own."""
+        return self._policy
+
+    @property
+    def policies(self):
+        """Return a dict mapping event types onto their policies."""
+        return self._policies
+
+    @property
+    def max_outstanding(self):
+        """Return the amount of outstanding publishes at which the queue is saturated, or None."""
+        return self._max_outstanding
+
+    @property
+    def max_depth(self):
+        """Return the queue depth at which the queue is saturated, or None."""
+        return self._max_depth
+
+    @property
+    def interval(self):
+        """Return the amount of seconds between measurements of outstanding publishes and flow control."""
+        return self._interval
+
+    @property
+    def depth_interval(self):
+        """Return the amount of seconds between measurements of queue depths."""
+        return self._depth_interval
+
+    @property
+    def level(self):
+        """Return the pressure level, which is at least 1 if the queue is saturated."""
+        return self._level
+
+    @property
+    def saturated(self):
+        """Return whether or not triggering events is being held back."""
+        return self._saturated
+
+    @property
+    def blocked(self):
+        """Return a set containing the sources which are blocked by the broker."""
+        with self._condition:
+            return set(self._blocked)
+
+    @property
+    def stats(self):
+        """Return a dict containing the pressure level, what it is made up of and what was held back so far."""
+        with self._condition:
+            stats = dict(self._stats)
+            stats.update({
+                'level': self.level,
+                'saturated': self.saturated,
+                'blocked': bool(self._blocked),
+                'outstanding': self._outstanding,
+                'depth': self._depth,
+                'shed_by_event': dict(self._shed),
+            })
+
+        return stats
+
+    def update(self, outstanding=None, depth=None):
+        """Update what the pressure level is made up of, and wake up triggers waiting for it to drop."""
+        with self._condition:
+            if outstanding is not None:
+                self._outstanding = outstanding
+
+            if depth is not None:
+                self._depth = depth
+
+            level = 1.0 if self._blocked else 0.0
+
+            if self.max_outstanding:
+                level = max(level, float(self._outstanding) / self.max_outstanding)
+
+            if self.max_depth:
+                level = max(level, float(self._depth) / self.max_depth)
+
+            self._level = level
+
+            if not self._saturated and level >= 1:
+                self._saturated = True
+                logger.warning('The queue is saturated (pressure %.2f), holding back events', level)
+            elif self._saturated and level < self._resume_level:
+                self._saturated = False
+                logger.info('The queue caught up (pressure %.2f), no longer holding back events', level)
+                self._condition.notify_all()
+
+    def block(self, source, reason=None):
+        """Mark a source, such as a connection, as blocked by the broker."""
+        with self._condition:
+            self._blocked.add(source)
+            self._stats['flow_control'] += 1
+
+        logger.warning('The broker blocked publishing: %s', reason)
+        self.update()
+
+    def unblock(self, source):
+        """Mark a source as no longer blocked by the broker."""
+        with self._condition:
+            self._blocked.discard(source)
+
+        self.update()
+
+    def admit(self, event_name):
+        """Return whether an event may be triggered, waiting for the pressure to drop if its policy says so.
+
+        Raises a `BackpressureError` if it may not, unless its policy is to
+        shed the event.
+        """
+        # This is called for every event triggered, so don't do anything unless the queue is saturated
+        if not self._saturated:
+            return True
+
+        policy = self.policies.get(event_name, self.policy)
+
+        with self._condition:
+            if policy == 'block':
+                self._stats['waited'] += 1
+                if self._condition.wait_for(lambda: not self._saturated, self._block_timeout):
+                    return True
+
+                self._stats['failed'] += 1
+                raise BackpressureError('The queue stayed saturated for %.1fs, not triggering "%s"' %
+                                        (self._block_timeout, event_name))
+
+            if policy == 'shed':
+                self._stats['shed'] += 1
+                self._shed[event_name] += 1
+                return False
+
+            self._stats['failed'] += 1
+
+        raise BackpressureError('The queue is saturated, not triggering "%s"' % event_name)
+
+    def start(self, probe):
+        """Call `probe` every `interval` seconds in a background thread, to keep the pressure level up to date.
+
+        Triggers waiting for the pressure to drop may hold up timers, so the
+        pressure level isn't kept up to date through those.
+        """
+        def monitor():
+            while not self._stopped.wait(self.interval):
+                try:
+                    probe()
+                except Exception:
+                    logger.warning('Failed to measure backpressure', exc_info=True)
+
+        self._stopped.clear()
+        threading.Thread(target=monitor, name='NITE backpressure monitor', daemon=True).start()
+
+    def stop(self):
+        """Stop measuring the pressure level, and release triggers waiting for it to drop."""
+        self._stopped.set()
+
+        with self._condition:
+            self._blocked.clear()
+
+        self.update(outstanding=0, depth=0)
+
+    def reset(self):
+        """Forget the pressure level and what it is made up of, such as in a process forked off the one measuring it.
+
+        Nothing keeps the pressure level up to date in forked processes, so
+        they would otherwise keep holding back events for as long as they
+        live if they were forked while the queue was saturated.
+        """
+        self._condition = threading.Condition()
+        self._stopped = threading.Event()
+        self._blocked = set()
+        self._outstanding = 0
+        self._depth = 0
+        self._level = 0.0
+        self._saturated = False
+        self._shed = collections.Counter()
+        self._stats = {'flow_control': 0, 'waited': 0, 'failed': 0, 'shed': 0}
+
+    def __init__(self, policy='block', policies=None, max_outstanding=10000, max_depth=None, resume_level=0.8,
+                 block_timeout=30, interval=0.5, depth_interval=5):
+        """Constructor."""
+        for value in [policy] + list((policies or {}).values()):
+            if value not in self.POLICIES:
+                raise Exception('Unknown backpressure policy "%s"' % value)
+
+        self._policy = policy
+        self._policies = policies or {}
+        self._max_outstanding = max_outstanding
+        self._max_depth = max_depth
+        self._resume_level = resume_level
+        self._block_timeout = block_timeout
+        self._interval = interval
+        self._depth_interval = depth_interval
+        self.reset()
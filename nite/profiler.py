@@ -0,0 +1,204 @@
+"""Profiler module."""
+import os
+import json
+import time
+import signal
+import logging
+import collections
+from nite.filter import FilteredHandler
+
+
+logger = logging.getLogger(__name__)
+
+#: Name samples taken outside of any handler are attributed to.
+OUTSIDE = '(outside handlers)'
+
+
+def unwrap(handler):
+    """Return the function executed when a handler is called, or None if there is none."""
+    if isinstance(handler, FilteredHandler):
+        handler = handler.handler
+
+    # Unwrap partials and bound methods, and fall back to the __call__ of callable objects
+    handler = getattr(handler, 'func', handler)
+    handler = getattr(handler, '__func__', handler)
+
+    if not hasattr(handler, '__code__'):
+        handler = getattr(type(handler), '__call__', None)
+
+    return handler if hasattr(handler, '__code__') else None
+
+
+def handler_name(handler):
+    """Return the name of a handler, as used in profiles."""
+    function = unwrap(handler)
+
+    return '%s.%s' % (function.__module__, function.__qualname__) if function is not None else repr(handler)
+
+
+def handler_codes(events):
+    """Return a dict mapping the code objects of the handlers registered with an event manager onto their names."""
+    codes = {}
+
+    for priorities in events.handlers.values():
+        for handlers in priorities.values():
+            for handler in handlers:
+                function = unwrap(handler)
+
+                if function is not None:
+                    codes[function.__code__] = handler_name(function)
+
+    return codes
+
+
+def merge(profiles):
+    """Merge profiles dumped by several profilers into one."""
+    merged = {'stacks': collections.Counter(), 'cpu': collections.Counter(), 'wall': collections.Counter(),
+              'calls': collections.Counter(), 'interval': None, 'duration': 0}
+
+    for profile in profiles:
+        merged['interval'] = profile['interval']
+        merged['duration'] = max(merged['duration'], profile['duration'])
+
+        for section in ('stacks', 'cpu', 'wall', 'calls'):
+            merged[section].update(profile[section])
+
+    return merged
+
+
+def write_collapsed(stacks, path):
+    """Write stack sample counts in the collapsed format understood by flamegraph tools."""
+    with open(path, 'w') as handle:
+        for stack, count in sorted(stacks.items()):
+            handle.write('%s %i\n' % (stack, count))
+
+
+class SamplingProfiler:
+
+    """This class finds out where the time of a process goes, by handler.
+
+    CPU time is sampled through SIGPROF, which only fires while the process
+    uses CPU time. Every sample is attributed to the outermost registered
+    handler on the interrupted stack, and the stack itself is counted for
+    flamegraphs. Wall time can't be sampled reliably from another thread
+    while the GIL is held, so it is measured around handler calls made
+    through `call()` instead, including the time spent in nested handlers.
+
+    Sampling relies on signals, so profilers have to be started from the
+    main thread.
+    """
+
+    @property
+    def interval(self):
+        """Return the amount of CPU seconds between samples."""
+        return self._interval
+
+    @property
+    def running(self):
+        """Return whether or not the profiler is sampling."""
+        return self._running
+
+    @property
+    def stacks(self):
+        """Return a dict counting CPU time samples per collapsed stack."""
+        return self._stacks
+
+    @property
+    def cpu(self):
+        """Return a dict counting CPU time samples per handler."""
+        return self._cpu
+
+    @property
+    def wall(self):
+        """Return a dict containing the wall time spent per handler, in seconds."""
+        return self._wall
+
+    @property
+    def calls(self):
+        """Return a dict counting calls per handler."""
+        return self._calls
+
+    def start(self):
+        """Start sampling."""
+        if self.running:
+            return
+
+        self._running = True
+        self._started = time.time()
+
+        self._previous = signal.signal(signal.SIGPROF, self.sample)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+
+        logger.info('Started profiling, sampling every %.1fms of CPU time', self.interval * 1000)
+
+    def stop(self):
+        """Stop sampling."""
+        if not self.running:
+            return
+
+        signal.setitimer(signal.ITIMER_PROF, 0)
+        signal.signal(signal.SIGPROF, self._previous)
+
+        self._running = False
+        self._duration += time.time() - self._started
+
+        logger.info('Stopped profiling after %.1fs', self._duration)
+
+    def sample(self, signum, frame):
+        """Take a CPU time sample of the interrupted stack."""
+        names = []
+        handler = None
+
+        while frame is not None:
+            code = frame.f_code
+            names.append('%s:%s' % (frame.f_globals.get('__name__', '?'), code.co_name))
+
+            # Keep walking outwards, so that handlers called by handlers are attributed to the outermost one
+            handler = self._codes.get(code, handler)
+            frame = frame.f_back
+
+        self.stacks[';'.join(reversed(names))] += 1
+        self.cpu[handler or OUTSIDE] += 1
+
+    def call(self, handler, event):
+        """Call a handler with an event, measuring the wall time it takes."""
+        started = time.perf_counter()
+
+        try:
+            return handler(event)
+        finally:
+            function = unwrap(handler)
+            name = self._codes.get(function.__code__, OUTSIDE) if function is not None else OUTSIDE
+            self.wall[name] += time.perf_counter() - started
+            self.calls[name] += 1
+
+    def dump(self):
+        """Return the profile so far as plain data."""
+        return {
+            'pid': os.getpid(),
+            'interval': self.interval,
+            'duration': self._duration + (time.time() - self._started if self.running else 0),
+            'stacks': dict(self.stacks),
+            'cpu': dict(self.cpu),
+            'wall': dict(self.wall),
+            'calls': dict(self.calls),
+        }
+
+    def save(self, path):
+        """Save the profile so far as JSON, replacing the file at `path` atomically."""
+        with open(path + '.tmp', 'w') as handle:
+            json.dump(self.dump(), handle)
+
+        os.rename(path + '.tmp', path)
+
+    def __init__(self, codes, interval=0.01):
+        """Create a profiler attributing time to the handlers whose code objects are mapped onto names in `codes`."""
+        self._codes = codes
+        self._interval = interval
+        self._running = False
+        self._started = 0
+        self._duration = 0
+        self._stacks = collections.Counter()
+        self._cpu = collections.Counter()
+        self._wall = collections.Counter()
+        self._calls = collections.Counter()
@@ -2,21 +2,43 @@
 import msgpack
 import logging
 import socket
+import time
+import os
 import re
+import random
+import threading
+import traceback
+import contextlib
+import collections
+import multiprocessing
+from queue import Empty
 import amqp.connection as amqp
 from amqp.basic_message import Message
-from nite.event import EventDemographic
-from nite.util import get_module_attr, instantiate
+from amqp.exceptions import NotFound, MessageNacked
+from nite.event import EventDemographic, MessagePriority, HandlerTimeout
+from nite.dispatch import WeightedDispatcher
+from nite.codec import Compressor, EnvelopeReader, unpack
+from nite.blob import create_blob_store
+from nite.spool import SegmentLog
+from nite.trace import Tracer, create_span_exporter, UNTRACED
+from nite.pressure import Backpressure
+from nite.record import Recorder
+from nite.util import get_module_attr, instantiate, jump_hash, rendezvous_score
 
 
 logger = logging.getLogger(__name__)
 
+# Errors which mean that the connection to the broker was lost or couldn't be made
+CONNECTION_ERRORS = tuple(set(amqp.Connection.connection_errors + amqp.Connection.recoverable_connection_errors +
+                              (socket.error, IOError)))
+
 
 class QueueConnectors:
 
     """This class helps map queue connectors to their identifiers."""
 
     amqp = ['nite.queue', 'AmqpQueueConnector']
+    memory = ['nite.queue', 'MemoryQueueConnector']
 
 
 def create_connector(type, events, config=None):
@@ -32,6 +54,246 @@ def create_connector(type, events, config=None):
     return instantiate(loader_data[0], loader_data[1], events, **config)
 
 
+def load_event(event_name, data):
+    """Import the class of an event and recreate the event from its serialized data, lazily if possible."""
+    matches = re.match(r'^(.*)\.([^\.]+)$', event_name)
+    Event = get_module_attr(matches.group(1), matches.group(2))
+
+    if hasattr(Event, 'load_lazy'):
+        return Event.load_lazy(lambda: unpack(data))
+
+    return Event.load(unpack(data))
+
+
+class Topology:
+
+    """This class records the declarations made through it on a channel, so that they can be made again later.
+
+    Durable exchanges and queues and the bindings between them outlive
+    connections, so when recovering from a lost connection only transient
+    queues and their bindings are declared again, along with QoS settings
+    and consumers.
+    """
+
+    RECORDED = ['exchange_declare', 'exchange_bind', 'queue_declare', 'queue_bind', 'basic_qos', 'basic_consume']
+
+    @property
+    def channel(self):
+        """Return the channel declarations are currently made on."""
+        return self._channel
+
+    @channel.setter
+    def channel(self, value):
+        """Set the channel declarations are currently made on."""
+        self._channel = value
+
+    @property
+    def declarations(self):
+        """Return a list of recorded declarations, as (method name, positional arguments, keyword arguments)."""
+        return self._declarations
+
+    @property
+    def prefetch_count(self):
+        """Return the prefetch count applied to consumers started through this topology from now on."""
+        return self._prefetch_count
+
+    def transient(self, declarations):
+        """Return the declarations which don't outlive connections."""
+        transient_queues = set()
+        result = []
+
+        for name, args, kwargs in declarations:
+            if name == 'queue_declare' and (kwargs['auto_delete'] or kwargs['exclusive'] or not kwargs['durable']):
+                transient_queues.add(kwargs['queue'])
+            elif name == 'queue_bind' and kwargs['queue'] not in transient_queues:
+                continue
+            elif name in ('exchange_declare', 'exchange_bind', 'queue_declare'):
+                continue
+
+            result.append((name, args, kwargs))
+
+        return result
+
+    def apply(self, channel, full=False):
+        """Make the recorded declarations on another channel, and make that the current channel.
+
+        Unless `full` is set, only declarations which don't outlive connections are made.
+        """
+        declarations = self.declarations if full else self.transient(self.declarations)
+        self.channel = channel
+
+        for name, args, kwargs in declarations:
+            getattr(channel, name)(*args, **kwargs)
+
+        return len(declarations)
+
+    def __getattr__(self, name):
+        """Return a method of the channel, which records its calls if it makes a declaration."""
+        method = getattr(self.channel, name)
+
+        if name not in self.RECORDED:
+            return method
+
+        def record(*args, **kwargs):
+            self.declarations.append((name, args, kwargs))
+
+            if name == 'basic_qos':
+                self._prefetch_count = kwargs['prefetch_count']
+
+            return method(*args, **kwargs)
+
+        return record
+
+    def __init__(self, channel):
+        """Constructor."""
+        self.channel = channel
+        self._declarations = []
+        self._prefetch_count = 0
+
+
+class ChannelPool:
+
+    """This class lends channels used for publishing to threads, one thread at a time.
+
+    Channels are created on demand through `factory`, up to `size` of them.
+    Threads which need a channel while all of them are in use wait for one to
+    be returned, for at most `timeout` seconds. Channels which fail with a
+    connection error are closed and replaced on demand.
+    """
+
+    @property
+    def size(self):
+        """Return the maximum amount of channels."""
+        return self._size
+
+    @property
+    def stats(self):
+        """Return a dict containing pool utilisation metrics."""
+        with self._condition:
+            stats = dict(self._stats)
+            stats.update({
+                'size': self.size,
+                'open': self._open,
+                'in_use': self._open - len(self._idle),
+                'utilisation': float(self._open - len(self._idle)) / self.size,
+            })
+
+        return stats
+
+    @contextlib.contextmanager
+    def acquire(self):
+        """Return a context manager which lends a channel to the current thread."""
+        channel = self.take()
+
+        try:
+            yield channel
+        except CONNECTION_ERRORS:
+            self.discard(channel)
+            raise
+        except Exception:
+            self.give(channel)
+            raise
+        except BaseException:
+            # Channels which were interrupted, by a `HandlerTimeout` for instance, may have been left mid-publish
+            self.discard(channel)
+            raise
+        else:
+            self.give(channel)
+
+    def take(self):
+        """Remove and return an idle channel, creating one if there is room for it."""
+        started = time.time()
+
+        with self._condition:
+            self._stats['acquired'] += 1
+
+            if not self._idle and self._open >= self.size:
+                self._stats['waited'] += 1
+
+                if not self._condition.wait_for(lambda: self._idle or self._open < self.size, self._timeout):
+                    raise Exception('No channel became available within %.1fs' % self._timeout)
+
+                self._stats['wait_time'] += time.time() - started
+
+            if self._idle:
+                channel = self._idle.pop()
+            else:
+                # Count the channel right away, but don't hold the lock while connecting
+                channel = None
+                self._open += 1
+
+            self._stats['peak_in_use'] = max(self._stats['peak_in_use'], self._open - len(self._idle))
+
+        if channel is None:
+            try:
+                channel = self._factory()
+            except BaseException:
+                with self._condition:
+                    self._open -= 1
+                    self._condition.notify()
+                raise
+
+        return channel
+
+    def give(self, channel):
+        """Return a channel to the pool."""
+        with self._condition:
+            self._idle.append(channel)
+            self._condition.notify()
+
+    def discard(self, channel):
+        """Close a channel which can't be used anymore, making room for a new one."""
+        with self._condition:
+            self._open -= 1
+            self._stats['discarded'] += 1
+            self._condition.notify()
+
+        self.close_channel(channel)
+
+    def clear(self):
+        """Close all idle channels."""
+        with self._condition:
+            idle = self._idle
+            self._open -= len(idle)
+            self._idle = []
+            self._condition.notify_all()
+
+        for channel in idle:
+            self.close_channel(channel)
+
+    def drain(self):
+        """Process whatever the broker sent to idle channels, such as publisher confirms and flow control."""
+        with self._condition:
+            idle, self._idle = self._idle, []
+
+        for channel in idle:
+            try:
+                while True:
+                    channel.connection.drain_events(timeout=0)
+            except socket.timeout:
+                self.give(channel)
+            except CONNECTION_ERRORS:
+                self.discard(channel)
+
+    def close_channel(self, channel):
+        """Close a channel along with its connection, ignoring connection errors."""
+        try:
+            channel.close()
+            channel.connection.close()
+        except CONNECTION_ERRORS:
+            pass
+
+    def __init__(self, factory, size=4, timeout=10):
+        """Constructor."""
+        self._factory = factory
+        self._size = size
+        self._timeout = timeout
+        self._condition = threading.Condition()
+        self._idle = []
+        self._open = 0
+        self._stats = {'acquired': 0, 'waited': 0, 'wait_time': 0.0, 'peak_in_use': 0, 'discarded': 0}
+
+
 class AbstractQueueConnector:
 
     """This class provides an easy way to interface with various message queueing implementations.
@@ -60,6 +322,16 @@ class AbstractQueueConnector:
         """Set event manager."""
         self._events = value
 
+    @property
+    def backpressure(self):
+        """Return what decides whether events may be published while the queue is saturated, or None."""
+        return self._backpressure
+
+    @backpressure.setter
+    def backpressure(self, value):
+        """Set what decides whether events may be published while the queue is saturated, or None."""
+        self._backpressure = value
+
     def stop(self):
         """Close all connections to the queue and perhaps perform some cleanup.
 
@@ -78,18 +350,50 @@ class AbstractQueueConnector:
         raise NotImplementedError(
             'All (indirect) derivatives of `AbstractQueueConnector` must implement an `start` method.')
 
-    def publish(self, event, demographic, reply_event):
+    def publish(self, event, demographic, reply_event, affinity=None, priority=MessagePriority.NORMAL,
+                deadline=None, delay=None):
         """Publish an event.
 
         This method should be called by the event manager.
         It should never have to be called manually.
 
+        If an `affinity` key is passed, connectors which support it should
+        make sure that all events sharing that key are handled by the same
+        consumer for as long as the set of consumers doesn't change.
+
+        Connectors which support it should deliver events with a higher
+        `priority` ahead of events with a lower one.
+
+        If a `deadline` (a UNIX timestamp) is passed, the event should be
+        dropped instead of handled once that deadline has passed.
+
+        If a `delay` is passed, the event should be held back durably for that
+        many seconds before being delivered.
+
         This is an abstract method. You should implement your own.
 
         """
         raise NotImplementedError(
             'All (indirect) derivatives of `AbstractQueueConnector` must implement a `publish` method.')
 
+    def declare_topology(self):
+        """Declare whatever is shared by all worker processes.
+
+        This method is called by the main process before any worker process
+        starts. Connectors which don't need to declare anything up front don't
+        have to implement it.
+
+        """
+        pass
+
+    def depths(self):
+        """Return a dict mapping the queues worker processes of this node consume from onto their depths.
+
+        Connectors which can't tell don't have to implement it.
+
+        """
+        return {}
+
     def fetch(self):
         """Fetch events.
 
@@ -106,6 +410,7 @@ class AbstractQueueConnector:
         """Constructor."""
         self.events = events
         self.node_identifier = 'node.%s' % socket.getfqdn()
+        self.backpressure = None
 
 
 class AmqpQueueConnector(AbstractQueueConnector):
@@ -122,56 +427,410 @@ class AmqpQueueConnector(AbstractQueueConnector):
         """Set connection."""
         self._connection = value
 
+    @property
+    def dispatcher(self):
+        """Return the dispatcher buffering consumed messages."""
+        return self._dispatcher
+
+    @dispatcher.setter
+    def dispatcher(self, value):
+        """Set the dispatcher buffering consumed messages."""
+        self._dispatcher = value
+
+    @property
+    def priority_weights(self):
+        """Return dispatcher lane weights by message priority."""
+        return self._priority_weights
+
+    @priority_weights.setter
+    def priority_weights(self, value):
+        """Set dispatcher lane weights by message priority."""
+        self._priority_weights = value
+
+    @property
+    def expired(self):
+        """Return the amount of expired messages dropped without being handled, by event type."""
+        return self._expired
+
+    @expired.setter
+    def expired(self, value):
+        """Set the amount of expired messages dropped without being handled, by event type."""
+        self._expired = value
+
+    @property
+    def confirms(self):
+        """Return a dict mapping publish channels onto the amounts of publishes made, confirmed and rejected."""
+        return self._confirms
+
+    @confirms.setter
+    def confirms(self, value):
+        """Set the amounts of publishes made, confirmed and rejected per publish channel."""
+        self._confirms = value
+
+    @property
+    def compressor(self):
+        """Return the compressor used for message bodies."""
+        return self._compressor
+
+    @compressor.setter
+    def compressor(self, value):
+        """Set the compressor used for message bodies."""
+        self._compressor = value
+
+    @property
+    def blobs(self):
+        """Return the blob store used for large payloads, or None."""
+        return self._blobs
+
+    @blobs.setter
+    def blobs(self, value):
+        """Set the blob store used for large payloads, or None."""
+        self._blobs = value
+
+    @property
+    def tracer(self):
+        """Return the tracer carrying trace context across events, or None if tracing is disabled."""
+        return self._tracer
+
+    @tracer.setter
+    def tracer(self, value):
+        """Set the tracer carrying trace context across events, or None if tracing is disabled."""
+        self._tracer = value
+
+    @property
+    def recorder(self):
+        """Return the recorder events passing through this connector are recorded by, or None."""
+        return self._recorder
+
+    @recorder.setter
+    def recorder(self, value):
+        """Set the recorder events passing through this connector are recorded by, or None."""
+        self._recorder = value
+
+    @property
+    def envelopes(self):
+        """Return the reader for event envelopes."""
+        return self._envelopes
+
+    @envelopes.setter
+    def envelopes(self, value):
+        """Set the reader for event envelopes."""
+        self._envelopes = value
+
+    @property
+    def spool(self):
+        """Return the spool holding events which couldn't be published yet, or None."""
+        return self._spool
+
+    @spool.setter
+    def spool(self, value):
+        """Set the spool holding events which couldn't be published yet, or None."""
+        self._spool = value
+
+    @property
+    def topology(self):
+        """Return the topology declared by this connector, or None if it is produce-only."""
+        return self._topology
+
+    @topology.setter
+    def topology(self, value):
+        """Set the topology declared by this connector."""
+        self._topology = value
+
+    @property
+    def subscriptions(self):
+        """Return the event names and patterns handled for messages, by the tag of the consumer receiving them.
+
+        Messages received by consumers which aren't listed here are handled
+        by every matching handler.
+        """
+        return self._subscriptions
+
+    @subscriptions.setter
+    def subscriptions(self, value):
+        """Set the event names and patterns handled for messages, by the tag of the consumer receiving them."""
+        self._subscriptions = value
+
     @property
     def channel(self):
-        """Return channel."""
+        """Return the channel used for consuming and acking."""
         return self._channel
 
     @channel.setter
     def channel(self, value):
-        """Set channel."""
+        """Set the channel used for consuming and acking."""
         self._channel = value
 
+    @property
+    def publish_channel(self):
+        """Return the channel used for publishing by worker processes."""
+        return self._publish_channel
+
+    @publish_channel.setter
+    def publish_channel(self, value):
+        """Set the channel used for publishing by worker processes."""
+        self._publish_channel = value
+
+    @property
+    def pool(self):
+        """Return the pool of channels used for publishing by the main process, or None."""
+        return self._pool
+
+    @pool.setter
+    def pool(self, value):
+        """Set the pool of channels used for publishing by the main process."""
+        self._pool = value
+
+    @property
+    def connected(self):
+        """Return whether or not the broker could be reached the last time we tried."""
+        return self._connected
+
+    @connected.setter
+    def connected(self, value):
+        """Set whether or not the broker could be reached the last time we tried."""
+        self._connected = value
+
     def stop(self):
         """Close connector and clean up."""
         logger.debug('Attempting to stop AMQP connector')
 
-        self.channel.close()
-        self.connection.close()
+        if self.channel is not None:
+            self.publish_channel.close()
+            self.channel.close()
+            self.connection.close()
+
+        if self.pool is not None:
+            self.pool.clear()
+
+        if self.spool is not None:
+            self.spool.close()
+
+        if self.tracer is not None:
+            self.tracer.close()
+
+        if self.backpressure is not None:
+            self.backpressure.stop()
+
+        if self.recorder is not None:
+            self.recorder.close()
 
         logger.debug('AMQP connector stopped successfully')
 
-    def start(self, produce_only=False):
-        """Initialize connections to queue."""
+    def start(self, produce_only=False, events=None):
+        """Initialize connections to queue.
+
+        If a list of `events` is passed, only those events will be consumed
+        instead of every event a handler is registered for.
+
+        If a spool is configured, produce-only connectors start even if the
+        broker can't be reached, spooling events until it can.
+        """
         logger.debug('Attempting to start AMQP connector')
 
-        self.connection = self.create_connection()
-        self.channel = self.create_channel(produce_only=produce_only)
+        if produce_only:
+            # The main process publishes from any thread, so every thread gets a channel of its own
+            self.pool = ChannelPool(self.create_publish_channel, self.config['publish_pool_size'],
+                                    self.config['publish_pool_timeout'])
+
+            if self.config['spool']:
+                self.spool = SegmentLog(**self.config['spool'])
+
+                # Connect (or don't) and pick up events spooled before a restart right away, then keep retrying
+                self.replay_spool()
+
+                interval = self.config['spool_replay_interval']
+                self.events.timers.add(time.time() + interval, self.replay_spool, interval)
+            else:
+                self.recover()
+        else:
+            # Worker processes may be forked after the main process started publishing, and must not publish over
+            # its connections or replay its spool. Those are only let go of here, as closing them would close them
+            # for the main process as well.
+            self.pool = None
+            self.spool = None
+            self.confirms = {}
+
+            # Its pressure level isn't kept up to date here, so it shouldn't hold back events triggered by handlers
+            if self.backpressure is not None:
+                self.backpressure.reset()
+
+            # Publishing on a channel of its own keeps publish bursts from holding up acks
+            self.connection = self.create_connection()
+            self.channel = self.create_channel(events=events)
+            self.publish_channel = self.connection.channel()
+            self.connected = True
+
+        # Keep track of how far behind the broker and worker processes are
+        if produce_only and self.backpressure is not None:
+            self.backpressure.start(self.measure_pressure)
+
+        # Spans are exported in batches, which shouldn't wait for the next span to be finished in quiet processes
+        if self.tracer is not None:
+            interval = self.config['trace_flush_interval']
+            self.events.timers.add(time.time() + interval, self.tracer.flush, interval)
+
+        # Payloads which were never released are collected by the main process of every node
+        if produce_only and self.blobs is not None:
+            interval = self.config['blob_collect_interval']
+            self.events.timers.add(time.time() + interval, self.blobs.collect, interval)
 
         logger.debug('AMQP connector started successfully')
 
     def create_connection(self):
         """Create and return a connection to the queue."""
-        return amqp.Connection(
+        connection = amqp.Connection(
             host=self.config['host'],
             userid=self.config['user'],
             password=self.config['password'],
             virtual_host=self.config['virtual_host'],
             connect_timeout=self.config['connect_timeout'],
-            ssl=self.config['ssl']
+            ssl=self.config['ssl'],
+            heartbeat=self.config['heartbeat']
         )
 
-    def create_channel(self, produce_only=False):
-        """Create and return a channel to the queue."""
-        channel = self.connection.channel()
+        # The flow control of the broker counts towards backpressure
+        if self.backpressure is not None:
+            connection.on_blocked = lambda reason=None: self.backpressure.block(connection, reason)
+            connection.on_unblocked = lambda: self.backpressure.unblock(connection)
 
-        if produce_only:
-            return channel
+        # Newer versions of the AMQP library don't connect until asked to
+        if hasattr(connection, 'connect'):
+            connection.connect()
 
-        # Set message prefetch count to 1
-        # channel.basic_qos(0, 1, 0)
+        return connection
 
-        # Declare or create the exchanges this channel is going to be using
+    def create_publish_channel(self):
+        """Create and return a channel for publishing from the main process, on a connection of its own.
+
+        Connections can't be shared between threads, so neither can channels
+        on the same connection.
+        """
+        channel = self.create_connection().channel()
+
+        # Publishes the broker didn't confirm yet count towards backpressure, and spooled messages are only let go
+        # of once the broker confirmed them
+        if self.backpressure is not None or self.spool is not None:
+            channel.confirm_select()
+            self.confirms[channel] = [0, 0, 0]
+            channel.events['basic_ack'].add(lambda tag, multiple: self.confirm(channel, tag))
+            channel.events['basic_nack'].add(lambda tag, multiple: self.confirm(channel, tag, True))
+
+        return channel
+
+    def confirm(self, channel, tag, rejected=False):
+        """Keep track of the publishes the broker confirmed (or rejected) on a channel."""
+        self.confirms[channel][1] = max(self.confirms[channel][1], tag)
+
+        if rejected:
+            self.confirms[channel][2] += 1
+
+    def wait_confirms(self, channel):
+        """Wait until the broker confirmed every publish made on a channel so far.
+
+        Raises `MessageNacked` if the broker rejected any of them since the
+        last time this was called, and `socket.timeout` if it didn't confirm
+        them within `confirm_timeout` seconds.
+        """
+        deadline = time.time() + self.config['confirm_timeout']
+
+        while self.confirms[channel][1] < self.confirms[channel][0]:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                raise socket.timeout('The broker didn\'t confirm %i publish(es) in time' %
+                                     (self.confirms[channel][0] - self.confirms[channel][1]))
+
+            try:
+                channel.connection.drain_events(timeout=remaining)
+            except socket.timeout:
+                pass
+
+        rejected, self.confirms[channel][2] = self.confirms[channel][2], 0
+        if rejected:
+            raise MessageNacked('The broker rejected %i publish(es)' % rejected)
+
+    def measure_pressure(self):
+        """Update the backpressure level with outstanding publishes and, once in a while, queue depths."""
+        if self.pool is not None:
+            self.pool.drain()
+
+        # Channels which were closed won't confirm anything anymore
+        for channel in list(self.confirms):
+            if not channel.is_open:
+                del self.confirms[channel]
+
+        # Neither will connections which were closed while the broker blocked them ever be unblocked
+        for connection in self.backpressure.blocked:
+            if not connection.connected:
+                self.backpressure.unblock(connection)
+
+        outstanding = sum(published - confirmed for published, confirmed, rejected in list(self.confirms.values()))
+        outstanding += len(self.spool) if self.spool is not None else 0
+
+        depth = None
+        if self.backpressure.max_depth and time.time() - self._depth_measured >= self.backpressure.depth_interval:
+            self._depth_measured = time.time()
+            depth = max(list(self.depths().values()) or [0])
+
+        self.backpressure.update(outstanding, depth)
+
+    def declare_topology(self, channel=None):
+        """Declare the exchanges, work queues and bindings shared by all worker processes.
+
+        This only does something when the consolidated topology is used, in
+        which case it is called once by the main process before any worker
+        process starts, on a connection of its own unless a `channel` is
+        passed. Event types are spread over `work_queues` durable queues by
+        binding their routing keys to the queue their name hashes to, and
+        worker processes only consume from those queues.
+
+        As worker processes consume whole work queues, they handle every
+        event type in them. Event types can't be kept apart in worker pools,
+        limited in concurrency or given prefetch limits of their own.
+        """
+        if self.config['topology'] != 'consolidated':
+            return
+
+        started = time.time()
+        connection = None
+
+        if channel is None:
+            connection = self.create_connection()
+            channel = connection.channel()
+
+        self.declare_exchanges(channel)
+
+        for i in range(0, self.config['work_queues']):
+            channel.queue_declare(
+                queue='nite.work.%i' % i,
+                passive=False,
+                durable=True,
+                exclusive=False,
+                auto_delete=False,
+                nowait=False,
+                arguments=self.queue_arguments()
+            )
+
+        events = list(self.events.handlers.keys())
+        for event in events:
+            channel.queue_bind(
+                queue=self.work_queue(event),
+                exchange=self.config['exchange_topic'],
+                routing_key='event.' + event,
+                nowait=False,
+                arguments=None
+            )
+
+        # Don't leave a connection behind for worker processes to inherit
+        if connection is not None:
+            channel.close()
+            connection.close()
+
+        logger.info('Declared %i work queue(s) for %i event type(s) in %.1fms', self.config['work_queues'],
+                    len(events), (time.time() - started) * 1000)
+
+    def declare_exchanges(self, channel):
+        """Declare the exchanges events are published to."""
         channel.exchange_declare(
             self.config['exchange_topic'],
             'topic',
@@ -192,6 +851,61 @@ class AmqpQueueConnector(AbstractQueueConnector):
             arguments=None
         )
 
+        # Shard routing keys go through an exchange of their own, where patterns of regular queues can't match them
+        if self.config['shards']:
+            channel.exchange_declare(
+                self.config['exchange_shards'],
+                'topic',
+                passive=False,
+                durable=True,
+                auto_delete=False,
+                nowait=False,
+                arguments=None
+            )
+
+        # Declare the delayed delivery exchange, which passes messages on to the others when they're due
+        if self.config['exchange_delayed']:
+            channel.exchange_declare(
+                self.config['exchange_delayed'],
+                'x-delayed-message',
+                passive=False,
+                durable=True,
+                auto_delete=False,
+                nowait=False,
+                arguments={'x-delayed-type': 'headers'}
+            )
+
+            for kind in ('topic', 'fanout', 'shards') if self.config['shards'] else ('topic', 'fanout'):
+                channel.exchange_bind(
+                    destination=self.config['exchange_%s' % kind],
+                    source=self.config['exchange_delayed'],
+                    routing_key='',
+                    nowait=False,
+                    arguments={'x-match': 'all', 'x-nite-exchange': kind}
+                )
+
+    def create_channel(self, events=None):
+        """Create and return a channel to the queue, and start consuming on it.
+
+        Every declaration made for consuming is recorded in `topology`, so
+        that it can be repeated when recovering from a lost connection.
+
+        With the consolidated topology, only the node-specific queue is
+        declared here, and events are consumed from the work queues declared
+        by `declare_topology` which contain them.
+        """
+        channel = self.connection.channel()
+        consolidated = self.config['topology'] == 'consolidated'
+
+        if events is None:
+            events = self.events.handlers.keys()
+
+        self.topology = channel = Topology(channel)
+
+        # Declare or create the exchanges this channel is going to be using
+        if not consolidated:
+            self.declare_exchanges(channel)
+
         # Declare node-specific queue
         channel.queue_declare(
             queue=self.node_identifier,
@@ -200,7 +914,7 @@ class AmqpQueueConnector(AbstractQueueConnector):
             exclusive=False,
             auto_delete=True,
             nowait=False,
-            arguments=None
+            arguments=self.queue_arguments()
         )
 
         # Bind node-specific queue to node-specific routing key
@@ -212,54 +926,49 @@ class AmqpQueueConnector(AbstractQueueConnector):
             arguments=None
         )
 
-        # Loop through events to be bound and declare queues/bind to queues
-        for event in self.events.handlers.keys():
-            # Declare the event-specific queue to bind to
-            channel.queue_declare(
-                queue='event.' + event,
-                passive=False,
-                durable=True,
-                exclusive=False,
-                auto_delete=False,
-                nowait=False,
-                arguments=None
-            )
-
-            # Bind routing key on event-specific queue
-            channel.queue_bind(
-                queue='event.' + event,
-                exchange=self.config['exchange_topic'],
-                routing_key=event,
-                nowait=False,
-                arguments=None
-            )
-
-            # Bind routing key on node-specific queue
+        # Fanout exchanges ignore routing keys, so a single binding covers every event
+        if consolidated:
             channel.queue_bind(
                 queue=self.node_identifier,
                 exchange=self.config['exchange_fanout'],
-                routing_key='event.' + event,
+                routing_key='',
                 nowait=False,
                 arguments=None
             )
 
-            # Start consuming from the queue
-            channel.basic_consume(
-                queue='event.' + event,
-                consumer_tag='',
-                no_local=False,
-                no_ack=False,
-                exclusive=False,
-                nowait=False,
-                callback=self.on_consume,
-                arguments=None,
-                on_cancel=None
-            )
+            self.set_prefetch(channel, self.config['prefetch'])
+
+            for queue in sorted(set(self.work_queue(event) for event in events)):
+                # Every event reaches a work queue once, however many of the subscriptions bound to it match
+                self.subscriptions[queue] = frozenset(
+                    subscription for subscription in self.events.handlers if self.work_queue(subscription) == queue)
+
+                channel.basic_consume(
+                    queue=queue,
+                    consumer_tag=queue,
+                    no_local=False,
+                    no_ack=False,
+                    exclusive=False,
+                    nowait=False,
+                    callback=self.on_consume,
+                    arguments=None,
+                    on_cancel=None
+                )
+
+        # Loop through events to be bound and declare queues/bind to queues
+        for event in events:
+            if not consolidated:
+                self.create_event_consumer(channel, event)
+
+            # Declare, bind and consume from the affinity shards of this event
+            for shard in range(0, self.config['shards']):
+                self.create_shard_consumer(channel, event, shard)
 
         # Start consuming from the node-specific queue
+        self.set_prefetch(channel, self.config['prefetch'])
         channel.basic_consume(
             queue=self.node_identifier,
-            consumer_tag='',
+            consumer_tag=self.node_identifier,
             no_local=False,
             no_ack=False,
             exclusive=False,
@@ -269,57 +978,633 @@ class AmqpQueueConnector(AbstractQueueConnector):
             on_cancel=None
         )
 
-        return channel
+        return channel.channel
+
+    def recover(self):
+        """Reconnect to the broker after losing the connection to it and return whether that worked.
+
+        Only what doesn't outlive a connection is declared again, using the
+        recorded topology. If the broker lost anything else along the way
+        (after a failover to a node without our durable queues, for
+        instance), the whole topology is declared again.
+        """
+        started = time.time()
+
+        # Messages delivered on the lost channel will be redelivered, and can't be acked anymore
+        self.dispatcher.clear()
+
+        try:
+            if self.pool is not None:
+                # Channels lent out right now are replaced once they fail
+                self.pool.clear()
+
+                with self.pool.acquire():
+                    pass
+            else:
+                # Let go of the lost connection without talking to the broker over it
+                if self.connection is not None:
+                    self.connection.collect()
+
+                self.connection = self.create_connection()
+
+                try:
+                    declarations = self.topology.apply(self.connection.channel())
+                except NotFound:
+                    logger.warning('The broker lost part of our topology, declaring all of it again')
+                    channel = self.connection.channel()
+                    self.declare_topology(channel)
+                    declarations = self.topology.apply(channel, full=True)
+
+                self.channel = self.topology.channel
+                self.publish_channel = self.connection.channel()
+        except CONNECTION_ERRORS:
+            self.connected = False
+            self._recovery_attempts += 1
+            logger.warning('Reconnecting to the broker failed (attempt %i)', self._recovery_attempts)
+            return False
+
+        logger.info('Reconnected to the broker in %.1fms after %i failed attempt(s)%s',
+                    (time.time() - started) * 1000, self._recovery_attempts,
+                    ', repeating %i declaration(s)' % declarations if self.pool is None else '')
+        self.connected = True
+        self._recovery_attempts = 0
+
+        return True
+
+    def recovery_delay(self):
+        """Return the amount of seconds to wait before the next attempt to reconnect.
+
+        Delays grow exponentially with every failed attempt, and are picked at
+        random below that, so that a crowd of workers which lost their
+        connection at the same time doesn't reconnect in lockstep.
+        """
+        limit = self.config['reconnect_delay'] * 2 ** min(self._recovery_attempts, 32)
+        return random.uniform(0, min(limit, self.config['reconnect_max_delay']))
+
+    def create_event_consumer(self, channel, event):
+        """Declare and bind the queue of a single event type and start consuming from it.
+
+        If the event name is a pattern such as `myapp.events.*`, the queue is
+        bound using that pattern, so the topic exchange routes every event
+        matching it there.
+        """
+        # Declare the event-specific queue to bind to
+        channel.queue_declare(
+            queue='event.' + event,
+            passive=False,
+            durable=True,
+            exclusive=False,
+            auto_delete=False,
+            nowait=False,
+            arguments=self.queue_arguments()
+        )
+
+        # Bind routing key on event-specific queue
+        channel.queue_bind(
+            queue='event.' + event,
+            exchange=self.config['exchange_topic'],
+            routing_key='event.' + event,
+            nowait=False,
+            arguments=None
+        )
+
+        # Bind routing key on node-specific queue
+        channel.queue_bind(
+            queue=self.node_identifier,
+            exchange=self.config['exchange_fanout'],
+            routing_key='event.' + event,
+            nowait=False,
+            arguments=None
+        )
+
+        # Limit the amount of unacked messages of this event type, for this consumer only
+        self.set_prefetch(channel, self.config['event_prefetch'].get(event, self.config['prefetch']))
+
+        # Start consuming from the queue, which only handles this subscription
+        self.subscriptions['event.' + event] = frozenset([event])
+        channel.basic_consume(
+            queue='event.' + event,
+            consumer_tag='event.' + event,
+            no_local=False,
+            no_ack=False,
+            exclusive=False,
+            nowait=False,
+            callback=self.on_consume,
+            arguments=None,
+            on_cancel=None
+        )
+
+    def create_shard_consumer(self, channel, event, shard):
+        """Declare and bind a single affinity shard queue and start consuming from it.
+
+        Every worker on every node consumes from every shard, but shard queues
+        only have a single active consumer at any time. Consumers register
+        with a priority equal to their rendezvous score for the shard, so the
+        broker hands each shard to the highest scoring live worker and moves
+        it to the runner-up when that worker disappears. Brokers which honour
+        consumer priorities for single active consumers (RabbitMQ 3.13+) also
+        move shards back to a higher scoring worker when one joins.
+
+        Shard queues are bound to the shard exchange, which only carries
+        sharded events. Subscriptions to patterns get shard queues of their
+        own, such as `event.myapp.#.shard.0`, so every subscription matching
+        a sharded event gets it exactly once, through its own shard queue.
+        """
+        queue = self.shard_queue(event, shard)
+
+        channel.queue_declare(
+            queue=queue,
+            passive=False,
+            durable=True,
+            exclusive=False,
+            auto_delete=False,
+            nowait=False,
+            arguments={
+                'x-queue-type': 'quorum',
+                'x-single-active-consumer': True
+            }
+        )
+
+        channel.queue_bind(
+            queue=queue,
+            exchange=self.config['exchange_shards'],
+            routing_key=queue,
+            nowait=False,
+            arguments=None
+        )
+
+        self.subscriptions[queue] = frozenset([event])
+        channel.basic_consume(
+            queue=queue,
+            consumer_tag=queue,
+            no_local=False,
+            no_ack=False,
+            exclusive=False,
+            nowait=False,
+            callback=self.on_consume,
+            arguments={'x-priority': rendezvous_score(self.consumer_identifier, queue)},
+            on_cancel=None
+        )
+
+    def set_prefetch(self, topology, count):
+        """Set the prefetch count applied to consumers started through a topology from now on.
+
+        A count of 0 means that prefetching is unlimited. QoS is only
+        renegotiated when the count actually changes.
+        """
+        if topology.prefetch_count != count:
+            topology.basic_qos(prefetch_size=0, prefetch_count=count, a_global=False)
+
+    def queue_arguments(self):
+        """Return the arguments to declare event and node queues with."""
+        if not self.config['priority_lanes']:
+            return None
+
+        return {'x-max-priority': max(priority.value for priority in MessagePriority)}
+
+    def work_queue(self, event):
+        """Return the name of the work queue an event type is consumed from with the consolidated topology."""
+        return 'nite.work.%i' % jump_hash(event, self.config['work_queues'])
+
+    def queue_names(self):
+        """Return the names of the queues worker processes of this node consume from."""
+        events = list(self.events.handlers.keys())
+
+        if self.config['topology'] == 'consolidated':
+            queues = sorted(set(self.work_queue(event) for event in events))
+        else:
+            queues = ['event.' + event for event in events]
+
+        queues.extend(self.shard_queue(event, shard) for event in events for shard in range(0, self.config['shards']))
+        queues.append(self.node_identifier)
+
+        return queues
+
+    def depths(self):
+        """Return a dict mapping the queues worker processes of this node consume from onto their depths.
+
+        Depths are the amounts of messages ready for delivery, so messages
+        delivered to worker processes which haven't been acked yet aren't
+        included. Queues which don't exist (yet) are left out.
+        """
+        connection = self.create_connection()
+        channel = connection.channel()
+        depths = {}
+
+        try:
+            for queue in self.queue_names():
+                try:
+                    depths[queue] = channel.queue_declare(queue=queue, passive=True).message_count
+                except NotFound:
+                    # The broker closes channels on which a queue wasn't found
+                    channel = connection.channel()
+        finally:
+            connection.close()
+
+        return depths
+
+    def shard_queue(self, event, shard):
+        """Return the name of the queue (and routing key) of an affinity shard of an event."""
+        return 'event.%s.shard.%i' % (event, shard)
 
     def on_consume(self, message):
+        """Buffer a consumed message until it is its turn to be handled.
+
+        Messages are buffered in one lane per message priority and event
+        type, so that messages which have already been delivered can still
+        be overtaken by more urgent ones, and so that a backlog of a single
+        event type can't monopolize the worker.
+
+        Messages which have already expired are dropped right away.
+        """
+        if self.drop_expired(message):
+            return
+
+        priority = message.properties.get('priority', MessagePriority.NORMAL.value)
+        event = (message.headers or {}).get('x-nite-event')
+        lane = (priority, event)
+
+        if lane not in self.dispatcher.weights:
+            self.dispatcher.weights[lane] = (self.priority_weights.get(priority, 1) *
+                                             self.config['event_weights'].get(event, 1))
+
+        self.dispatcher.put(lane, message)
+
+    def drop_expired(self, message):
+        """Acknowledge and count a message without handling it if its deadline has passed.
+
+        Only message headers are inspected, so this is cheap enough to do
+        before a message is even deserialized. Returns whether the message
+        was dropped.
+        """
+        headers = message.headers or {}
+        deadline = headers.get('x-nite-deadline')
+
+        if deadline is None or deadline > time.time():
+            return False
+
+        self.expired[headers.get('x-nite-event')] += 1
+
+        if self.settle(message, 'basic_ack'):
+            self.discard_payload(message)
+
+        logger.debug('Dropped expired event "%s"', headers.get('x-nite-event'))
+
+        return True
+
+    def delivery_channel(self, message):
+        """Return the channel a message was delivered on, which is the only channel its delivery tag is valid on.
+
+        If the connection was lost meanwhile, acking the message on that
+        channel fails, and the broker will deliver the message again.
+        """
+        return getattr(message, 'channel', None) or self.channel
+
+    def settle(self, message, method, **kwargs):
+        """Ack, nack or reject a message on the channel it was delivered on, and return whether that worked.
+
+        `method` is the name of the channel method to call. Losing the
+        connection to the broker meanwhile isn't raised, but recovered from
+        by the next `fetch()`, as the broker will deliver the message again.
+        """
+        try:
+            getattr(self.delivery_channel(message), method)(delivery_tag=message.delivery_info['delivery_tag'],
+                                                            **kwargs)
+        except CONNECTION_ERRORS:
+            logger.warning('Lost the connection to the broker while settling a message, reconnecting', exc_info=True)
+            self.connected = False
+            return False
+
+        return True
+
+    def discard_payload(self, message):
+        """Release the payload of a message which was sent out of band, if the message won't be delivered again."""
+        reference = (message.headers or {}).get('x-nite-blob')
+
+        if reference is not None:
+            self.blobs.release(reference)
+
+    def handle_message(self, message):
         """Handle a consumed message."""
-        # Unserialize the data received in the message body
-        data = msgpack.loads(message.body, encoding='utf-8')
-        # Grab the event class by importing it
-        matches = re.match(r'^(.*)\.([^\.]+)$', data['event'])
-        Event = get_module_attr(matches.group(1), matches.group(2))
-        # Recreate the event with the received data
-        event = Event.load(data['data'])
+        # Messages can expire while they're buffered, too
+        if self.drop_expired(message):
+            return
+
+        headers = message.headers or {}
+        reference = headers.get('x-nite-blob')
+
+        # Pick up the trace the message is part of, so that events triggered by handlers become part of it as well
+        span = None
+        if self.tracer is not None:
+            span = self.tracer.receive(headers, 'consume', event=headers.get('x-nite-event'),
+                                       consumer=message.delivery_info.get('consumer_tag'),
+                                       redelivered=bool(message.delivery_info.get('redelivered')))
+
+        try:
+            if reference is None:
+                self.handle_body(message, message.body)
+                return
+
+            # Payloads sent out of band are handled straight from the memory mapped blob
+            with contextlib.ExitStack() as stack:
+                try:
+                    view = stack.enter_context(self.blobs.open(reference))
+                except FileNotFoundError:
+                    # Payloads which were collected already are gone for good, so no worker can handle the message
+                    logger.error('The payload of a "%s" event is gone, rejecting it', headers.get('x-nite-event'))
+
+                    with self.trace('reject'):
+                        self.settle(message, 'basic_reject', requeue=False)
+
+                    return
+
+                try:
+                    event, result = self.handle_body(message, view)
+                except BaseException as e:
+                    # Views of the payload held on to by the traceback would keep the mapping from being closed
+                    traceback.clear_frames(e.__traceback__)
+                    raise
+
+                # The mapping is about to be closed, so events which weren't populated yet can't be populated later
+                if '_loader' in event.__dict__:
+                    event.__dict__['_loader'] = self.released_loader
+
+            # Once acked, we no longer need the payload
+            if result:
+                self.blobs.release(reference)
+        finally:
+            if span is not None:
+                self.tracer.pop(span)
+
+    def handle_body(self, message, body):
+        """Handle the body of a consumed message, which may be any bytes-like object.
+
+        Only the envelope of the event is read before the event is handled.
+        Its data is unserialized when a handler first accesses the event.
+
+        Returns the event and whether or not it was handled successfully and acked.
+        """
+        headers = message.headers or {}
+
+        with self.trace('deserialize', bytes=len(body)):
+            body = self.compressor.decompress(headers.get('x-nite-event'), body,
+                                              message.properties.get('content_encoding'),
+                                              headers.get('x-nite-dictionary'))
+            event_name, data = self.envelopes.read(body, headers.get('x-nite-event'))
+
+            # Recreate the event with the received data
+            event = load_event(event_name, data)
+
+        if self.recorder is not None and self.recorder.tap == 'consume':
+            # Delayed events reach us through the delayed exchange, so they carry the exchange they were meant for
+            fanout = message.delivery_info.get('exchange') == self.config['exchange_fanout']
+            fanout = headers.get('x-nite-exchange', 'fanout' if fanout else 'topic') == 'fanout'
+
+            self.recorder.record(EventDemographic.GLOBAL_ALL if fanout else EventDemographic.GLOBAL_SINGLE,
+                                 MessagePriority(message.properties.get('priority', MessagePriority.NORMAL.value)),
+                                 body)
 
         event._source = message.properties['reply_to']
         event._reply_to_uuid = message.properties['correlation_id'] if 'correlation_id' in message.properties else None
 
-        # Have event handled by event manager
-        result = self.events.handle(event)
-
-        # ACK or NACK as needed
-        tag = message.delivery_info['delivery_tag']
-        self.channel.basic_ack(delivery_tag=tag) if result else self.channel.basic_nack(delivery_tag=tag)
+        if 'message_id' in message.properties:
+            event._uuid = message.properties['message_id']
 
-    def publish(self, event, demographic, reply_event):
-        """Publish an event onto the queue."""
+        # Have event handled by event manager
+        try:
+            result = self.events.handle(event, self.subscriptions.get(message.delivery_info.get('consumer_tag')))
+        except HandlerTimeout as e:
+            # Give events which timed out one more chance, but don't let them time out workers forever
+            requeue = not message.delivery_info.get('redelivered')
+            logger.error('%s, %s it', e, 'requeueing' if requeue else 'rejecting')
+
+            with self.trace('nack', requeue=requeue):
+                settled = self.settle(message, 'basic_nack', requeue=requeue)
+
+            if settled and not requeue:
+                self.discard_payload(message)
+
+            return event, False
+
+        # ACK or NACK as needed, messages which weren't acked will be delivered again
+        with self.trace('ack' if result else 'nack'):
+            settled = self.settle(message, 'basic_ack' if result else 'basic_nack')
+
+        return event, result and settled
+
+    def trace(self, name, **attributes):
+        """Return a context manager recording a span inside of the current span, if tracing."""
+        return UNTRACED if self.tracer is None else self.tracer.span(name, **attributes)
+
+    def released_loader(self):
+        """Take the place of the loader of an event whose payload was released before it was populated."""
+        raise Exception('The data of this event can no longer be loaded, because its payload was released')
+
+    def publish(self, event, demographic, reply_event, affinity=None, priority=MessagePriority.NORMAL,
+                deadline=None, delay=None):
+        """Publish an event onto the queue.
+
+        If sharding is enabled and an `affinity` key is passed along with a
+        `GLOBAL_SINGLE` event, the event is routed to one of the affinity
+        shards of the event using consistent hashing, through the shard
+        exchange. Events without an affinity key keep using the regular event
+        queue.
+
+        A `deadline` is passed to the broker as the message expiration, so
+        expired messages at the head of a queue are discarded by the broker
+        itself, and in the `x-nite-deadline` header, so that workers can drop
+        messages which expired after delivery.
+
+        A `delay` requires the delayed message exchange plugin and a
+        configured `exchange_delayed`. Delayed messages are published to that
+        exchange, which passes them on to the exchange they were meant for
+        once they're due.
+
+        If a blob store is configured, (compressed) bodies of at least
+        `blob_threshold` bytes are put into it and only a reference is sent.
+        Node-local stores are only used for events sent to this node, as
+        payloads in them can't be read anywhere else. Other events keep their
+        payload inline. Payloads of events with a `deadline` aren't kept
+        around after it has passed.
+
+        Events sent to a node reach a single queue, so their payloads are
+        removed once handled. Other events may reach any amount of queues,
+        through pattern subscriptions or queues shared by event types, so
+        their payloads are left for the blob store to collect.
+        """
         routing_key = 'event.' + event['event']
 
+        # Determine exchange name
+        kind = 'fanout' if demographic is EventDemographic.GLOBAL_ALL else 'topic'
+
         # If the demographic is not part of "EventDemographic",
         # we should assume EventDemographic is a routing key.
-        if demographic not in EventDemographic:
+        if not isinstance(demographic, EventDemographic):
             routing_key = demographic
+        elif demographic is EventDemographic.GLOBAL_SINGLE and affinity is not None and self.config['shards']:
+            routing_key = self.shard_queue(event['event'], jump_hash(affinity, self.config['shards']))
+            kind = 'shards'
+
+        exchange = self.config['exchange_%s' % kind]
+
+        headers = {'x-nite-event': event['event']}
+        properties = {}
+
+        if delay is not None:
+            if not self.config['exchange_delayed']:
+                raise Exception('Events can\'t be delayed durably without an "exchange_delayed"!')
+
+            headers['x-delay'] = int(delay * 1000)
+            headers['x-nite-exchange'] = kind
+            exchange = self.config['exchange_delayed']
+
+        if deadline is not None:
+            headers['x-nite-deadline'] = deadline
+            properties['expiration'] = str(max(0, int((deadline - time.time()) * 1000)))
+
+        # Serialize and, if it pays off, compress the event
+        body = msgpack.dumps(event, use_bin_type=True)
+
+        if self.recorder is not None and self.recorder.tap == 'publish':
+            self.recorder.record(demographic, priority, body)
+
+        body, encoding, dictionary = self.compressor.compress(event['event'], body)
+
+        if encoding is not None:
+            properties['content_encoding'] = encoding
+
+        if dictionary is not None:
+            headers['x-nite-dictionary'] = dictionary
+
+        # Carry the trace the event is triggered in along, or start a new one
+        if self.tracer is not None:
+            self.tracer.inject(headers)
+
+        # Move large payloads out of band, sending only a reference to them through the queue
+        if self.blobs is not None and len(body) >= self.config['blob_threshold']:
+            consumers = None if isinstance(demographic, EventDemographic) else 1
+
+            # Payloads on node-local storage can only be handled on this node
+            if not self.blobs.node_local or routing_key == self.node_identifier:
+                headers['x-nite-blob'] = self.blobs.put(body, consumers, deadline)
+                body = b''
 
         # Create the message.
         message = Message(
-            body=msgpack.dumps(event, use_bin_type=True),
+            body=body,
             message_id=event['data']['_uuid'],
             correlation_id=reply_event.uuid if reply_event else None,
-            reply_to=self.node_identifier
+            reply_to=self.node_identifier,
+            priority=priority.value,
+            application_headers=headers,
+            **properties
         )
 
-        # Determine exchange name
-        exchange = self.config['exchange_%s' % ('fanout' if demographic is EventDemographic.GLOBAL_ALL else 'topic')]
-
         # Publish the message
-        self.channel.basic_publish(
-            message,
+        self.send(message, exchange, routing_key)
+
+    def send(self, message, exchange, routing_key):
+        """Publish a message, or spool it if there is a spool and the broker can't be reached."""
+        # While the spool is being drained, new messages have to queue up behind it to keep their order
+        if self.spool is not None and (not self.connected or len(self.spool)):
+            self.spool.append(msgpack.dumps([exchange, routing_key, message.properties, message.body],
+                                            use_bin_type=True))
+            return
+
+        try:
+            if self.pool is None:
+                self.publish_channel.basic_publish(
+                    message,
+                    exchange=exchange,
+                    routing_key=routing_key,
+                    mandatory=False,
+                    immediate=False
+                )
+            else:
+                with self.pool.acquire() as channel:
+                    channel.basic_publish(
+                        message,
+                        exchange=exchange,
+                        routing_key=routing_key,
+                        mandatory=False,
+                        immediate=False
+                    )
+
+                    if channel in self.confirms:
+                        self.confirms[channel][0] += 1
+        except CONNECTION_ERRORS:
+            if self.spool is not None:
+                logger.warning('Lost the connection to the broker, spooling events until it is back', exc_info=True)
+                self.connected = False
+                self.send(message, exchange, routing_key)
+                return
+
+            # Worker processes publish while handling a message, which has to be acked on the channel it arrived
+            # on, so they reconnect once they're done with it
+            if self.pool is None:
+                self.connected = False
+                raise
+
+            # Without a spool, try to reconnect right away and give up if that doesn't work
+            logger.warning('Lost the connection to the broker, reconnecting', exc_info=True)
+            if not self.recover():
+                raise
+
+            self.send(message, exchange, routing_key)
+
+    def replay_spool(self):
+        """Publish spooled messages, connecting to the broker first if needed.
+
+        Spooled messages are published in batches, and only let go of once
+        the broker confirmed the whole batch. Batches which weren't confirmed
+        are published again, so messages may be published more than once.
+        """
+        # Spooled messages reach the disk in time, even if nothing is appended after them
+        self.spool.sync()
+
+        if not self.connected and not self.recover():
+            logger.debug('The broker still can\'t be reached, %i event(s) spooled', len(self.spool))
+            return
+
+        # Confirms of messages published right away would pile up on idle channels otherwise
+        self.pool.drain()
+
+        if not len(self.spool):
+            return
+
+        started = time.time()
+        replayed = self.spool.stats['read']
+
+        try:
+            with self.pool.acquire() as channel:
+                self.spool.replay(lambda record: self.publish_spooled(channel, record),
+                                  commit=lambda: self.wait_confirms(channel))
+        except MessageNacked as e:
+            logger.warning('%s while replaying spooled events, retrying later', e)
+        except CONNECTION_ERRORS:
+            logger.warning('Lost the connection to the broker while replaying spooled events', exc_info=True)
+            self.connected = False
+
+        replayed = self.spool.stats['read'] - replayed
+        duration = max(time.time() - started, 1e-6)
+        logger.info('Replayed %i spooled event(s) in %.2fs (%.0f/s), %i left', replayed, duration,
+                    replayed / duration, len(self.spool))
+
+    def publish_spooled(self, channel, record):
+        """Publish a single spooled message on a channel."""
+        exchange, routing_key, properties, body = msgpack.loads(record, raw=False)
+
+        channel.basic_publish(
+            Message(body=body, **properties),
             exchange=exchange,
             routing_key=routing_key,
             mandatory=False,
             immediate=False
         )
 
+        if channel in self.confirms:
+            self.confirms[channel][0] += 1
+
     def fetch(self):
         """Fetch events.
 
@@ -327,15 +1612,184 @@ class AmqpQueueConnector(AbstractQueueConnector):
         It should never have to be called manually.
 
         """
+        # After losing the connection, try to get it back before doing anything else
+        if not self.connected:
+            time.sleep(self.recovery_delay())
+            self.recover()
+            return
+
         try:
-            # Try to drain some events
-            self.connection.drain_events(0.5)
+            if self.config['heartbeat']:
+                self.connection.heartbeat_tick()
+
+            # Try to drain some events, only waiting for them if we have nothing buffered
+            self.connection.drain_events(0 if self.dispatcher else 0.5)
+
+            # Pull in everything else that has already arrived, so all lanes get to compete
+            while len(self.dispatcher) < self.config['buffer_size']:
+                self.connection.drain_events(0)
         except socket.timeout:
             # If we got a timeout, do nothing
             pass
+        except CONNECTION_ERRORS:
+            logger.warning('Lost the connection to the broker, reconnecting', exc_info=True)
+            self.connected = False
+            return
+
+        # Handle the next buffered message, if any
+        message = self.dispatcher.pop()
+        if message is not None:
+            try:
+                self.handle_message(message)
+            except CONNECTION_ERRORS:
+                # Handlers which failed to publish over a lost connection are recovered from, while anything else
+                # they raise is theirs, even if it looks like a connection error
+                if self.connected:
+                    raise
+
+                logger.warning('Lost the connection to the broker while handling an event, reconnecting',
+                               exc_info=True)
+
+    @property
+    def consumer_identifier(self):
+        """Return an identifier which is unique for every worker process on every node."""
+        return '%s.%i' % (self.node_identifier, os.getpid())
 
     def __init__(self, events, exchange_fanout, exchange_topic, virtual_host,
-                 host, user, password, ssl=False, connect_timeout=5):
+                 host, user, password, ssl=False, connect_timeout=5, shards=0, priority_lanes=False,
+                 priority_weights=None, buffer_size=256, prefetch=0, event_prefetch=None, event_weights=None,
+                 exchange_delayed=None, compression=None, compression_threshold=1024, compression_level=None,
+                 compression_dictionaries=None, blob_store=None, blob_config=None, blob_threshold=1048576,
+                 blob_collect_interval=60, spool=None, spool_replay_interval=1, heartbeat=0, reconnect_delay=0.05,
+                 reconnect_max_delay=30, publish_pool_size=4, publish_pool_timeout=10, topology='per_event',
+                 work_queues=4, trace_exporter=None, trace_config=None, trace_sample_rate=0.01, trace_batch_size=256,
+                 trace_flush_interval=5, backpressure=None, record=None, exchange_shards=None, confirm_timeout=30):
+        """Constructor."""
+        super(self.__class__, self).__init__(events=events)
+        self.config = locals()
+
+        if topology not in ('per_event', 'consolidated'):
+            raise Exception('Unknown topology "%s"' % topology)
+
+        # Consumers of shared work queues get every event type in them, so prefetch can't be limited per event type
+        if topology == 'consolidated' and event_prefetch:
+            raise Exception('Prefetch limits per event type can\'t be used with the consolidated topology')
+
+        self.config['exchange_shards'] = exchange_shards or '%s.shards' % exchange_topic
+        self.config['event_prefetch'] = event_prefetch or {}
+        self.config['event_weights'] = event_weights or {}
+
+        # Map configured lane weights (keyed by priority name) onto message priorities
+        weights = {'BULK': 1, 'NORMAL': 4, 'HIGH': 16, 'URGENT': 64}
+        weights.update(priority_weights or {})
+        self.priority_weights = {MessagePriority[name].value: weight for name, weight in weights.items()}
+        self.dispatcher = WeightedDispatcher()
+        self.envelopes = EnvelopeReader()
+        self.compressor = Compressor(compression, compression_threshold, compression_level, compression_dictionaries)
+        self.blobs = create_blob_store(blob_store, blob_config) if blob_store else None
+        self.tracer = None
+        self.spool = None
+        self.topology = None
+        self.connection = None
+        self.channel = None
+        self.publish_channel = None
+        self.pool = None
+        self.subscriptions = {}
+        self.connected = False
+        self.expired = collections.Counter()
+        self.backpressure = Backpressure(**backpressure) if backpressure else None
+        self.recorder = Recorder(**record) if record else None
+        self.confirms = {}
+        self._recovery_attempts = 0
+        self._depth_measured = 0
+
+        # Handlers are traced through the event manager, so that spans cover every handler separately
+        if trace_exporter:
+            self.tracer = Tracer(create_span_exporter(trace_exporter, trace_config), trace_sample_rate,
+                                 trace_batch_size, trace_flush_interval, self.node_identifier)
+            self.events.tracer = self.tracer
+
+
+class MemoryQueueConnector(AbstractQueueConnector):
+
+    """This class provides a queue in memory shared by the processes of a single node, in place of a broker.
+
+    It is meant for benchmarking and testing without a broker. The connector
+    has to be created before worker processes are forked, and can only
+    deliver events to the node it was created on. Every event is handled by
+    a single worker process, including events sent to all nodes. Message
+    priorities are ignored, and events can't be delayed durably.
+    """
+
+    @property
+    def messages(self):
+        """Return the queue of published messages."""
+        return self._messages
+
+    @messages.setter
+    def messages(self, value):
+        """Set the queue of published messages."""
+        self._messages = value
+
+    @property
+    def envelopes(self):
+        """Return the reader for event envelopes."""
+        return self._envelopes
+
+    @envelopes.setter
+    def envelopes(self, value):
+        """Set the reader for event envelopes."""
+        self._envelopes = value
+
+    def start(self, produce_only=False, events=None):
+        """Do nothing, as there is nothing to connect to."""
+        logger.debug('Memory connector started successfully')
+
+    def stop(self):
+        """Do nothing, as there is nothing to disconnect from."""
+        logger.debug('Memory connector stopped successfully')
+
+    def publish(self, event, demographic, reply_event, affinity=None, priority=MessagePriority.NORMAL,
+                deadline=None, delay=None):
+        """Publish an event."""
+        if delay is not None:
+            raise Exception('The memory queue connector can\'t delay events durably!')
+
+        if not isinstance(demographic, EventDemographic) and demographic != self.node_identifier:
+            raise Exception('The memory queue connector can\'t deliver events to node "%s"!' % demographic)
+
+        self.messages.put((
+            msgpack.dumps(event, use_bin_type=True),
+            reply_event.uuid if reply_event else None,
+            deadline
+        ))
+
+    def fetch(self):
+        """Fetch and handle a single event, waiting for it for a little while."""
+        try:
+            body, correlation_id, deadline = self.messages.get(timeout=0.5)
+        except Empty:
+            return
+
+        event_name, data = self.envelopes.read(body)
+
+        if deadline is not None and deadline < time.time():
+            logger.debug('Dropped an expired "%s" event', event_name)
+            return
+
+        event = load_event(event_name, data)
+        event._source = self.node_identifier
+        event._reply_to_uuid = correlation_id
+
+        self.events.handle(event)
+
+    def depths(self):
+        """Return a dict containing the amount of messages in the queue."""
+        return {'memory': self.messages.qsize()}
+
+    def __init__(self, events, maxsize=0):
         """Constructor."""
         super(self.__class__, self).__init__(events=events)
         self.config = locals()
+        self.messages = multiprocessing.Queue(maxsize)
+        self.envelopes = EnvelopeReader()
@@ -0,0 +1,272 @@
+"""Record module."""
+import os
+import time
+import heapq
+import queue
+import random
+import logging
+import threading
+import msgpack
+from nite.event import EventDemographic, MessagePriority
+from nite.spool import Segment, SegmentLog
+from nite.pressure import BackpressureError
+from nite.util import percentile
+
+
+logger = logging.getLogger(__name__)
+
+
+class Recorder:
+
+    """This class records the events passing through a queue connector, to be replayed later.
+
+    Events are recorded either as they're published (`tap` is `publish`) or
+    as they're consumed by worker processes (`tap` is `consume`), into
+    segment logs of length-prefixed msgpack records. Every process records
+    into a segment log of its own, in a directory under `path`, as segment
+    logs can't be shared between processes. Only `sample_rate` of all events
+    are recorded.
+
+    Records contain the time an event passed, the demographic it was sent
+    to, its message priority and its serialized (uncompressed) body. Events
+    consumed from the fanout exchange are recorded as sent to all nodes, and
+    any other consumed events as sent to a single node.
+    """
+
+    @property
+    def path(self):
+        """Return the directory containing the segment logs of all processes."""
+        return self._path
+
+    @property
+    def tap(self):
+        """Return where events are recorded, either `publish` or `consume`."""
+        return self._tap
+
+    def record(self, demographic, priority, body):
+        """Record a serialized event sent to a demographic with a `MessagePriority`, unless it isn't sampled."""
+        if self._sample_rate < 1 and random.random() >= self._sample_rate:
+            return
+
+        # Segment logs are opened lazily, as worker processes are forked after the recorder is created
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._log = SegmentLog(os.path.join(self.path, '%s-%i' % (self.tap, os.getpid())),
+                                           **self._config)
+                    self._pid = os.getpid()
+
+        if isinstance(demographic, EventDemographic):
+            demographic = demographic.name
+
+        self._log.append(msgpack.dumps([time.time(), demographic, priority.value, bytes(body)], use_bin_type=True))
+
+    def close(self):
+        """Flush and close the segment log of the current process."""
+        with self._lock:
+            if self._pid == os.getpid():
+                self._log.close()
+                self._pid = None
+
+    def __init__(self, path, tap='publish', sample_rate=1.0, segment_size=67108864, max_bytes=1073741824,
+                 fsync='interval', fsync_interval=1.0):
+        """Constructor."""
+        if tap not in ('publish', 'consume'):
+            raise Exception('Events can\'t be recorded on "%s"' % tap)
+
+        self._path = path
+        self._tap = tap
+        self._sample_rate = sample_rate
+        self._config = {
+            'segment_size': segment_size,
+            'max_bytes': max_bytes,
+            'fsync': fsync,
+            'fsync_interval': fsync_interval,
+            'overflow': 'drop_oldest',
+        }
+        self._log = None
+        self._pid = None
+
+        # Threads of the main process may record the first event of a process at the same time
+        self._lock = threading.Lock()
+
+
+def read_log(path):
+    """Yield the records in a segment log, oldest first, without marking them as read."""
+    for name in sorted(name for name in os.listdir(path) if name.endswith('.seg')):
+        segment = Segment(os.path.join(path, name), 0, read_only=True)
+
+        try:
+            record, offset = segment.read(Segment.HEADER.size)
+
+            while record is not None:
+                yield msgpack.loads(record, raw=False)
+                record, offset = segment.read(offset)
+        finally:
+            segment.close()
+
+
+def read_recording(path):
+    """Yield the records of all segment logs in a recording, ordered by the time they were recorded."""
+    # A single segment log may be passed as well
+    if any(name.endswith('.seg') for name in os.listdir(path)):
+        logs = [path]
+    else:
+        logs = [os.path.join(path, name) for name in sorted(os.listdir(path))
+                if os.path.isdir(os.path.join(path, name))]
+
+    return heapq.merge(*[read_log(log) for log in logs], key=lambda record: record[0])
+
+
+class Replay:
+
+    """This class triggers recorded events again, at the pace they were recorded at or faster.
+
+    Events are triggered `speed` times as fast as they were recorded, or as
+    fast as possible if `speed` is 0, capped at `max_rate` events per second
+    if passed. A single thread reads the recording and keeps the pace,
+    handing records to `threads` threads which trigger them, so more threads
+    only help when triggering is what holds a replay back.
+
+    Events which were sent to a specific node are sent to any single node
+    instead, as that node may no longer be around.
+    """
+
+    #: Amount of records read ahead per triggering thread.
+    READ_AHEAD = 64
+
+    @property
+    def events(self):
+        """Return the event manager events are triggered through."""
+        return self._events
+
+    def run(self):
+        """Replay the recording and return a summary of what happened."""
+        started = time.time()
+        records = queue.Queue(self._threads * self.READ_AHEAD)
+        threads = [threading.Thread(target=self.read, args=(records, started), name='NITE replay reader')]
+        threads += [threading.Thread(target=self.consume, args=(records,), name='NITE replay trigger #%i' % i)
+                    for i in range(0, self._threads)]
+
+        for thread in threads:
+            thread.start()
+
+        for thread in threads:
+            thread.join()
+
+        duration = max(time.time() - started, 1e-9)
+        latencies = sorted(self._latencies)
+        lags = sorted(self._lags)
+
+        summary = dict(self._stats)
+        summary.update({
+            'duration': duration,
+            'events_per_second': summary['triggered'] / duration,
+        })
+
+        if latencies:
+            summary.update({
+                'p50': percentile(latencies, 0.5),
+                'p99': percentile(latencies, 0.99),
+                'max': latencies[-1],
+            })
+
+        if lags:
+            summary.update({
+                'lag_p99': percentile(lags, 0.99),
+                'lag_max': lags[-1],
+            })
+
+        return summary
+
+    def read(self, records, started):
+        """Read the recording at the pace of the replay, and put its records on a queue for threads to trigger.
+
+        Every triggering thread is sent None once the recording has been read.
+        """
+        first = None
+        interval = 1.0 / self._max_rate if self._max_rate else 0
+        paced = bool(self._speed or interval)
+        due = started
+
+        try:
+            for i, (timestamp, demographic, priority, body) in enumerate(read_recording(self._path)):
+                if self._limit is not None and i >= self._limit:
+                    break
+
+                first = timestamp if first is None else first
+
+                # Keep the pace of the recording, without exceeding the maximum rate
+                if self._speed:
+                    due = max(due, started + (timestamp - first) / self._speed)
+
+                wait = due - time.time()
+                if wait > 0:
+                    time.sleep(wait)
+
+                records.put((demographic, priority, body, due if paced else None))
+                due += interval
+        finally:
+            for _ in range(0, self._threads):
+                records.put(None)
+
+    def consume(self, records):
+        """Trigger records taken from a queue, until None is taken."""
+        record = records.get()
+
+        while record is not None:
+            self.trigger(*record)
+            record = records.get()
+
+    def trigger(self, demographic, priority, body, due=None):
+        """Trigger a single recorded event, which was due at `due` if the replay is paced."""
+        demographic = EventDemographic.__members__.get(demographic, EventDemographic.GLOBAL_SINGLE)
+        started = time.time()
+
+        try:
+            triggered = self.events.trigger(msgpack.loads(body, raw=False), demographic,
+                                            priority=MessagePriority(priority))
+        except BackpressureError:
+            triggered = None
+        except Exception:
+            logger.warning('Failed to replay an event', exc_info=True)
+            triggered = None
+
+        with self._lock:
+            if triggered:
+                self._stats['triggered'] += 1
+                self._latencies.append(time.time() - started)
+
+                if due is not None:
+                    self._lags.append(max(0, started - due))
+            else:
+                self._stats['shed' if triggered is False else 'failed'] += 1
+
+    def __init__(self, events, path, speed=1.0, threads=1, max_rate=None, limit=None):
+        """Constructor."""
+        self._events = events
+        self._path = path
+        self._speed = speed
+        self._threads = max(1, threads)
+        self._max_rate = max_rate
+        self._limit = limit
+        self._lock = threading.Lock()
+        self._latencies = []
+        self._lags = []
+        self._stats = {'triggered': 0, 'shed': 0, 'failed': 0}
+
+
+def report(summary):
+    """Return a human-readable report of a replay summary."""
+    lines = ['%i event(s) triggered in %.1fs (%.0f/s), %i shed, %i failed' % (
+        summary['triggered'], summary['duration'], summary['events_per_second'], summary['shed'], summary['failed'])]
+
+    if 'p50' in summary:
+        lines.append('trigger latency: p50 %.2fms, p99 %.2fms, max %.2fms' % (
+            summary['p50'] * 1000, summary['p99'] * 1000, summary['max'] * 1000))
+
+    if 'lag_p99' in summary:
+        lines.append('behind schedule: p99 %.2fms, max %.2fms' % (
+            summary['lag_p99'] * 1000, summary['lag_max'] * 1000))
+
+    return '\n'.join(lines)
@@ -0,0 +1,338 @@
+"""Spool module."""
+import os
+import time
+import mmap
+import struct
+import logging
+import threading
+
+
+logger = logging.getLogger(__name__)
+
+
+class SpoolFullError(Exception):
+
+    """Raised when a record can't be appended to a full segment log which doesn't drop records."""
+
+    pass
+
+
+class Segment:
+
+    """A single memory-mapped segment file of a `SegmentLog`.
+
+    Segments start with a header containing the offset of the first record
+    which hasn't been read yet, followed by length-prefixed records. A
+    length of zero marks the end of the records written so far.
+    """
+
+    HEADER = struct.Struct('<Q')
+    LENGTH = struct.Struct('<I')
+
+    @property
+    def path(self):
+        """Return the path of the segment file."""
+        return self._path
+
+    @property
+    def write_offset(self):
+        """Return the offset at which the next record will be written."""
+        return self._write_offset
+
+    @property
+    def read_offset(self):
+        """Return the offset of the first record which hasn't been read yet."""
+        return self.HEADER.unpack_from(self._mapping, 0)[0]
+
+    @read_offset.setter
+    def read_offset(self, value):
+        """Set the offset of the first record which hasn't been read yet."""
+        self.HEADER.pack_into(self._mapping, 0, value)
+
+    def fits(self, record):
+        """Return whether a record fits into the remaining space of this segment."""
+        return self.write_offset + self.LENGTH.size + len(record) + self.LENGTH.size <= len(self._mapping)
+
+    def append(self, record):
+        """Append a record."""
+        offset = self.write_offset + self.LENGTH.size
+        self._mapping[offset:offset + len(record)] = record
+
+        # Write the length last, so that a crash never exposes a partial record
+        self.LENGTH.pack_into(self._mapping, self.write_offset, len(record))
+        self._write_offset = offset + len(record)
+
+    def read(self, offset):
+        """Return the record at an offset and the offset of the next one, or None and the offset if there is none."""
+        if offset + self.LENGTH.size > len(self._mapping):
+            return None, offset
+
+        length = self.LENGTH.unpack_from(self._mapping, offset)[0]
+        if not length:
+            return None, offset
+
+        start = offset + self.LENGTH.size
+        return bytes(self._mapping[start:start + length]), start + length
+
+    def flush(self):
+        """Flush written records to disk."""
+        self._mapping.flush()
+
+    def close(self):
+        """Unmap and close the segment file."""
+        self._mapping.close()
+        os.close(self._descriptor)
+
+    def __init__(self, path, size, read_only=False):
+        """Open a segment file, creating it with room for `size` bytes if it doesn't exist.
+
+        Segments opened with `read_only` must exist already, and can only be read.
+        """
+        self._path = path
+        created = not read_only and not os.path.exists(path)
+
+        self._descriptor = os.open(path, os.O_RDONLY if read_only else os.O_RDWR | os.O_CREAT, 0o600)
+        if created:
+            os.ftruncate(self._descriptor, size)
+
+        self._mapping = mmap.mmap(self._descriptor, 0, access=mmap.ACCESS_READ if read_only else mmap.ACCESS_WRITE)
+
+        if created:
+            self.read_offset = self.HEADER.size
+
+        # Find the end of the records written so far
+        self._write_offset = self.read_offset
+        while True:
+            record, offset = self.read(self._write_offset)
+            if record is None:
+                break
+            self._write_offset = offset
+
+
+class SegmentLog:
+
+    """This class provides an append-only log of records on local disk, split into memory-mapped segments.
+
+    Records are appended to the newest segment until it is full, at which
+    point a new segment is started. Segments are removed once every record
+    in them has been read. Reading progress is kept in the segments
+    themselves, so it survives restarts.
+
+    `fsync` determines when written records are flushed to disk: after
+    every record (`always`), at most every `fsync_interval` seconds
+    (`interval`) or whenever the OS sees fit (`never`). With `interval`,
+    `sync()` has to be called periodically as well, or records appended
+    last wait for the next record to be appended.
+
+    Once the log takes up `max_bytes`, the oldest segment is dropped to make
+    room if `overflow` is `drop_oldest`, or a `SpoolFullError` is raised if
+    `overflow` is `reject`.
+    """
+
+    #: Maximum amount of records read at once while replaying.
+    BATCH_SIZE = 256
+
+    @property
+    def path(self):
+        """Return the directory containing the segments."""
+        return self._path
+
+    @property
+    def stats(self):
+        """Return a dict containing the amount of records appended, read and dropped."""
+        return self._stats
+
+    @property
+    def size(self):
+        """Return the amount of bytes taken up by segments on disk."""
+        return len(self._segments) * self._segment_size
+
+    def append(self, record):
+        """Append a record to the log."""
+        if Segment.HEADER.size + Segment.LENGTH.size * 2 + len(record) > self._segment_size:
+            raise Exception('A record of %i bytes doesn\'t fit in a segment of %i bytes' %
+                            (len(record), self._segment_size))
+
+        with self._lock:
+            if not self._segments or not self._segments[-1].fits(record):
+                self.rotate()
+
+            self._segments[-1].append(record)
+            self._stats['appended'] += 1
+            self._pending += 1
+            self._dirty = True
+
+            if self._fsync == 'always':
+                self.flush()
+            else:
+                self.sync()
+
+    def rotate(self):
+        """Start a new segment, making room for it first if needed."""
+        while self.size + self._segment_size > self._max_bytes and self._segments:
+            if self._overflow == 'reject':
+                raise SpoolFullError('The segment log in "%s" is full' % self.path)
+
+            dropped = self.count(self._segments[0])
+            self.remove(self._segments.pop(0))
+            self._stats['dropped'] += dropped
+            self._pending -= dropped
+            logger.warning('Dropped %i record(s) from the segment log in "%s" to make room', dropped, self.path)
+
+        if self._segments:
+            self._segments[-1].flush()
+
+        self._sequence += 1
+        self._segments.append(Segment(os.path.join(self.path, '%020i.seg' % self._sequence), self._segment_size))
+
+    def replay(self, callback, limit=None, commit=None):
+        """Pass unread records to `callback` in the order they were appended, and return how many were passed.
+
+        A record only counts as read once `callback` returns. If it raises,
+        replaying stops and the record will be replayed again next time.
+
+        If `commit` is passed, it is called after every batch of records, and
+        records only count as read once it returns. If it raises, replaying
+        stops and the whole batch will be replayed again next time.
+
+        Records are read in batches, and `callback` is called without holding
+        on to the log, so records can be appended while others are replayed.
+        Only a single thread replays at a time.
+        """
+        replayed = 0
+
+        with self._replaying:
+            while limit is None or replayed < limit:
+                segment, batch = self.read_batch(self.BATCH_SIZE if limit is None else
+                                                 min(self.BATCH_SIZE, limit - replayed))
+
+                if not batch:
+                    break
+
+                for record, offset in batch:
+                    callback(record)
+                    replayed += 1
+
+                    if commit is None and not self.advance(segment, offset, 1):
+                        break
+
+                if commit is not None:
+                    commit()
+                    self.advance(segment, batch[-1][1], len(batch))
+
+        return replayed
+
+    def advance(self, segment, offset, count):
+        """Mark `count` records of a segment as read, up to `offset`, and return whether the segment is still there."""
+        with self._lock:
+            # The segment may have been dropped to make room in the meantime, along with its records
+            if segment not in self._segments:
+                return False
+
+            segment.read_offset = offset
+            self._pending -= count
+            self._stats['read'] += count
+
+        return True
+
+    def read_batch(self, size):
+        """Return the oldest segment with unread records, and at most `size` of those with the offset following them.
+
+        Fully read segments are removed along the way.
+        """
+        with self._lock:
+            while self._segments:
+                segment = self._segments[0]
+                batch = []
+                record, offset = segment.read(segment.read_offset)
+
+                while record is not None and len(batch) < size:
+                    batch.append((record, offset))
+                    record, offset = segment.read(offset)
+
+                # Fully read segments can go, unless we're still writing to them
+                if batch or len(self._segments) == 1:
+                    return segment, batch
+
+                self.remove(self._segments.pop(0))
+
+        return None, []
+
+    def count(self, segment):
+        """Return the amount of unread records in a segment."""
+        count = 0
+        record, offset = segment.read(segment.read_offset)
+
+        while record is not None:
+            count += 1
+            record, offset = segment.read(offset)
+
+        return count
+
+    def remove(self, segment):
+        """Close and delete a segment."""
+        segment.close()
+        os.unlink(segment.path)
+
+    def sync(self):
+        """Flush written records to disk if the fsync policy says they're due.
+
+        With the `interval` policy, this should be called periodically, so
+        that records reach the disk even if nothing is appended after them.
+        """
+        with self._lock:
+            if self._fsync == 'interval' and self._dirty and time.time() - self._flushed >= self._fsync_interval:
+                self.flush()
+
+    def flush(self):
+        """Flush written records to disk."""
+        with self._lock:
+            if self._segments:
+                self._segments[-1].flush()
+
+            self._flushed = time.time()
+            self._dirty = False
+
+    def close(self):
+        """Flush and close all segments."""
+        with self._lock:
+            for segment in self._segments:
+                segment.flush()
+                segment.close()
+
+            self._segments = []
+
+    def __len__(self):
+        """Return the amount of unread records."""
+        return self._pending
+
+    def __init__(self, path, segment_size=67108864, max_bytes=1073741824, fsync='interval', fsync_interval=1.0,
+                 overflow='drop_oldest'):
+        """Open the segment log in `path`, picking up where a previous instance left off."""
+        if fsync not in ('always', 'interval', 'never'):
+            raise Exception('Unknown fsync policy "%s"' % fsync)
+
+        if overflow not in ('drop_oldest', 'reject'):
+            raise Exception('Unknown overflow policy "%s"' % overflow)
+
+        self._path = path
+        self._segment_size = segment_size
+        self._max_bytes = max_bytes
+        self._fsync = fsync
+        self._fsync_interval = fsync_interval
+        self._overflow = overflow
+        self._flushed = time.time()
+        self._dirty = False
+        self._lock = threading.RLock()
+        self._replaying = threading.Lock()
+        self._stats = {'appended': 0, 'read': 0, 'dropped': 0}
+
+        os.makedirs(path, exist_ok=True)
+
+        names = sorted(name for name in os.listdir(path) if name.endswith('.seg'))
+        self._segments = [Segment(os.path.join(path, name), segment_size) for name in names]
+        self._sequence = int(names[-1][:-4]) if names else 0
+        self._pending = sum(self.count(segment) for segment in self._segments)
+
+        if self._pending:
+            logger.info('Found %i unread record(s) in the segment log in "%s"', self._pending, path)
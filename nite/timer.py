@@ -0,0 +1,400 @@
+"""Timer module."""
+import os
+import time
+import logging
+import weakref
+import calendar
+import threading
+from datetime import datetime, timedelta
+
+
+logger = logging.getLogger(__name__)
+
+
+class Timer:
+
+    """A single pending timer, as returned by `TimerScheduler`.
+
+    Call `cancel()` to make sure the timer never fires (again).
+    """
+
+    @property
+    def deadline(self):
+        """Return the UNIX timestamp at which this timer fires next."""
+        return self._deadline
+
+    @deadline.setter
+    def deadline(self, value):
+        """Set the UNIX timestamp at which this timer fires next."""
+        self._deadline = value
+
+    @property
+    def callback(self):
+        """Return the function called when this timer fires."""
+        return self._callback
+
+    @callback.setter
+    def callback(self, value):
+        """Set the function called when this timer fires."""
+        self._callback = value
+
+    @property
+    def recurrence(self):
+        """Return the recurrence of this timer, or None for one-shot timers.
+
+        The recurrence is either an interval in seconds or a `CronSchedule`.
+        """
+        return self._recurrence
+
+    @recurrence.setter
+    def recurrence(self, value):
+        """Set the recurrence of this timer."""
+        self._recurrence = value
+
+    @property
+    def cancelled(self):
+        """Return whether or not this timer has been cancelled."""
+        return self._cancelled
+
+    def next_deadline(self):
+        """Return the deadline following the current one, or None if this timer doesn't recur."""
+        if self.recurrence is None:
+            return None
+
+        if isinstance(self.recurrence, CronSchedule):
+            return self.recurrence.next(self.deadline)
+
+        return self.deadline + self.recurrence
+
+    def cancel(self):
+        """Cancel this timer."""
+        self._cancelled = True
+
+        if self._scheduler is not None:
+            self._scheduler.remove(self)
+
+    def __init__(self, deadline, callback, recurrence=None):
+        """Constructor."""
+        self.deadline = deadline
+        self.callback = callback
+        self.recurrence = recurrence
+        self._cancelled = False
+        self._scheduler = None
+        self._slot = None
+        self._expires = None
+        self._target = None
+
+
+class TimerWheel:
+
+    """A hierarchical timing wheel.
+
+    The first wheel has one slot per tick. Every following wheel has slots
+    spanning a full revolution of the wheel before it. Timers are put into
+    the slot of the smallest wheel that can hold them, and are cascaded into
+    smaller wheels as time advances. Slots are sets, so both inserting and
+    cancelling a timer is O(1), regardless of the amount of pending timers.
+
+    Timers further away than the wheels span are put into the last slot
+    they can reach, and put back in once that slot comes around, until
+    their own tick does.
+    """
+
+    ROOT_BITS = 8
+    LEVEL_BITS = 6
+    LEVELS = 5
+
+    @property
+    def tick(self):
+        """Return the amount of ticks which have passed."""
+        return self._tick
+
+    def add(self, timer, expires):
+        """Insert a timer which expires at tick `expires`.
+
+        Timers which should already have expired expire on the next tick.
+        """
+        timer._target = max(expires, self._tick + 1)
+        self.place(timer, timer._target)
+        self._size += 1
+
+    def place(self, timer, expires):
+        """Put a timer into the slot of the smallest wheel which can hold it."""
+        expires = min(expires, self._tick + self._span - 1)
+        delta = expires - self._tick
+
+        level = 0
+        while level < self.LEVELS - 1 and delta >= 1 << (self.ROOT_BITS + self.LEVEL_BITS * level):
+            level += 1
+
+        slot = self._wheels[level][self.slot_index(level, expires)]
+        slot.add(timer)
+        timer._slot = slot
+        timer._expires = expires
+
+    def remove(self, timer):
+        """Remove a timer."""
+        if timer._slot is not None:
+            timer._slot.discard(timer)
+            timer._slot = None
+            self._size -= 1
+
+    def advance(self):
+        """Advance the wheel by a single tick and return the timers which expired."""
+        self._tick += 1
+
+        # Whenever a wheel wraps around, the next slot of the wheel above it is cascaded down
+        if not self._tick & ((1 << self.ROOT_BITS) - 1):
+            for level in range(1, self.LEVELS):
+                index = self.slot_index(level, self._tick)
+                self.cascade(level, index)
+
+                if index:
+                    break
+
+        slot = self._wheels[0][self.slot_index(0, self._tick)]
+        timers = list(slot)
+        slot.clear()
+        expired = []
+
+        for timer in timers:
+            # Timers which were out of reach when they were added are only due once their own tick comes around
+            if timer._target > self._tick:
+                self.place(timer, timer._target)
+                continue
+
+            timer._slot = None
+            expired.append(timer)
+
+        self._size -= len(expired)
+
+        return expired
+
+    def cascade(self, level, index):
+        """Redistribute the timers in a slot over the wheels below it."""
+        slot = self._wheels[level][index]
+        timers = list(slot)
+        slot.clear()
+
+        for timer in timers:
+            self.place(timer, timer._target)
+
+    def slot_index(self, level, tick):
+        """Return the index of the slot of a wheel containing a tick."""
+        shift = 0 if not level else self.ROOT_BITS + self.LEVEL_BITS * (level - 1)
+        return (tick >> shift) & ((1 << self._bits[level]) - 1)
+
+    def __len__(self):
+        """Return the amount of pending timers."""
+        return self._size
+
+    def __init__(self):
+        """Constructor."""
+        self._bits = [self.ROOT_BITS] + [self.LEVEL_BITS] * (self.LEVELS - 1)
+        self._wheels = [[set() for i in range(0, 1 << bits)] for bits in self._bits]
+        self._span = 1 << sum(self._bits)
+        self._tick = 0
+        self._size = 0
+
+
+class TimerScheduler:
+
+    """This class fires timers from a single background thread per process.
+
+    The thread is started lazily in every process that adds a timer, which
+    means that worker processes forked from the main process get their own
+    scheduler instead of a dead copy of the parent's.
+    """
+
+    @property
+    def resolution(self):
+        """Return the duration of a single tick in seconds."""
+        return self._resolution
+
+    @resolution.setter
+    def resolution(self, value):
+        """Set the duration of a single tick in seconds."""
+        self._resolution = value
+
+    def add(self, deadline, callback, recurrence=None):
+        """Call `callback` at UNIX timestamp `deadline` and return the `Timer`.
+
+        If `recurrence` is set, the callback is called again every time the
+        recurrence (an interval in seconds or a `CronSchedule`) comes around.
+        """
+        timer = Timer(deadline, callback, recurrence)
+        timer._scheduler = self
+
+        with self._lock:
+            self.ensure_running()
+            self._wheel.add(timer, self.ticks(deadline))
+
+        return timer
+
+    def remove(self, timer):
+        """Remove a pending timer."""
+        with self._lock:
+            self._wheel.remove(timer)
+
+    def ticks(self, timestamp):
+        """Return the tick at which a UNIX timestamp comes around."""
+        return int((timestamp - self._epoch) / self.resolution) + 1
+
+    def reset_lock(self):
+        """Replace the lock guarding the wheel, which the timer thread of a parent process may have held."""
+        self._lock = threading.Lock()
+
+    def ensure_running(self):
+        """Make sure this process has a running timer thread."""
+        if self._pid == os.getpid():
+            return
+
+        # Timers added in another process are not ours to fire
+        self._pid = os.getpid()
+        self._wheel = TimerWheel()
+        self._epoch = time.time()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self.run, name='NITE Timer Thread', daemon=True)
+        self._thread.start()
+
+    def run(self):
+        """Fire timers until stopped."""
+        while not self._stopped.wait(self.resolution):
+            target = self.ticks(time.time()) - 1
+            expired = []
+
+            with self._lock:
+                # Catch up on every tick which has passed, so timers never drift
+                while self._wheel.tick < target:
+                    expired.extend(self._wheel.advance())
+
+            for timer in expired:
+                self.fire(timer)
+
+    def fire(self, timer):
+        """Call the callback of an expired timer and reschedule it if it recurs."""
+        if timer.cancelled:
+            return
+
+        try:
+            timer.callback()
+        except Exception:
+            logger.exception('Timer callback %r raised an exception', timer.callback)
+
+        deadline = timer.next_deadline()
+        if deadline is not None and not timer.cancelled:
+            timer.deadline = deadline
+
+            with self._lock:
+                self._wheel.add(timer, self.ticks(deadline))
+
+    def stop(self):
+        """Stop firing timers in this process."""
+        if self._pid == os.getpid():
+            self._stopped.set()
+            self._thread.join()
+            self._pid = None
+
+    def __len__(self):
+        """Return the amount of pending timers."""
+        return len(self._wheel) if self._pid == os.getpid() else 0
+
+    def __init__(self, resolution=0.01):
+        """Constructor."""
+        self.resolution = resolution
+        self._lock = threading.Lock()
+        self._pid = None
+
+        # Only the forking thread survives a fork, so a lock held by the timer thread would never be released
+        reset_lock = weakref.WeakMethod(self.reset_lock)
+        os.register_at_fork(after_in_child=lambda: reset_lock() is not None and reset_lock()())
+
+
+class CronSchedule:
+
+    """A recurring schedule in the five field crontab format (minute, hour, day of month, month, day of week).
+
+    Fields support `*`, lists (`1,15`), ranges (`1-5`) and steps (`*/10`,
+    `0-30/5`). Days of week run from 0 (sunday) to 6. Schedules are
+    evaluated in UTC.
+    """
+
+    FIELDS = [(0, 59), (0, 23), (1, 31), (1, 12), (0, 6)]
+
+    @property
+    def expression(self):
+        """Return the crontab expression."""
+        return self._expression
+
+    def parse_field(self, field, minimum, maximum):
+        """Return the set of values matched by a single crontab field."""
+        values = set()
+
+        for part in field.split(','):
+            step = 1
+            if '/' in part:
+                part, step = part.split('/')
+                step = int(step)
+
+            if part == '*':
+                start, end = minimum, maximum
+            elif '-' in part:
+                start, end = [int(value) for value in part.split('-')]
+            else:
+                start = end = int(part)
+
+                # A step on a single value means "from this value onwards"
+                if step > 1:
+                    end = maximum
+
+            if start < minimum or end > maximum or start > end or step < 1:
+                raise ValueError('Invalid crontab field "%s"' % field)
+
+            values.update(range(start, end + 1, step))
+
+        return values
+
+    def matches_day(self, moment):
+        """Return whether a day matches the day of month and day of week fields.
+
+        As in cron, if both fields are restricted a day matches if either one does.
+        """
+        dom = moment.day in self._days
+        dow = (moment.isoweekday() % 7) in self._weekdays
+
+        if self._any_day or self._any_weekday:
+            return dom and dow
+
+        return dom or dow
+
+    def next(self, after):
+        """Return the first UNIX timestamp matching this schedule after UNIX timestamp `after`."""
+        moment = datetime.utcfromtimestamp(int(after) // 60 * 60) + timedelta(minutes=1)
+        limit = moment + timedelta(days=366 * 5)
+
+        while moment < limit:
+            if moment.month not in self._months:
+                moment = (moment.replace(day=1, hour=0, minute=0) + timedelta(days=32)).replace(day=1)
+            elif not self.matches_day(moment):
+                moment = moment.replace(hour=0, minute=0) + timedelta(days=1)
+            elif moment.hour not in self._hours:
+                moment = moment.replace(minute=0) + timedelta(hours=1)
+            elif moment.minute not in self._minutes:
+                moment += timedelta(minutes=1)
+            else:
+                return calendar.timegm(moment.utctimetuple())
+
+        raise ValueError('Crontab expression "%s" never matches' % self.expression)
+
+    def __init__(self, expression):
+        """Constructor."""
+        fields = expression.split()
+        if len(fields) != len(self.FIELDS):
+            raise ValueError('Crontab expression "%s" should have %i fields' % (expression, len(self.FIELDS)))
+
+        self._expression = expression
+        self._minutes, self._hours, self._days, self._months, self._weekdays = [
+            self.parse_field(field, minimum, maximum) for field, (minimum, maximum) in zip(fields, self.FIELDS)
+        ]
+        self._any_day = fields[2] == '*'
+        self._any_weekday = fields[4] == '*'
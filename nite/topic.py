@@ -0,0 +1,94 @@
+"""Topic module."""
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+def is_pattern(topic):
+    """Return whether or not a topic contains wildcards."""
+    return any(word in ('*', '#') for word in topic.split('.'))
+
+
+class TopicTrie:
+
+    """This class matches dot-separated names against topics which may contain wildcards.
+
+    Wildcards follow the semantics of AMQP topic exchanges: `*` matches
+    exactly one word and `#` matches zero or more words. Topics are kept in
+    a trie of words, and the result of matching a name is memoized until the
+    trie changes, so that repeated lookups cost no more than a dict lookup.
+    """
+
+    @property
+    def root(self):
+        """Return the root node of the trie."""
+        return self._root
+
+    def add(self, topic):
+        """Add a topic."""
+        node = self.root
+
+        for word in topic.split('.'):
+            node = node[0].setdefault(word, ({}, set()))
+
+        node[1].add(topic)
+        self._cache = {}
+
+    def remove(self, topic):
+        """Remove a topic."""
+        node = self.root
+
+        for word in topic.split('.'):
+            node = node[0].get(word)
+            if node is None:
+                return
+
+        node[1].discard(topic)
+        self._cache = {}
+
+    def match(self, name):
+        """Return a tuple of topics matching a name, with the name itself (if it was added) first."""
+        try:
+            return self._cache[name]
+        except KeyError:
+            pass
+
+        matches = set()
+        self.walk(self.root, name.split('.'), 0, matches)
+
+        result = tuple(sorted(matches, key=lambda topic: (topic != name, topic)))
+        self._cache[name] = result
+
+        return result
+
+    def walk(self, node, words, index, matches):
+        """Collect the topics in a node matching the words of a name from `index` onwards."""
+        children, topics = node
+        hashed = children.get('#')
+
+        # A hash matches zero or more words, so try every remaining suffix
+        if hashed is not None:
+            for i in range(index, len(words) + 1):
+                self.walk(hashed, words, i, matches)
+
+        if index == len(words):
+            matches.update(topics)
+            return
+
+        for word in (words[index], '*'):
+            child = children.get(word)
+            if child is not None:
+                self.walk(child, words, index + 1, matches)
+
+    def __contains__(self, name):
+        """Return whether or not any topic matches a name."""
+        return bool(self.match(name))
+
+    def __init__(self, topics=None):
+        """Constructor."""
+        self._root = ({}, set())
+        self._cache = {}
+
+        for topic in topics or []:
+            self.add(topic)
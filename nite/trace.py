@@ -0,0 +1,302 @@
+"""Trace module."""
+import os
+import json
+import time
+import random
+import socket
+import logging
+import threading
+import weakref
+import contextlib
+from nite.util import instantiate
+
+
+logger = logging.getLogger(__name__)
+
+#: Context manager which does nothing, used in place of spans which aren't recorded.
+UNTRACED = contextlib.nullcontext()
+
+
+class SpanExporters:
+
+    """This class helps map span exporters to their identifiers."""
+
+    file = ['nite.trace', 'FileSpanExporter']
+
+
+def create_span_exporter(type, config=None):
+    """Initialize and return a span exporter of a certain type."""
+    # If the span exporter isn't mapped at all, throw an error.
+    if not hasattr(SpanExporters, type):
+        raise Exception('A span exporter with the type "%s" can\'t be created!' % type)
+
+    # Fetch loader data
+    loader_data = getattr(SpanExporters, type)
+
+    # Instantiate the class with our args
+    return instantiate(loader_data[0], loader_data[1], **(config or {}))
+
+
+def create_id():
+    """Return a random 64-bit identifier for a trace or span, as hex."""
+    return '%016x' % random.getrandbits(64)
+
+
+class Span:
+
+    """This class represents a timed operation, which is part of a trace.
+
+    Spans of traces which aren't sampled are never exported, and only carry
+    that decision on to the events triggered inside of them.
+    """
+
+    __slots__ = ['trace_id', 'span_id', 'parent_id', 'name', 'start', 'end', 'attributes', 'sampled']
+
+    def dump(self):
+        """Turn this span into plain data."""
+        return {
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'name': self.name,
+            'start': self.start,
+            'duration': self.end - self.start,
+            'attributes': self.attributes,
+        }
+
+    def __init__(self, trace_id, parent_id, name, start=None, attributes=None, sampled=True):
+        """Start a span."""
+        self.trace_id = trace_id
+        self.span_id = create_id()
+        self.parent_id = parent_id
+        self.name = name
+        self.start = time.time() if start is None else start
+        self.end = None
+        self.attributes = attributes or {}
+        self.sampled = sampled
+
+
+class AbstractSpanExporter:
+
+    """This class sends finished spans somewhere they can be looked at."""
+
+    def export(self, spans):
+        """Export a batch of finished spans, as plain data.
+
+        This is an abstract method. You should implement your own.
+
+        """
+        raise NotImplementedError(
+            'All (indirect) derivatives of `AbstractSpanExporter` must implement an `export` method.')
+
+    def close(self):
+        """Release whatever the exporter holds on to."""
+        pass
+
+
+class FileSpanExporter(AbstractSpanExporter):
+
+    """This class appends spans to a local file as JSON lines.
+
+    Every process on a node may append to the same file, as every batch is
+    written with a single call.
+    """
+
+    def export(self, spans):
+        """Append a batch of finished spans to the file."""
+        # File descriptors aren't shared with forked processes, to keep writes from getting tangled up
+        if self._pid != os.getpid():
+            self.close()
+            self._descriptor = os.open(self._path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            self._pid = os.getpid()
+
+        os.write(self._descriptor, ''.join(json.dumps(span) + '\n' for span in spans).encode('utf-8'))
+
+    def close(self):
+        """Close the file."""
+        if self._descriptor is not None:
+            os.close(self._descriptor)
+            self._descriptor = None
+
+    def __init__(self, path='/tmp/nite/spans.jsonl'):
+        """Constructor."""
+        self._path = path
+        self._descriptor = None
+        self._pid = None
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+
+class Tracer:
+
+    """This class records spans for sampled traces, and carries trace context across events.
+
+    The span being recorded in a thread is kept in a thread-local stack, so
+    that events triggered while handling an event become part of its trace.
+    Whether a trace is sampled is decided once, when it starts, at
+    `sample_rate`; unsampled traces cost next to nothing. Finished spans are
+    buffered and handed to the exporter in batches of `batch_size`, or after
+    `flush_interval` seconds, provided `flush()` is called periodically.
+    """
+
+    @property
+    def exporter(self):
+        """Return the exporter for finished spans, or None if tracing is disabled."""
+        return self._exporter
+
+    @property
+    def sample_rate(self):
+        """Return the fraction of traces which are sampled."""
+        return self._sample_rate
+
+    @property
+    def node_identifier(self):
+        """Return the node identifier recorded with every span."""
+        return self._node_identifier
+
+    def current(self):
+        """Return the span being recorded in the current thread, or None."""
+        stack = getattr(self._local, 'stack', None)
+        return stack[-1] if stack else None
+
+    def inject(self, headers):
+        """Add the trace context of the current thread to the headers of a message being published.
+
+        Outside of any trace, this is where traces start, sampled or not.
+        Inside of one, whether it was sampled is passed on as is.
+        """
+        if self.exporter is None:
+            return
+
+        span = self.current()
+
+        if span is not None:
+            headers['x-nite-trace-id'] = span.trace_id
+            headers['x-nite-sampled'] = 1 if span.sampled else 0
+
+            if span.sampled:
+                headers['x-nite-span-id'] = span.span_id
+        else:
+            headers['x-nite-trace-id'] = create_id()
+            headers['x-nite-sampled'] = 1 if random.random() < self.sample_rate else 0
+
+        if headers['x-nite-sampled']:
+            headers['x-nite-published'] = time.time()
+
+    def receive(self, headers, name, **attributes):
+        """Start recording the handling of a received message and return its span, or None if it isn't traced.
+
+        The time the message spent queueing is recorded as a span of its own.
+        Messages of unsampled traces get a span as well, which isn't recorded
+        but keeps events triggered while handling them out of the sample.
+        """
+        if self.exporter is None or 'x-nite-trace-id' not in headers:
+            return None
+
+        trace_id, parent_id = headers['x-nite-trace-id'], headers.get('x-nite-span-id')
+
+        if not headers.get('x-nite-sampled'):
+            span = Span(trace_id, parent_id, name, sampled=False)
+            self.push(span)
+
+            return span
+
+        published = headers.get('x-nite-published')
+
+        if published is not None:
+            wait = Span(trace_id, parent_id, 'queue', published, attributes)
+            self.finish(wait)
+
+        span = Span(trace_id, parent_id, name, attributes=attributes)
+        self.push(span)
+
+        return span
+
+    def push(self, span):
+        """Make a span the current span of the current thread."""
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+
+        self._local.stack.append(span)
+
+    def pop(self, span):
+        """Finish the current span of the current thread, exporting it if it is sampled."""
+        self._local.stack.remove(span)
+
+        if span.sampled:
+            self.finish(span)
+
+    @contextlib.contextmanager
+    def record(self, name, attributes):
+        """Return a context manager recording a span inside of the current span."""
+        parent = self.current()
+        span = Span(parent.trace_id, parent.span_id, name, attributes=attributes)
+        self.push(span)
+
+        try:
+            yield span
+        finally:
+            self.pop(span)
+
+    def span(self, name, **attributes):
+        """Return a context manager recording a span inside of the current span, if it is being recorded."""
+        current = self.current()
+
+        if current is None or not current.sampled:
+            return UNTRACED
+
+        return self.record(name, attributes)
+
+    def finish(self, span):
+        """Finish a span and buffer it for exporting."""
+        span.end = time.time()
+        data = span.dump()
+        data['node'] = self.node_identifier
+        data['pid'] = os.getpid()
+
+        with self._lock:
+            self._buffer.append(data)
+
+            if len(self._buffer) >= self._batch_size or time.time() - self._flushed >= self._flush_interval:
+                self.flush()
+
+    def flush(self):
+        """Export buffered spans."""
+        with self._lock:
+            spans, self._buffer = self._buffer, []
+            self._flushed = time.time()
+
+            if not spans:
+                return
+
+            try:
+                self.exporter.export(spans)
+            except Exception:
+                logger.warning('Dropped %i span(s) which couldn\'t be exported', len(spans), exc_info=True)
+
+    def reset(self):
+        """Let go of the spans buffered by the parent process, and of its lock, after forking."""
+        self._lock = threading.RLock()
+        self._buffer = []
+        self._flushed = time.time()
+
+    def close(self):
+        """Export buffered spans and close the exporter."""
+        if self.exporter is not None:
+            self.flush()
+            self.exporter.close()
+
+    def __init__(self, exporter=None, sample_rate=0.01, batch_size=256, flush_interval=5,
+                 node_identifier=None):
+        """Create a tracer exporting spans through `exporter`, or a disabled tracer if there is none."""
+        self._exporter = exporter
+        self._sample_rate = sample_rate
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+        self._node_identifier = node_identifier or socket.getfqdn()
+        self._local = threading.local()
+        self.reset()
+
+        # Spans buffered by the parent are its to export, and its timer thread may hold the lock while forking
+        reset = weakref.WeakMethod(self.reset)
+        os.register_at_fork(after_in_child=lambda: reset() is not None and reset()())
@@ -1,4 +1,6 @@
 """Util module."""
+import hashlib
+import struct
 
 
 def get_module_attr(module_name, attr_name):
@@ -15,3 +17,46 @@ def instantiate(module_name, class_name, *args, **kwargs):
     class_ = get_module_attr(module_name, class_name)
     # Instantiate the class with our args and return the instance
     return class_(*args, **kwargs)
+
+
+def stable_hash(value):
+    """Return a 64-bit hash of `value` which is stable across processes and nodes.
+
+    The builtin `hash()` is salted per interpreter, which makes it useless for
+    anything that has to agree between processes.
+    """
+    digest = hashlib.md5(str(value).encode('utf-8')).digest()
+    return struct.unpack('>Q', digest[:8])[0]
+
+
+def jump_hash(key, buckets):
+    """Map `key` onto one of `buckets` buckets using jump consistent hashing.
+
+    Growing the amount of buckets from n to n + 1 only moves 1 / (n + 1) of
+    all keys, which keeps per-key locality intact when shards are added.
+
+    See: http://arxiv.org/abs/1406.2294
+    """
+    key = stable_hash(key)
+    bucket, candidate = -1, 0
+
+    while candidate < buckets:
+        bucket = candidate
+        key = (key * 2862933555777941757 + 1) & 0xffffffffffffffff
+        candidate = int((bucket + 1) * (float(1 << 31) / float((key >> 33) + 1)))
+
+    return bucket
+
+
+def rendezvous_score(member, key, limit=32767):
+    """Return the highest-random-weight score of `member` for `key`, in the range [0, limit].
+
+    The member with the highest score for a key owns that key. When a member
+    leaves, only the keys it owned move to the runner-up.
+    """
+    return stable_hash('%s:%s' % (member, key)) % (limit + 1)
+
+
+def percentile(values, fraction):
+    """Return the value below which `fraction` of a sorted list of values falls."""
+    return values[min(len(values) - 1, int(fraction * len(values)))]
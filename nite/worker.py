@@ -1,13 +1,66 @@
 """Worker module."""
+import os
+import glob
+import json
+import time
 import logging
+import collections
 import multiprocessing
 import signal
+import threading
 from setproctitle import setproctitle
+from nite.util import stable_hash
+from nite.affinity import CpuPlacement
+from nite.profiler import SamplingProfiler, OUTSIDE, handler_codes, merge, write_collapsed
 
 
 logger = logging.getLogger(__name__)
 
 
+class WorkerStatus:
+
+    """This class keeps track of what a worker process is doing, in memory shared with the main process.
+
+    Worker processes update it, and the main process reads it to find
+    worker processes which are stuck.
+    """
+
+    @property
+    def heartbeat(self):
+        """Return the UNIX timestamp at which the worker process last showed signs of life."""
+        return self._times[0]
+
+    @property
+    def busy_since(self):
+        """Return the UNIX timestamp at which the worker process started handling its current event, or 0."""
+        return self._times[1]
+
+    @property
+    def event(self):
+        """Return the name of the event the worker process is handling, or None."""
+        return self._event.value.decode('utf-8', 'replace') if self.busy_since else None
+
+    def beat(self):
+        """Show signs of life."""
+        self._times[0] = time.time()
+
+    def begin(self, event_name):
+        """Mark the start of handling an event."""
+        self._event.value = event_name.encode('utf-8')[:len(self._event) - 1]
+        self._times[1] = self._times[0] = time.time()
+
+    def end(self):
+        """Mark the end of handling an event."""
+        self._times[1] = 0
+        self._times[0] = time.time()
+
+    def __init__(self):
+        """Constructor."""
+        # Timestamps are written and read without locking, torn reads only delay detection by a check
+        self._times = multiprocessing.RawArray('d', [time.time(), 0])
+        self._event = multiprocessing.RawArray('c', 256)
+
+
 class Worker(multiprocessing.Process):
 
     """Worker process class."""
@@ -32,27 +85,127 @@ class Worker(multiprocessing.Process):
         """Set whether process should terminate."""
         self._terminate = value
 
-    def __init__(self, queue, terminate, name, daemon):
+    @property
+    def events(self):
+        """Return the events this worker consumes, or None for all events."""
+        return self._events
+
+    @events.setter
+    def events(self, value):
+        """Set the events this worker consumes, or None for all events."""
+        self._events = value
+
+    @property
+    def status(self):
+        """Return the status shared with the main process."""
+        return self._status
+
+    @status.setter
+    def status(self, value):
+        """Set the status shared with the main process."""
+        self._status = value
+
+    @property
+    def profile(self):
+        """Return a dict containing profiling configuration."""
+        return self._profile
+
+    @profile.setter
+    def profile(self, value):
+        """Set profiling configuration."""
+        self._profile = value
+
+    @property
+    def retire(self):
+        """Return whether this process should stop, while others keep running."""
+        return self._retire
+
+    @retire.setter
+    def retire(self, value):
+        """Set whether this process should stop, while others keep running."""
+        self._retire = value
+
+    @property
+    def cpus(self):
+        """Return the set of CPUs this process is pinned to, or None."""
+        return self._cpus
+
+    @cpus.setter
+    def cpus(self, value):
+        """Set the set of CPUs this process is pinned to, or None."""
+        self._cpus = value
+
+    @property
+    def log_level(self):
+        """Return the level of the root logger shared with the main process, or None."""
+        return self._log_level
+
+    @log_level.setter
+    def log_level(self, value):
+        """Set the level of the root logger shared with the main process, or None."""
+        self._log_level = value
+
+    def toggle_profiling(self, signum=None, frame=None):
+        """Start profiling, or stop profiling and save the profile to the profiling directory.
+
+        Worker processes do this when they receive SIGUSR1.
+        """
+        if self.queue.events.profiler is None:
+            self.queue.events.profiler = SamplingProfiler(handler_codes(self.queue.events), self.profile['interval'])
+            self.queue.events.profiler.start()
+            return
+
+        profiler = self.queue.events.profiler
+        self.queue.events.profiler = None
+        profiler.stop()
+
+        os.makedirs(self.profile['path'], exist_ok=True)
+        profiler.save(os.path.join(self.profile['path'], 'worker-%i.json' % os.getpid()))
+
+    def __init__(self, queue, terminate, name, daemon, events=None, status=None, profile=None, log_level=None,
+                 cpus=None):
         """Instantiate the worker process."""
         super(self.__class__, self).__init__(name=name, daemon=daemon)
         self.queue = queue
         self.terminate = terminate
+        self.retire = multiprocessing.Value('b', False)
+        self.events = events
+        self.status = status or WorkerStatus()
+        self.profile = profile
+        self.log_level = log_level
+        self.cpus = cpus
 
     def run(self):
         """Main worker function of worker process."""
         # Worker processes should ignore certain signals
         signal.signal(signal.SIGINT, signal.SIG_IGN)
 
+        # Profiling is toggled at runtime
+        signal.signal(signal.SIGUSR1, self.toggle_profiling)
+
         # Set process title (for top, ps and the like)
         setproctitle(self.name)
 
+        # Stay on the CPUs we were placed on
+        if self.cpus is not None:
+            os.sched_setaffinity(0, self.cpus)
+
+        # Let the main process know what we're up to
+        self.status.beat()
+        self.queue.events.status = self.status
+
         # Start queue connector
-        self.queue.start()
+        self.queue.start(events=self.events)
 
         # While the process doesn't have to terminate
-        while not self.terminate.value:
+        while not self.terminate.value and not self.retire.value:
             # Fetch events
             self.queue.fetch()
+            self.status.beat()
+
+            # Follow log level changes made through the main process
+            if self.log_level is not None and self.log_level.value != logging.root.level:
+                logging.root.setLevel(self.log_level.value)
 
         # Stop queue connector
         self.queue.stop()
@@ -82,6 +235,26 @@ class WorkerManager:
         """Set worker count."""
         self._worker_count = value
 
+    @property
+    def pools(self):
+        """Return dedicated worker pools."""
+        return self._pools
+
+    @pools.setter
+    def pools(self, value):
+        """Set dedicated worker pools."""
+        self._pools = value
+
+    @property
+    def concurrency(self):
+        """Return the maximum amount of workers per pool consuming each event type."""
+        return self._concurrency
+
+    @concurrency.setter
+    def concurrency(self, value):
+        """Set the maximum amount of workers per pool consuming each event type."""
+        self._concurrency = value
+
     @property
     def processes(self):
         """Return processes."""
@@ -102,36 +275,419 @@ class WorkerManager:
         """Set whether process should terminate."""
         self._terminate = value
 
+    @property
+    def stuck_timeout(self):
+        """Return the amount of seconds after which busy or unresponsive workers are replaced, or None."""
+        return self._stuck_timeout
+
+    @stuck_timeout.setter
+    def stuck_timeout(self, value):
+        """Set the amount of seconds after which busy or unresponsive workers are replaced, or None."""
+        self._stuck_timeout = value
+
+    @property
+    def stuck(self):
+        """Return the amount of worker processes replaced while handling an event, by event type."""
+        return self._stuck
+
+    @stuck.setter
+    def stuck(self, value):
+        """Set the amount of worker processes replaced while handling an event, by event type."""
+        self._stuck = value
+
+    @property
+    def profile(self):
+        """Return a dict containing profiling configuration."""
+        return self._profile
+
+    @profile.setter
+    def profile(self, value):
+        """Set profiling configuration."""
+        self._profile = value
+
+    @property
+    def log_level(self):
+        """Return the level of the root logger of worker processes, shared with them."""
+        return self._log_level
+
+    @log_level.setter
+    def log_level(self, value):
+        """Set the level of the root logger of worker processes, shared with them."""
+        self._log_level = value
+
+    @property
+    def placement(self):
+        """Return the placement of worker processes on CPUs, or None if they aren't pinned."""
+        return self._placement
+
+    @placement.setter
+    def placement(self, value):
+        """Set the placement of worker processes on CPUs, or None if they aren't pinned."""
+        self._placement = value
+
+    @property
+    def cache(self):
+        """Return the cache shared with worker processes, or None."""
+        return self._cache
+
+    @cache.setter
+    def cache(self, value):
+        """Set the cache shared with worker processes, or None."""
+        self._cache = value
+
+    @property
+    def lock(self):
+        """Return the lock held while worker processes are being replaced."""
+        return self._lock
+
+    @lock.setter
+    def lock(self, value):
+        """Set the lock held while worker processes are being replaced."""
+        self._lock = value
+
+    @property
+    def restarting(self):
+        """Return whether or not worker processes are being replaced."""
+        return self._restarting
+
+    @restarting.setter
+    def restarting(self, value):
+        """Set whether or not worker processes are being replaced."""
+        self._restarting = value
+
+    @property
+    def profiling(self):
+        """Return whether or not worker processes are being profiled."""
+        return self._profiling
+
+    @profiling.setter
+    def profiling(self, value):
+        """Set whether or not worker processes are being profiled."""
+        self._profiling = value
+
+    @property
+    def assignable(self):
+        """Return whether or not event types can be assigned to some worker processes only.
+
+        With the consolidated topology, worker processes consume shared work
+        queues, and handle every event type in them.
+        """
+        return self.queue.config.get('topology') != 'consolidated'
+
+    def assign(self, events, count):
+        """Divide events over `count` workers while respecting concurrency limits.
+
+        Returns a list containing the events to consume for every worker. An
+        event limited to n workers is consumed by n consecutive workers,
+        starting at an offset derived from the event name so that limited
+        events don't all pile up on the first worker.
+        """
+        assignments = [[] for i in range(0, count)]
+
+        for event in events:
+            limit = min(self.concurrency.get(event, count), count)
+            offset = stable_hash(event) % count
+
+            for i in range(0, limit):
+                assignments[(offset + i) % count].append(event)
+
+        return assignments
+
+    def layout(self):
+        """Return a list containing the name and the events to consume of every worker process to run."""
+        # Events pinned to a dedicated pool are not consumed by the default pool
+        events = list(self.queue.events.handlers.keys())
+        pinned = set(event for pool in self.pools.values() for event in pool['events'])
+
+        pools = [(None, self.worker_count, [event for event in events if event not in pinned])]
+        pools.extend((name, pool['processes'], pool['events']) for name, pool in sorted(self.pools.items()))
+
+        layout = []
+        for pool, count, pool_events in pools:
+            for worker_events in self.assign(pool_events, count):
+                layout.append(('NITE Worker Process #%i%s' % (len(layout), ' (%s)' % pool if pool else ''),
+                               worker_events))
+
+        return layout
+
     def start(self):
         """Initialize the worker manager."""
-        self.processes = []
         self.terminate = multiprocessing.Value('b', False)
 
+        # Keep reserved CPUs to ourselves, worker processes are pinned to the others
+        if self.placement is not None:
+            self.placement.pin_master()
+
         # Start spawning individual processes
-        for i in range(0, self.worker_count):
-            process = Worker(
-                queue=self.queue,
-                terminate=self.terminate,
-                name='NITE Worker Process #%i' % i,
-                daemon=True
-            )
+        self.processes = [self.spawn(name, events, cpus=self.cpus_for(i))
+                          for i, (name, events) in enumerate(self.layout())]
+
+        logger.info('%s worker process(es) started', len(self.processes))
+
+    def restart(self, wait=True):
+        """Replace all worker processes one by one, with processes following the current configuration.
+
+        Every replacement is started before the process it replaces is asked
+        to stop, so that there's never a worker process less than there
+        should be. Processes which are asked to stop finish the event they're
+        handling first, unless that takes longer than `stuck_timeout`.
+
+        Unless `wait` is set, processes are replaced by a background thread,
+        and this returns right away.
+        """
+        if not wait:
+            self.restarting = True
+            threading.Thread(target=self.restart, name='NITE worker restart', daemon=True).start()
+            return
+
+        with self.lock:
+            self.restarting = True
+            previous, layout = self.processes, self.layout()
+            self.processes = []
+
+            try:
+                for i in range(0, max(len(previous), len(layout))):
+                    # Once stopping, processes are only retired
+                    if i < len(layout) and not self.terminate.value:
+                        self.processes.append(self.spawn(*layout[i], cpus=self.cpus_for(i)))
+
+                    if i < len(previous):
+                        self.retire(previous[i])
+            finally:
+                self.restarting = False
+
+        logger.info('Replaced %i worker process(es) by %i worker process(es)', len(previous), len(self.processes))
+
+    def retire(self, process):
+        """Stop a single worker process, killing it if it doesn't stop within `stuck_timeout`."""
+        process.retire.value = True
+        process.join(self.stuck_timeout or 30)
+
+        if process.is_alive():
+            logger.error('%s didn\'t stop in time, killing it', process.name)
+            process.kill()
+            process.join()
+            self.release(process)
+
+    def resize(self, worker_count, wait=True):
+        """Change the amount of worker processes in the default pool, replacing all worker processes."""
+        self.worker_count = worker_count
+        self.restart(wait)
+
+    def limit(self, event, concurrency, wait=True):
+        """Change the maximum amount of workers per pool consuming an event type, replacing all worker processes.
+
+        A `concurrency` of None lifts the limit. See `restart()` for `wait`.
+        """
+        if concurrency is not None and not self.assignable:
+            raise Exception('Concurrency limits can\'t be used with the consolidated topology')
+
+        if concurrency is None:
+            self.concurrency.pop(event, None)
+        else:
+            self.concurrency[event] = concurrency
+
+        self.restart(wait)
+
+    def cpus_for(self, index):
+        """Return the set of CPUs to pin the worker process at an index to, or None."""
+        return self.placement.cpus_for(index) if self.placement is not None else None
+
+    def spawn(self, name, events, status=None, cpus=None):
+        """Start and return a worker process."""
+        process = Worker(
+            queue=self.queue,
+            terminate=self.terminate,
+            name=name,
+            daemon=True,
+            events=events,
+            status=status,
+            profile=self.profile,
+            log_level=self.log_level,
+            cpus=cpus
+        )
+
+        process.start()
+
+        return process
+
+    def check(self):
+        """Replace worker processes which died, or which have been stuck for longer than `stuck_timeout`.
+
+        This should be called periodically by the main process. Messages
+        which were delivered to a replaced worker process but not acked yet
+        are requeued by the broker once its connection is gone.
+        """
+        now = time.time()
+
+        # Don't check more often than once a second, so that crashing workers aren't replaced in a tight loop
+        if self.terminate.value or now - self._checked < 1:
+            return
+
+        # Worker processes which are being replaced anyway don't need checking
+        if not self.lock.acquire(blocking=False):
+            return
+
+        try:
+            self.replace_failed(now)
+        finally:
+            self.lock.release()
+
+        self._checked = now
+
+    def replace_failed(self, now):
+        """Replace worker processes which died or got stuck."""
+        for i, process in enumerate(self.processes):
+            status = process.status
+
+            if not process.is_alive():
+                logger.error('%s died with exit code %s, replacing it', process.name, process.exitcode)
+            elif self.stuck_timeout and status.busy_since and now - status.busy_since > self.stuck_timeout:
+                logger.error('%s has been handling "%s" for %.0fs, replacing it', process.name, status.event,
+                             now - status.busy_since)
+                self.stuck[status.event] += 1
+                process.kill()
+            elif self.stuck_timeout and now - status.heartbeat > self.stuck_timeout:
+                logger.error('%s has been unresponsive for %.0fs, replacing it', process.name, now - status.heartbeat)
+                process.kill()
+            else:
+                continue
+
+            process.join()
+            self.release(process)
+            status.end()
+            self.processes[i] = self.spawn(process.name, process.events, status, process.cpus)
+
+            if self.stuck:
+                logger.warning('Event types which got worker processes stuck so far: %s',
+                               ', '.join('%s (%i)' % item for item in self.stuck.most_common()))
+
+    def release(self, process):
+        """Release what a worker process which was killed or died held on to in memory shared with others."""
+        if self.cache is not None:
+            self.cache.recover(process.pid)
+
+    def toggle_profiling(self):
+        """Start profiling all worker processes, or stop profiling them and return the path of the merged profile.
+
+        Profiles of worker processes are merged into collapsed stacks of CPU
+        time (`cpu.collapsed`), which can be turned into flamegraphs, and
+        the CPU and wall time spent per handler (`handlers.json`).
+        """
+        self.profiling = not self.profiling
+        started = time.time()
+
+        # Start from scratch, so that profiles of earlier runs don't get merged in
+        if self.profiling:
+            for path in glob.glob(os.path.join(self.profile['path'], 'worker-*.json')):
+                os.unlink(path)
+
+        for process in self.processes:
+            if process.is_alive():
+                os.kill(process.pid, signal.SIGUSR1)
+
+        if self.profiling:
+            logger.info('Started profiling %i worker process(es)', len(self.processes))
+            return None
+
+        # Give worker processes a moment to save their profiles
+        expected = set(os.path.join(self.profile['path'], 'worker-%i.json' % process.pid)
+                       for process in self.processes if process.is_alive())
+
+        while time.time() - started < 5 and not all(os.path.exists(path) for path in expected):
+            time.sleep(0.05)
+
+        profiles = []
+        for path in glob.glob(os.path.join(self.profile['path'], 'worker-*.json')):
+            with open(path) as handle:
+                profiles.append(json.load(handle))
+
+        return self.save_profile(merge(profiles), len(profiles))
+
+    def save_profile(self, profile, count):
+        """Save a merged profile of `count` worker processes, log a summary and return the path it was saved to."""
+        path = self.profile['path']
+        os.makedirs(path, exist_ok=True)
 
-            process.start()
-            self.processes.append(process)
+        write_collapsed(profile['stacks'], os.path.join(path, 'cpu.collapsed'))
 
-        logger.info('%s worker process(es) started', self.worker_count)
+        # CPU time samples are converted to seconds, and everything is summed over all worker processes
+        handlers = {
+            name: {
+                'cpu': profile['cpu'][name] * profile['interval'],
+                'wall': profile['wall'][name],
+                'calls': profile['calls'][name],
+            }
+            for name in set(profile['cpu']) | set(profile['wall'])
+        }
+
+        with open(os.path.join(path, 'handlers.json'), 'w') as handle:
+            json.dump(handlers, handle, indent=2, sort_keys=True)
+
+        logger.info('Profiled %i worker process(es) for %.1fs, saved to "%s"', count, profile['duration'], path)
+
+        for name, spent in sorted(handlers.items(), key=lambda item: -item[1]['cpu'])[:10]:
+            if name != OUTSIDE:
+                logger.info('%8.2fs CPU %8.2fs wall %8i calls  %s', spent['cpu'], spent['wall'], spent['calls'], name)
+
+        return path
 
     def stop(self):
         """Shut down the worker manager."""
         # Tell worker processes that we want them to terminate.
         self.terminate.value = True
 
-        # Actually start terminating and joining processes
-        for process in self.processes:
-            process.join()
+        # Actually start terminating and joining processes, once they're no longer being replaced
+        with self.lock:
+            for process in self.processes:
+                process.join()
+
+    def __init__(self, queue, worker_count=None, pools=None, concurrency=None, stuck_timeout=None, profile=None,
+                 affinity=None, cache=None):
+        """Instantiate the worker manager.
+
+        `pools` maps pool names onto dicts containing the amount of
+        `processes` in the pool and the `events` they exclusively consume.
+        These processes are spawned on top of the default pool, so that slow
+        event types can only exhaust their own pool.
+
+        `concurrency` maps event types onto the maximum amount of workers
+        within their pool which may consume them at the same time.
+
+        Neither can be used with the consolidated topology, as worker
+        processes then consume every event type in shared work queues.
+
+        Worker processes which have been handling a single event, or have
+        been unresponsive, for longer than `stuck_timeout` seconds are killed
+        and replaced by `check()`.
+
+        `profile` may contain the `path` of the directory to save profiles
+        to and the `interval` in seconds between samples.
+
+        If `affinity` is passed, worker processes are pinned to CPUs as
+        described by `nite.affinity.CpuPlacement`, which takes its contents
+        as arguments.
 
-    def __init__(self, queue, worker_count=None):
-        """Instantiate the worker manager."""
+        If the `cache` shared with worker processes is passed, the locks of
+        worker processes which are killed or die are recovered.
+        """
         self.queue = queue
         self.worker_count = worker_count if worker_count else multiprocessing.cpu_count()
+        self.pools = pools or {}
+        self.concurrency = concurrency or {}
+
+        if (self.pools or self.concurrency) and not self.assignable:
+            raise Exception('Worker pools and concurrency limits can\'t be used with the consolidated topology')
+
+        self.stuck_timeout = stuck_timeout
+        self.stuck = collections.Counter()
+        self.profile = {'path': '/tmp/nite/profiles', 'interval': 0.01}
+        self.profile.update(profile or {})
+        self.profiling = False
+        self.placement = CpuPlacement(**affinity) if affinity else None
+        self.log_level = multiprocessing.Value('i', logging.root.level)
+        self.lock = threading.RLock()
+        self.restarting = False
+        self.cache = cache
+        self._checked = 0
         logging.debug('Worker manager initialized')
@@ -27,7 +27,8 @@ setup(
         'License :: OSI Approved :: MIT License',
     ],
 
-    packages=find_packages(),
+    packages=find_packages(exclude=['tests']),
+    python_requires='>=3.7',
     entry_points={
         'console_scripts': [
             'nite = nite:nite',
@@ -37,7 +38,7 @@ setup(
     install_requires=[
         'amqp',
         'setproctitle',
-        'msgpack-python',
+        'msgpack>=1.0',
         'click',
         'ballercfg',
         'colorlog'
@@ -0,0 +1 @@
+"""NITE tests."""
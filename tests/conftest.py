@@ -0,0 +1,10 @@
+"""Fixtures shared by the tests."""
+import pytest
+from nite import queue
+from tests.fakes import FakeConnection
+
+
+@pytest.fixture
+def fake_broker(monkeypatch):
+    """Keep queue connectors from connecting to a broker."""
+    monkeypatch.setattr(queue.amqp, 'Connection', FakeConnection)
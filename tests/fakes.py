@@ -0,0 +1,119 @@
+"""Fake broker connections, which let queue connectors run without a broker."""
+import socket
+import collections
+from nite import queue
+from nite.topic import TopicTrie
+
+
+class FakeChannel:
+
+    """A channel which records what is published and acked on it."""
+
+    is_open = True
+
+    def basic_publish(self, message, **kwargs):
+        """Record a published message."""
+        self.published.append((message, kwargs))
+
+    def basic_ack(self, delivery_tag):
+        """Record an ack."""
+        self.acks.append(('ack', delivery_tag))
+
+    def basic_nack(self, delivery_tag, requeue=True):
+        """Record a nack."""
+        self.acks.append(('nack', delivery_tag))
+
+    def basic_reject(self, delivery_tag, requeue=True):
+        """Record a rejection."""
+        self.acks.append(('reject', delivery_tag))
+
+    def __getattr__(self, name):
+        """Accept declarations and anything else without doing anything."""
+        return lambda *args, **kwargs: None
+
+    def __init__(self, connection=None):
+        """Constructor."""
+        self.connection = connection
+        self.events = collections.defaultdict(set)
+        self.published = []
+        self.acks = []
+
+
+class FakeConnection:
+
+    """A connection which never talks to a broker."""
+
+    #: How publishes are confirmed on channels in confirm mode: 'basic_ack', 'basic_nack' or not at all (None).
+    confirm = 'basic_ack'
+
+    def channel(self):
+        """Return a new channel."""
+        channel = FakeChannel(self)
+        self.channels.append(channel)
+
+        return channel
+
+    def drain_events(self, timeout=None):
+        """Confirm every publish made so far, then wait for nothing."""
+        for channel in self.channels:
+            for callback in list(channel.events[self.confirm] if self.confirm else []):
+                callback(len(channel.published), True)
+
+        raise socket.timeout()
+
+    def collect(self):
+        """Tear down the connection."""
+        self.connected = False
+
+    def close(self):
+        """Close the connection."""
+        self.connected = False
+
+    def __init__(self, **kwargs):
+        """Constructor."""
+        self.channels = []
+        self.connected = True
+
+
+def connector(events, produce_only=False, **config):
+    """Return a started connector for the handlers registered with an event manager."""
+    amqp = queue.AmqpQueueConnector(events, 'nite.fanout', 'nite.topic', '/', 'localhost', 'user', 'password',
+                                    **config)
+    events.queue = amqp
+
+    if produce_only:
+        amqp.start(produce_only=True)
+    else:
+        amqp.start(events=list(events.handlers))
+
+    return amqp
+
+
+def route(amqp, message):
+    """Return the subscriptions of the queues a published message would be routed to by the broker."""
+    message, kwargs = message
+    routed = []
+
+    for name, args, bindings in amqp.topology.declarations:
+        if name != 'queue_bind' or bindings['exchange'] != kwargs['exchange']:
+            continue
+
+        if kwargs['routing_key'] in TopicTrie([bindings['routing_key']]):
+            routed.extend(amqp.subscriptions.get(bindings['queue'], []))
+
+    return sorted(routed)
+
+
+def delivered(amqp, published, tag=1, redelivered=False):
+    """Return a published message as it would be delivered back to a connector."""
+    message = published[0]
+    message.channel = amqp.channel
+    message.delivery_info = {'delivery_tag': tag, 'exchange': published[1]['exchange'], 'consumer_tag': None,
+                             'redelivered': redelivered}
+
+    return message
+
+
+def deliver(amqp, published, tag=1, redelivered=False):
+    """Deliver a published message back to a connector, and return what handling it returned."""
+    return amqp.handle_message(delivered(amqp, published, tag, redelivered))
@@ -0,0 +1,54 @@
+"""Tests for the affinity module."""
+import threading
+import pytest
+from nite import affinity
+from nite.affinity import CpuPlacement
+
+
+@pytest.fixture(autouse=True)
+def topology(monkeypatch):
+    """Pretend to run on 2 NUMA nodes of 2 cores with 2 hyperthreads each, CPUs 0-3 being the first threads."""
+    monkeypatch.setattr(affinity, 'ALLOWED_CPUS', set(range(0, 8)))
+    monkeypatch.setattr(affinity, 'cpu_topology',
+                        lambda cpus: {cpu: ((cpu % 4) // 2, (cpu % 4) // 2, cpu % 2) for cpu in cpus})
+
+
+def test_compact_placement_fills_up_nodes():
+    """Compact placement hands out every CPU of a node before moving on to the next."""
+    assert CpuPlacement('compact').worker_cpus == [0, 4, 1, 5, 2, 6, 3, 7]
+
+
+def test_spread_placement_takes_turns():
+    """Spread placement takes turns between nodes, and gives every core a worker before any gets two."""
+    assert CpuPlacement('spread').worker_cpus == [0, 2, 1, 3, 4, 6, 5, 7]
+
+
+def test_reserved_cpus_and_node_scope():
+    """Reserved CPUs are kept for the main process, and node scope pins to every CPU of a node."""
+    placement = CpuPlacement('list', cpus=[3, 2, 1, 0], reserved=[0, 1], scope='node')
+
+    assert placement.master_cpus == {0, 1}
+    assert placement.worker_cpus == [3, 2]
+    assert placement.cpus_for(0) == {2, 3}
+
+    with pytest.raises(Exception):
+        CpuPlacement('list', cpus=[0, 4], reserved=2)
+
+
+def test_pin_master_pins_every_thread(monkeypatch):
+    """Threads which were started before the main process was pinned are pinned as well."""
+    pinned = {}
+    monkeypatch.setattr(affinity.os, 'sched_setaffinity', lambda thread, cpus: pinned.update({thread: cpus}))
+
+    stop = threading.Event()
+    thread = threading.Thread(target=stop.wait)
+    thread.start()
+
+    try:
+        CpuPlacement(reserved=1).pin_master()
+    finally:
+        stop.set()
+        thread.join()
+
+    assert pinned[thread.native_id] == {0}
+    assert pinned[threading.get_native_id()] == {0}
@@ -0,0 +1,92 @@
+"""Tests for the blob module."""
+import os
+import time
+import pytest
+from nite.blob import SpoolBlobStore, create_blob_store
+
+
+@pytest.fixture
+def store(tmp_path):
+    """Return a blob store in a temporary directory."""
+    return SpoolBlobStore(str(tmp_path), ttl=60)
+
+
+def age(store, seconds):
+    """Make every file in a blob store look like it was written a while ago."""
+    then = time.time() - seconds
+
+    for name in os.listdir(store.path):
+        os.utime(os.path.join(store.path, name), (then, then))
+
+
+def test_put_and_open(store):
+    """Stored payloads can be read without copying them."""
+    reference = store.put(b'payload')
+
+    with store.open(reference) as view:
+        assert isinstance(view, memoryview)
+        assert bytes(view) == b'payload'
+
+
+def test_payloads_are_removed_by_their_last_consumer(store):
+    """Payloads go once every consumer released them."""
+    reference = store.put(b'payload', consumers=2)
+
+    store.release(reference)
+    assert os.path.exists(store.file(reference))
+
+    store.release(reference)
+    assert not os.path.exists(store.file(reference))
+
+    # Releasing it once more is harmless
+    store.release(reference)
+
+
+def test_collect_removes_payloads_nobody_waits_for(store):
+    """Old payloads with an unknown amount of consumers, expired payloads and half-written files are collected."""
+    unknown = store.put(b'unknown')
+    expired = store.put(b'expired', consumers=1, expires=time.time() - 120)
+    open(store.file('half-written') + '.tmp', 'wb').close()
+    age(store, 120)
+
+    assert store.collect() == 3
+    assert not os.path.exists(store.file(unknown))
+    assert not os.path.exists(store.file(expired))
+
+
+def test_collect_keeps_payloads_with_pending_consumers(store):
+    """Payloads which are still waiting for consumers are kept, however old they are."""
+    pending = store.put(b'pending', consumers=1)
+    expiring = store.put(b'expiring', consumers=1, expires=time.time() + 30)
+    recent = store.put(b'recent')
+    age(store, 3600)
+    os.utime(store.file(recent))
+
+    assert store.collect() == 0
+
+    with store.open(pending) as view:
+        assert bytes(view) == b'pending'
+
+    assert os.path.exists(store.file(expiring))
+    assert os.path.exists(store.file(recent))
+
+
+def test_views_outliving_open_dont_raise(store):
+    """Views of a payload held on to after it was opened don't get in the way of closing it."""
+    reference = store.put(b'payload')
+
+    with store.open(reference) as view:
+        kept = view[0:3]
+
+    assert bytes(kept) == b'pay'
+
+
+def test_create_blob_store(tmp_path):
+    """Blob stores are created by their type."""
+    store = create_blob_store('spool', {'path': str(tmp_path), 'node_local': False})
+
+    assert isinstance(store, SpoolBlobStore)
+    assert not store.node_local
+
+    with pytest.raises(Exception):
+        create_blob_store('s3')
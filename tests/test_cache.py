@@ -0,0 +1,138 @@
+"""Tests for the cache module."""
+import os
+import signal
+import time
+import pytest
+from nite.cache import SharedCache
+
+
+@pytest.fixture
+def cache():
+    """Return a small cache."""
+    return SharedCache(size=65536, slot_size=256, ways=4, stripes=4)
+
+
+def test_set_and_get(cache):
+    """Cached values come back as they went in."""
+    assert cache.set('key', {'a': [1, 2, 3]})
+    assert cache.get('key') == {'a': [1, 2, 3]}
+    assert cache.get('missing', 'default') == 'default'
+
+    stats = cache.stats
+    assert (stats['sets'], stats['hits'], stats['misses']) == (1, 1, 1)
+
+
+def test_set_replaces(cache):
+    """Setting a cached key replaces its value."""
+    cache.set(b'key', 1)
+    cache.set(b'key', 2)
+
+    assert cache.get(b'key') == 2
+
+
+def test_delete_and_clear(cache):
+    """Deleted and cleared keys are gone."""
+    cache.set('a', 1)
+    cache.set('b', 2)
+
+    assert cache.delete('a')
+    assert not cache.delete('a')
+    assert cache.get('a') is None
+
+    cache.clear()
+    assert cache.get('b') is None
+
+
+def test_expiry(cache):
+    """Entries are gone once their ttl passed."""
+    cache.set('key', 'value', ttl=0.05)
+    assert cache.get('key') == 'value'
+
+    time.sleep(0.1)
+    assert cache.get('key') is None
+
+
+def test_get_or_set(cache):
+    """Factories are only called on misses."""
+    calls = []
+
+    def factory():
+        calls.append(1)
+        return 'value'
+
+    assert cache.get_or_set('key', factory) == 'value'
+    assert cache.get_or_set('key', factory) == 'value'
+    assert len(calls) == 1
+
+
+def test_least_recently_used_entries_are_evicted():
+    """Full sets evict the entry which was used the longest ago."""
+    cache = SharedCache(size=256 * 4, slot_size=256, ways=4, stripes=1)
+
+    for key in range(0, 4):
+        cache.set(key, key)
+
+    cache.get(0)
+    cache.set(4, 4)
+
+    assert cache.get(0) == 0
+    assert cache.get(1) is None
+    assert cache.get(4) == 4
+
+
+def test_oversized_values_are_rejected(cache):
+    """Values which don't fit into a slot aren't cached."""
+    assert not cache.set('key', 'x' * 500)
+    assert cache.get('key') is None
+    assert cache.stats['rejections'] == 1
+
+
+def test_oversized_values_remove_the_previous_value(cache):
+    """A rejected value doesn't leave the previous value of its key around."""
+    cache.set('key', 'small')
+
+    assert not cache.set('key', 'x' * 500)
+    assert cache.get('key') is None
+
+
+def test_shared_with_forked_processes(cache):
+    """Values set by forked processes can be read by their parent."""
+    pid = os.fork()
+
+    if not pid:
+        cache.set('child', os.getpid())
+        os._exit(0)
+
+    os.waitpid(pid, 0)
+
+    assert cache.get('child') == pid
+
+
+def test_locks_of_killed_processes_are_recovered(cache):
+    """Locks held by a process which was killed are released, and what they guarded is removed."""
+    cache.set('key', 'value')
+    key, digest, index, stripe = cache.locate('key')
+    pid = os.fork()
+
+    if not pid:
+        with cache.locked(stripe):
+            time.sleep(60)
+
+        os._exit(0)
+
+    for i in range(0, 500):
+        if cache._holders[stripe] == pid:
+            break
+
+        time.sleep(0.01)
+
+    os.kill(pid, signal.SIGKILL)
+    os.waitpid(pid, 0)
+
+    assert not cache._locks[stripe].acquire(timeout=0.1)
+    assert cache.recover(pid) == 1
+    assert cache.recover(pid) == 0
+    assert cache._locks[stripe].acquire(timeout=1)
+
+    cache._locks[stripe].release()
+    assert cache.get('key') is None
@@ -0,0 +1,100 @@
+"""Tests for the codec module."""
+import msgpack
+import pytest
+from nite.codec import Compressor, EnvelopeReader, available_codecs, create_codec, unpack
+
+
+@pytest.mark.parametrize('name', sorted(available_codecs()))
+def test_codecs_round_trip(name):
+    """Codecs decompress what they compressed, with and without a dictionary."""
+    codec = create_codec(name)
+    data = b'{"user": "someone", "action": "login"}' * 20
+    dictionary = b'{"user": "", "action": ""}' * 10
+
+    assert codec.decompress(codec.compress(data)) == data
+    assert codec.decompress(codec.compress(data, dictionary), dictionary) == data
+
+
+def test_unknown_codecs():
+    """Codecs which aren't available can't be created."""
+    with pytest.raises(Exception):
+        create_codec('brotli')
+
+
+def test_compressor_threshold():
+    """Small bodies are sent as they are."""
+    compressor = Compressor('zlib', threshold=100)
+
+    assert compressor.compress('app.Event', b'x' * 50) == (b'x' * 50, None, None)
+
+    body, encoding, dictionary_id = compressor.compress('app.Event', b'x' * 500)
+    assert encoding == 'zlib'
+    assert len(body) < 500
+    assert compressor.decompress('app.Event', body, encoding, dictionary_id) == b'x' * 500
+
+
+def test_compressor_dictionaries():
+    """Events compressed with a dictionary can only be decompressed with the same dictionary."""
+    producer = Compressor('zlib', threshold=0)
+    producer.add_dictionary('app.Event', b'"user": "someone"' * 8)
+    body, encoding, dictionary_id = producer.compress('app.Event', b'{"user": "someone"}' * 4)
+
+    assert dictionary_id is not None
+
+    consumer = Compressor(threshold=0)
+    consumer.add_dictionary('app.Event', b'"user": "someone"' * 8)
+    assert consumer.decompress('app.Event', body, encoding, dictionary_id) == b'{"user": "someone"}' * 4
+
+    stranger = Compressor(threshold=0)
+    stranger.add_dictionary('app.Event', b'something else entirely')
+    with pytest.raises(Exception):
+        stranger.decompress('app.Event', body, encoding, dictionary_id)
+
+
+def test_incompressible_bodies_are_sent_as_they_are():
+    """Bodies which don't get any smaller aren't compressed."""
+    compressor = Compressor('zlib', threshold=0)
+
+    assert compressor.compress('app.Event', b'ab') == (b'ab', None, None)
+
+
+def envelope(event, data, **extra):
+    """Return a serialized event."""
+    envelope = {'event': event, 'data': data}
+    envelope.update(extra)
+
+    return msgpack.packb(envelope, use_bin_type=True)
+
+
+def test_envelope_reader_known_event():
+    """Envelopes of known events are recognized by their prefix."""
+    reader = EnvelopeReader()
+    event, data = reader.read(envelope('app.Event', {'a': 1}), 'app.Event')
+
+    assert event == 'app.Event'
+    assert isinstance(data, memoryview)
+    assert unpack(data) == {'a': 1}
+
+
+def test_envelope_reader_unknown_layout():
+    """Envelopes in any other order or with other keys are walked instead."""
+    reader = EnvelopeReader()
+    body = msgpack.packb({'extra': [1, 2], 'data': {'b': [3]}, 'event': 'app.Other'}, use_bin_type=True)
+
+    for i in range(0, 3):
+        assert reader.read(body, 'app.Event') == ('app.Other', memoryview(msgpack.packb({'b': [3]})))
+
+    event, data = reader.read(envelope('app.Event', {'c': 'd'}, version=2))
+    assert event == 'app.Event'
+    assert unpack(data) == {'c': 'd'}
+
+
+def test_envelope_reader_recovers_from_garbage():
+    """Envelopes which can't be read don't break the envelopes after them."""
+    reader = EnvelopeReader()
+
+    with pytest.raises(Exception):
+        reader.read(b'\x82\xa5event')
+
+    event, data = reader.read(envelope('app.Event', {'a': 1}))
+    assert (event, unpack(data)) == ('app.Event', {'a': 1})
@@ -0,0 +1,114 @@
+"""Tests for the control module."""
+import os
+import socket
+import logging
+import collections
+import pytest
+import nite
+from nite.control import ControlServer, send_command
+
+
+class FakeWorkers:
+
+    """A worker manager which records how it is asked to change."""
+
+    processes = []
+    stuck = collections.Counter()
+    restarting = False
+    profiling = False
+
+    def resize(self, worker_count, wait=True):
+        """Record a resize."""
+        self.changes.append(('resize', worker_count, wait))
+
+    def restart(self, wait=True):
+        """Record a restart."""
+        self.changes.append(('restart', wait))
+
+    def __init__(self):
+        """Constructor."""
+        self.changes = []
+
+
+class FakeQueue:
+
+    """A queue connector with nothing to show."""
+
+    node_identifier = 'node.test'
+    config = {'prefetch': 0, 'event_prefetch': {}, 'topology': 'per_event'}
+
+
+class FakeCore:
+
+    """A NITE core with fake parts."""
+
+    def __init__(self):
+        """Constructor."""
+        self.workers = FakeWorkers()
+        self.queue = FakeQueue()
+
+
+@pytest.fixture
+def control(tmp_path):
+    """Return a started control server of a fake core."""
+    server = ControlServer(FakeCore(), os.path.join(str(tmp_path), 'control.sock'))
+    server.start()
+
+    yield server
+
+    server.stop()
+
+
+def test_commands(control):
+    """Commands are answered with their result, or an error."""
+    assert send_command(control.path, 'status')['result']['node'] == 'node.test'
+    assert 'set_workers' in send_command(control.path, 'help')['result']
+    assert 'error' in send_command(control.path, 'nonexistent')
+    assert 'error' in send_command(control.path, 'set_workers', count=0)
+
+
+def test_restarting_commands_return_right_away(control):
+    """Commands which replace worker processes don't wait for them to be replaced."""
+    send_command(control.path, 'set_workers', count=4)
+    send_command(control.path, 'set_prefetch', count=10)
+    send_command(control.path, 'restart')
+
+    assert control.core.workers.changes == [('resize', 4, False), ('restart', False), ('restart', False)]
+
+
+def test_only_one_instance_listens(control):
+    """Sockets which are listened on aren't taken over."""
+    with pytest.raises(Exception):
+        ControlServer(FakeCore(), control.path).start()
+
+    assert send_command(control.path, 'status')['result']['pid'] == os.getpid()
+
+
+def test_sockets_left_behind_are_taken_over(tmp_path):
+    """Sockets nobody listens on anymore are replaced."""
+    path = os.path.join(str(tmp_path), 'control.sock')
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as stale:
+        stale.bind(path)
+
+    server = ControlServer(FakeCore(), path)
+    server.start()
+
+    try:
+        assert os.stat(path).st_mode & 0o777 == 0o600
+        assert 'result' in send_command(path, 'status')
+    finally:
+        server.stop()
+
+
+def test_stopping_before_starting(monkeypatch, tmp_path):
+    """Cores which didn't start, or only partially, can be stopped."""
+    monkeypatch.chdir(str(tmp_path))
+    monkeypatch.setattr(nite, 'configure_logging', lambda *args, **kwargs: logging.root.level)
+    monkeypatch.setattr(nite.NITECore, 'register_signal_handlers', lambda self: None)
+    monkeypatch.setattr(nite.NITECore, 'start', lambda self: None)
+
+    core = nite.NITECore({'daemonize': False, 'debug': False})
+    core.stop()
+
+    assert core.terminate.is_set()
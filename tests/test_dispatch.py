@@ -0,0 +1,66 @@
+"""Tests for the dispatch module."""
+import collections
+from nite.dispatch import WeightedDispatcher
+
+
+def test_single_lane_is_fifo():
+    """Items in the same lane are handed out in the order they were buffered."""
+    dispatcher = WeightedDispatcher()
+
+    for i in range(0, 5):
+        dispatcher.put('lane', i)
+
+    assert len(dispatcher) == 5
+    assert [dispatcher.pop() for i in range(0, 5)] == [0, 1, 2, 3, 4]
+    assert dispatcher.pop() is None
+
+
+def test_backlogged_lanes_are_served_by_weight():
+    """Lanes are served in proportion to their weights while all of them are backlogged."""
+    dispatcher = WeightedDispatcher({'high': 3, 'low': 1})
+
+    for i in range(0, 100):
+        dispatcher.put('high', 'high')
+        dispatcher.put('low', 'low')
+
+    served = collections.Counter(dispatcher.pop() for i in range(0, 80))
+
+    assert served == {'high': 60, 'low': 20}
+
+
+def test_light_lanes_are_never_starved():
+    """Even lanes with the lowest weight are served in every round."""
+    dispatcher = WeightedDispatcher({'high': 64}, default_weight=1)
+
+    for i in range(0, 200):
+        dispatcher.put('high', 'high')
+
+    dispatcher.put('low', 'low')
+
+    assert 'low' in [dispatcher.pop() for i in range(0, 65)]
+
+
+def test_idle_lanes_dont_hoard_credit():
+    """Lanes which ran empty start over once they get items again."""
+    dispatcher = WeightedDispatcher({'a': 1, 'b': 1})
+    dispatcher.put('a', 1)
+    dispatcher.pop()
+
+    assert 'a' not in dispatcher.lanes
+
+    dispatcher.put('b', 'b1')
+    dispatcher.put('b', 'b2')
+    dispatcher.put('a', 'a1')
+
+    assert [dispatcher.pop() for i in range(0, 3)] == ['b1', 'a1', 'b2']
+
+
+def test_clear():
+    """Clearing removes every buffered item."""
+    dispatcher = WeightedDispatcher()
+    dispatcher.put('a', 1)
+    dispatcher.put('b', 2)
+    dispatcher.clear()
+
+    assert len(dispatcher) == 0
+    assert dispatcher.pop() is None
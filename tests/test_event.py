@@ -0,0 +1,127 @@
+"""Tests for the event module."""
+import time
+import pytest
+from nite.event import EventManager, BaseEvent, HandlerTimeout
+from nite.worker import WorkerStatus
+from tests.fakes import connector, deliver
+
+
+pytestmark = pytest.mark.usefixtures('fake_broker')
+
+
+class Perishable(BaseEvent):
+
+    """An event which is only worth handling for a minute."""
+
+    ttl = 60
+
+
+class Nested(BaseEvent):
+
+    """An event handled while handling another one."""
+
+    pass
+
+
+def test_event_ttl_becomes_a_deadline():
+    """The TTL of an event type is sent along as a deadline, and as the message expiration."""
+    events = EventManager()
+    events.register(Perishable, lambda event: True)
+    amqp = connector(events)
+
+    events.trigger(Perishable())
+    message, kwargs = amqp.publish_channel.published[-1]
+
+    assert time.time() + 59 < message.application_headers['x-nite-deadline'] <= time.time() + 60
+    assert 55000 < int(message.properties['expiration']) <= 60000
+
+    events.trigger(Perishable(), deadline=time.time() + 10)
+    message, kwargs = amqp.publish_channel.published[-1]
+
+    assert message.application_headers['x-nite-deadline'] <= time.time() + 10
+
+
+def test_expired_events_are_dropped():
+    """Events whose deadline passed before they were handled are acked and counted, but not handled."""
+    handled = []
+    events = EventManager()
+    events.register(Perishable, handled.append)
+    amqp = connector(events)
+
+    events.trigger(Perishable(), ttl=0)
+    deliver(amqp, amqp.publish_channel.published[-1], tag=7)
+
+    assert handled == []
+    assert amqp.channel.acks == [('ack', 7)]
+    assert amqp.expired == {'%s.Perishable' % __name__: 1}
+
+
+def test_pattern_subscriptions():
+    """Handlers registered for patterns get every event matching them, and only the subscriptions passed."""
+    handled = []
+    events = EventManager()
+    events.register(Perishable, lambda event: handled.append('exact'))
+    events.register('%s.*' % __name__, lambda event: handled.append('star'))
+    events.register('#', lambda event: handled.append('hash'))
+    events.register('other.#', lambda event: handled.append('other'))
+
+    events.handle(Perishable())
+    assert sorted(handled) == ['exact', 'hash', 'star']
+
+    del handled[:]
+    events.handle(Perishable(), frozenset(['#']))
+    assert handled == ['hash']
+
+
+def test_filtered_handlers():
+    """Handlers registered with filters only get events with matching attributes."""
+    handled = []
+    events = EventManager()
+    events.register(Perishable, lambda event: handled.append('any'))
+    events.register(Perishable, lambda event: handled.append('acme'), filters={'tenant': {'acme', 'initech'}})
+
+    for tenant in ('acme', 'other'):
+        event = Perishable()
+        event.tenant = tenant
+        events.handle(event)
+
+    assert handled == ['any', 'acme', 'any']
+
+
+def test_handlers_which_catch_everything_still_time_out():
+    """Handlers catching every exception don't get to keep running past their timeout."""
+    def handle(event):
+        try:
+            time.sleep(5)
+        except Exception:
+            pass
+
+        time.sleep(5)
+
+    events = EventManager(timeout=0.1)
+    events.register(Perishable, handle)
+    started = time.time()
+
+    with pytest.raises(HandlerTimeout):
+        events.handle(Perishable())
+
+    assert time.time() - started < 1
+
+
+def test_worker_status_covers_the_outermost_event():
+    """Events handled while handling another event don't change what the worker is busy with."""
+    seen = []
+    events = EventManager()
+    events.status = WorkerStatus()
+
+    def outer(event):
+        busy_since = events.status.busy_since
+        events.handle(Nested())
+        seen.append((events.status.event, events.status.busy_since == busy_since))
+
+    events.register(Perishable, outer)
+    events.register(Nested, lambda event: seen.append((events.status.event, True)))
+    events.handle(Perishable())
+
+    assert seen == [('%s.Perishable' % __name__, True)] * 2
+    assert events.status.event is None
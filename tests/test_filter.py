@@ -0,0 +1,66 @@
+"""Tests for the filter module."""
+import pytest
+from nite.filter import FilteredHandler, HandlerIndex
+
+
+class Event:
+
+    """A plain event with whatever attributes it is given."""
+
+    def __init__(self, **attributes):
+        """Constructor."""
+        self.__dict__.update(attributes)
+
+
+def handler(name):
+    """Return a handler which is identified by a name."""
+    def handle(event):
+        return name
+
+    handle.__name__ = name
+
+    return handle
+
+
+def names(handlers):
+    """Return the names of a list of handlers."""
+    return [handler.__name__ for handler in handlers]
+
+
+def test_filtered_handler_matches_every_filter():
+    """Events only match if every one of their filtered attributes has an accepted value."""
+    filtered = FilteredHandler(handler('a'), {'kind': ['x', 'y'], 'region': 'eu'})
+
+    assert filtered(Event(kind='x', region='eu')) == 'a'
+    assert filtered(Event(kind='z', region='eu')) is None
+    assert filtered(Event(kind='x')) is None
+    assert filtered(Event(kind=['x'], region='eu')) is None
+
+
+def test_filtered_handler_needs_filters():
+    """Filtered handlers without filters are refused."""
+    with pytest.raises(Exception):
+        FilteredHandler(handler('a'), {})
+
+
+def test_handler_index_selects_matching_handlers_in_order():
+    """Unfiltered and matching filtered handlers are selected in the order they were registered."""
+    index = HandlerIndex([
+        FilteredHandler(handler('eu'), {'region': 'eu'}),
+        handler('all'),
+        FilteredHandler(handler('eu_x'), {'region': ['eu', 'us'], 'kind': 'x'}),
+        FilteredHandler(handler('us'), {'region': 'us'}),
+    ])
+
+    assert len(index) == 4
+    assert names(index.select(Event(region='eu', kind='x'))) == ['eu', 'all', 'eu_x']
+    assert names(index.select(Event(region='us', kind='y'))) == ['all', 'us']
+    assert names(index.select(Event())) == ['all']
+    assert names(index.select(Event(region=['eu']))) == ['all']
+
+
+def test_handler_index_without_filters():
+    """Without filtered handlers, every handler is selected."""
+    index = HandlerIndex([handler('a'), handler('b')])
+
+    assert names(index.select(Event())) == ['a', 'b']
@@ -0,0 +1,111 @@
+"""Tests for the pressure module."""
+import time
+import threading
+import pytest
+from nite.event import EventManager, BaseEvent
+from nite.pressure import Backpressure, BackpressureError
+from tests.fakes import FakeConnection, connector
+
+
+class Pressing(BaseEvent):
+
+    """An event triggered while the queue may be saturated."""
+
+    pass
+
+
+def test_saturation_has_hysteresis():
+    """Queues are saturated once the level reaches 1, and until it drops below the resume level."""
+    backpressure = Backpressure(max_outstanding=100, max_depth=1000)
+
+    backpressure.update(outstanding=50, depth=1000)
+    assert backpressure.saturated and backpressure.level == 1
+
+    backpressure.update(depth=850)
+    assert backpressure.saturated
+
+    backpressure.update(depth=700)
+    assert not backpressure.saturated and backpressure.level == 0.7
+
+
+def test_flow_control_saturates():
+    """Connections blocked by the broker saturate the queue until they're unblocked."""
+    backpressure = Backpressure()
+
+    backpressure.block('connection', 'low on memory')
+    assert backpressure.saturated and backpressure.blocked == {'connection'}
+
+    backpressure.unblock('connection')
+    assert not backpressure.saturated
+
+
+def test_policies():
+    """Saturated queues fail, shed or hold back events, according to the policy of their type."""
+    backpressure = Backpressure(policy='fail', policies={'app.Shed': 'shed', 'app.Block': 'block'}, block_timeout=5)
+    assert backpressure.admit('app.Fail')
+
+    backpressure.update(outstanding=10000)
+
+    with pytest.raises(BackpressureError):
+        backpressure.admit('app.Fail')
+
+    assert not backpressure.admit('app.Shed')
+
+    timer = threading.Timer(0.1, backpressure.update, kwargs={'outstanding': 0})
+    timer.start()
+    started = time.time()
+
+    assert backpressure.admit('app.Block')
+    assert time.time() - started < 5
+
+    assert backpressure.stats['shed_by_event'] == {'app.Shed': 1}
+    assert (backpressure.stats['failed'], backpressure.stats['waited']) == (1, 1)
+
+
+def test_blocking_times_out():
+    """Events held back for longer than the block timeout fail."""
+    backpressure = Backpressure(block_timeout=0.05)
+    backpressure.update(outstanding=10000)
+
+    with pytest.raises(BackpressureError):
+        backpressure.admit('app.Block')
+
+
+@pytest.mark.usefixtures('fake_broker')
+def test_shed_events_arent_published():
+    """Triggering an event which is shed returns False, and publishes nothing."""
+    events = EventManager()
+    events.register(Pressing, lambda event: True)
+    amqp = connector(events, backpressure={'policy': 'shed'})
+
+    assert events.trigger(Pressing())
+
+    amqp.backpressure.update(outstanding=10000)
+    assert not events.trigger(Pressing())
+    assert len(amqp.publish_channel.published) == 1
+
+
+@pytest.mark.usefixtures('fake_broker')
+def test_unconfirmed_publishes_saturate(monkeypatch):
+    """Publishes the broker didn't confirm yet count towards the pressure level."""
+    events = EventManager()
+    amqp = connector(events, produce_only=True, backpressure={'max_outstanding': 2, 'interval': 60})
+
+    try:
+        monkeypatch.setattr(FakeConnection, 'confirm', None)
+        events.trigger(Pressing())
+        events.trigger(Pressing())
+        amqp.measure_pressure()
+        assert amqp.backpressure.saturated
+
+        # Connections closed while the broker blocked them don't hold anything back anymore
+        monkeypatch.setattr(FakeConnection, 'confirm', 'basic_ack')
+        closed = FakeConnection()
+        closed.connected = False
+        amqp.backpressure.block(closed)
+        amqp.measure_pressure()
+
+        assert not amqp.backpressure.saturated
+        assert amqp.backpressure.stats['outstanding'] == 0
+    finally:
+        amqp.backpressure.stop()
@@ -0,0 +1,87 @@
+"""Tests for the profiler module."""
+import os
+import time
+import functools
+from nite.event import EventManager, BaseEvent
+from nite.profiler import SamplingProfiler, OUTSIDE, handler_codes, handler_name, merge, write_collapsed
+
+
+class Busy(BaseEvent):
+
+    """An event which takes CPU time to handle."""
+
+    pass
+
+
+class Handlers:
+
+    """Handlers which are methods, of callable objects as well."""
+
+    def handle(self, event):
+        """Handle an event."""
+        return True
+
+    def __call__(self, event):
+        """Handle an event."""
+        return True
+
+
+def spin(event, seconds=0.2):
+    """Keep the CPU busy for a while."""
+    until = time.process_time() + seconds
+
+    while time.process_time() < until:
+        pass
+
+    return True
+
+
+def test_handler_names():
+    """Handlers are named after the function they execute, however they're wrapped."""
+    handlers = Handlers()
+
+    assert handler_name(spin) == '%s.spin' % __name__
+    assert handler_name(functools.partial(spin, seconds=1)) == '%s.spin' % __name__
+    assert handler_name(handlers.handle) == '%s.Handlers.handle' % __name__
+    assert handler_name(handlers) == '%s.Handlers.__call__' % __name__
+
+
+def test_cpu_and_wall_time_are_attributed_to_handlers():
+    """Samples and wall time are attributed to the handlers they were taken in."""
+    events = EventManager()
+    events.register(Busy, spin)
+    profiler = SamplingProfiler(handler_codes(events), interval=0.005)
+    events.profiler = profiler
+
+    profiler.start()
+    events.handle(Busy())
+    profiler.stop()
+
+    name = '%s.spin' % __name__
+    assert profiler.cpu[name] > 0
+    assert profiler.cpu[name] >= sum(count for handler, count in profiler.cpu.items() if handler != name)
+    assert profiler.calls == {name: 1}
+    assert profiler.wall[name] >= 0.2
+    assert any(stack.endswith('%s:spin' % __name__) for stack in profiler.stacks)
+    assert not profiler.running
+
+
+def test_profiles_are_merged_and_saved(tmp_path):
+    """Profiles of several processes add up, and stacks are saved in the collapsed format."""
+    profiles = []
+
+    for i in range(0, 2):
+        profiler = SamplingProfiler({}, interval=0.01)
+        profiler.cpu[OUTSIDE] += 2
+        profiler.stacks['a;b'] += 2
+        profiler.save(os.path.join(str(tmp_path), 'worker-%i.json' % i))
+        profiles.append(profiler.dump())
+
+    merged = merge(profiles)
+    assert merged['cpu'] == {OUTSIDE: 4}
+    assert merged['interval'] == 0.01
+
+    write_collapsed(merged['stacks'], os.path.join(str(tmp_path), 'cpu.collapsed'))
+
+    with open(os.path.join(str(tmp_path), 'cpu.collapsed')) as handle:
+        assert handle.read() == 'a;b 4\n'
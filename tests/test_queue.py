@@ -0,0 +1,228 @@
+"""Tests for the queue module, against a fake broker connection."""
+import os
+import pytest
+from nite.event import EventManager, BaseEvent, MessagePriority
+from tests.fakes import FakeConnection, connector, route, delivered, deliver
+
+
+pytestmark = pytest.mark.usefixtures('fake_broker')
+
+
+class Sharded(BaseEvent):
+
+    """An event sent with affinity."""
+
+    pass
+
+
+class Large(BaseEvent):
+
+    """An event with a payload which is sent out of band."""
+
+    pass
+
+
+class Prioritized(BaseEvent):
+
+    """An event with a number, to tell them apart."""
+
+    def __init__(self, number=None):
+        """Constructor."""
+        super(Prioritized, self).__init__()
+        self.number = number
+
+
+def test_affinity_keys_stick_to_a_shard():
+    """Events sharing an affinity key go to the same shard, and are handled once."""
+    name = '%s.Sharded' % __name__
+    events = EventManager()
+    events.register(name, lambda event: True)
+    amqp = connector(events, shards=4)
+    published = amqp.publish_channel.published
+
+    for affinity in ['user-1', 'user-1', 'user-2']:
+        events.trigger(Sharded(), affinity=affinity)
+        assert route(amqp, published[-1]) == [name]
+
+    assert published[0][1]['routing_key'] == published[1][1]['routing_key']
+    assert len(set(kwargs['routing_key'] for message, kwargs in published)) <= 2
+
+
+def test_sharded_events_reach_every_subscription_once():
+    """Events sent with affinity reach exact and pattern subscriptions once, through their own exchange."""
+    name = '%s.Sharded' % __name__
+    events = EventManager()
+
+    for topic in (name, '%s.*' % __name__, '#'):
+        events.register(topic, lambda event: True)
+
+    amqp = connector(events, shards=4)
+
+    events.trigger(Sharded(), affinity='user-1')
+    sharded = amqp.publish_channel.published[-1]
+
+    assert sharded[1]['exchange'] == 'nite.topic.shards'
+    assert route(amqp, sharded) == sorted([name, '%s.*' % __name__, '#'])
+
+    events.trigger(Sharded())
+    assert route(amqp, amqp.publish_channel.published[-1]) == sorted([name, '%s.*' % __name__, '#'])
+
+
+def test_urgent_messages_overtake_buffered_ones():
+    """Messages which were buffered already are overtaken by more urgent ones."""
+    handled = []
+    events = EventManager()
+    events.register(Prioritized, lambda event: handled.append(event.number))
+    amqp = connector(events, priority_lanes=True)
+
+    for number, priority in enumerate([MessagePriority.BULK] * 3 + [MessagePriority.URGENT]):
+        events.trigger(Prioritized(number), priority=priority)
+        amqp.on_consume(delivered(amqp, amqp.publish_channel.published[-1], tag=number + 1))
+
+    for i in range(0, 4):
+        amqp.fetch()
+
+    assert handled[0] == 3
+    assert sorted(handled) == [0, 1, 2, 3]
+    assert amqp.channel.acks == [('ack', 4), ('ack', 1), ('ack', 2), ('ack', 3)]
+
+
+def large(events, payload, **kwargs):
+    """Trigger an event with a large payload and return the published message."""
+    event = Large()
+    event.payload = payload
+    events.trigger(event, **kwargs)
+
+    return events.queue.publish_channel.published[-1]
+
+
+def test_handler_errors_on_blob_payloads_are_kept(tmp_path):
+    """Exceptions raised by handlers of payloads sent out of band aren't replaced by errors closing the payload."""
+    def fail(event):
+        event.payload
+        raise ValueError('handler failed')
+
+    events = EventManager()
+    events.register(Large, fail)
+    amqp = connector(events, blob_store='spool', blob_config={'path': str(tmp_path), 'node_local': False},
+                     blob_threshold=16)
+    published = large(events, 'x' * 100, demographic=amqp.node_identifier)
+
+    assert 'x-nite-blob' in published[0].application_headers
+
+    with pytest.raises(ValueError):
+        deliver(amqp, published)
+
+    # The message is delivered again, so its payload has to stick around
+    assert len(os.listdir(str(tmp_path))) == 1
+
+
+def test_blob_payloads_of_events_for_several_queues_are_collected(tmp_path):
+    """Payloads of events which may reach several queues are left for collection, those sent to a node aren't."""
+    handled = []
+    events = EventManager()
+
+    for topic in (Large, '%s.*' % __name__):
+        events.register(topic, lambda event: handled.append(event.payload) or True)
+
+    amqp = connector(events, blob_store='spool', blob_config={'path': str(tmp_path), 'node_local': False},
+                     blob_threshold=16)
+    published = large(events, 'x' * 100)
+
+    assert len(route(amqp, published)) == 2
+
+    deliver(amqp, published, tag=1)
+    deliver(amqp, published, tag=2)
+
+    assert handled == ['x' * 100] * 4
+    assert len(os.listdir(str(tmp_path))) == 1
+
+    deliver(amqp, large(events, 'y' * 100, demographic=amqp.node_identifier), tag=3)
+
+    assert len(os.listdir(str(tmp_path))) == 1
+
+
+def test_missing_blob_payloads_are_rejected(tmp_path):
+    """Messages whose payload was removed already are rejected instead of breaking the worker."""
+    events = EventManager()
+    events.register(Large, lambda event: True)
+    amqp = connector(events, blob_store='spool', blob_config={'path': str(tmp_path)}, blob_threshold=16)
+    published = large(events, 'x' * 100, demographic=amqp.node_identifier)
+
+    for name in os.listdir(str(tmp_path)):
+        os.unlink(os.path.join(str(tmp_path), name))
+
+    deliver(amqp, published, tag=5)
+
+    assert amqp.channel.acks == [('reject', 5)]
+
+
+def test_node_local_blobs_keep_routing(tmp_path):
+    """Events which may be handled by other nodes don't use node-local payloads, nor get rerouted for them."""
+    events = EventManager()
+    events.register(Large, lambda event: True)
+    connector(events, blob_store='spool', blob_config={'path': str(tmp_path)}, blob_threshold=16)
+    message, kwargs = large(events, 'x' * 100)
+
+    assert kwargs['routing_key'] == 'event.%s.Large' % __name__
+    assert 'x-nite-blob' not in (message.application_headers or {})
+    assert os.listdir(str(tmp_path)) == []
+
+
+@pytest.mark.parametrize('confirm', [None, 'basic_nack'])
+def test_spooled_events_are_kept_until_confirmed(tmp_path, monkeypatch, confirm):
+    """Spooled events the broker didn't confirm, or rejected, are replayed again later."""
+    events = EventManager()
+    amqp = connector(events, produce_only=True, spool={'path': str(tmp_path)}, confirm_timeout=0.1)
+    amqp.connected = False
+
+    for i in range(0, 3):
+        events.trigger(Sharded())
+
+    monkeypatch.setattr(FakeConnection, 'confirm', confirm)
+    amqp.replay_spool()
+
+    assert len(amqp.spool) == 3
+    assert amqp.spool.stats['read'] == 0
+
+    monkeypatch.setattr(FakeConnection, 'confirm', 'basic_ack')
+    amqp.replay_spool()
+
+    assert len(amqp.spool) == 0
+    assert amqp.spool.stats['read'] == 3
+
+
+def test_handler_errors_arent_lost_connections():
+    """Connection errors raised by handlers themselves aren't taken for a lost connection to the broker."""
+    def fail(event):
+        raise OSError('handler failed')
+
+    events = EventManager()
+    events.register(Sharded, fail)
+    amqp = connector(events)
+
+    events.trigger(Sharded())
+    amqp.on_consume(delivered(amqp, amqp.publish_channel.published[-1]))
+
+    with pytest.raises(OSError):
+        amqp.fetch()
+
+    assert amqp.connected
+    assert amqp.channel.acks == []
+
+
+def test_failed_acks_are_lost_connections(monkeypatch):
+    """Messages which can't be acked are left to be delivered again after reconnecting."""
+    def fail(delivery_tag):
+        raise ConnectionResetError()
+
+    events = EventManager()
+    events.register(Sharded, lambda event: True)
+    amqp = connector(events)
+    monkeypatch.setattr(amqp.channel, 'basic_ack', fail)
+
+    events.trigger(Sharded())
+    amqp.on_consume(delivered(amqp, amqp.publish_channel.published[-1]))
+    amqp.fetch()
+
+    assert not amqp.connected
@@ -0,0 +1,101 @@
+"""Tests for the record module."""
+import os
+import msgpack
+import pytest
+from nite.event import EventDemographic, MessagePriority
+from nite.pressure import BackpressureError
+from nite.record import Recorder, Replay, read_recording
+from nite.spool import Segment
+
+
+class FakeEvents:
+
+    """An event manager which records what is triggered, shedding or failing events it's told to."""
+
+    def trigger(self, event, demographic, priority=None):
+        """Record a triggered event."""
+        if event.get('shed'):
+            return False
+
+        if event.get('fail'):
+            raise BackpressureError('saturated')
+
+        self.triggered.append((event, demographic, priority))
+
+        return True
+
+    def __init__(self):
+        """Constructor."""
+        self.triggered = []
+
+
+def record(path, events, tap='publish'):
+    """Record event bodies sent to demographics, and return the recorder."""
+    recorder = Recorder(str(path), tap=tap, segment_size=4096, fsync='never')
+
+    for demographic, body in events:
+        recorder.record(demographic, MessagePriority.NORMAL, msgpack.dumps(body))
+
+    recorder.close()
+
+    return recorder
+
+
+def test_recordings_are_read_back_in_order(tmp_path):
+    """Recorded events are read back oldest first, with their demographic and priority."""
+    record(tmp_path, [(EventDemographic.GLOBAL_ALL, {'i': i}) for i in range(0, 100)])
+    records = list(read_recording(str(tmp_path)))
+
+    assert [msgpack.loads(body, raw=False) for _, _, _, body in records] == [{'i': i} for i in range(0, 100)]
+    assert set((demographic, priority) for _, demographic, priority, _ in records) == \
+        {('GLOBAL_ALL', MessagePriority.NORMAL.value)}
+
+
+def test_recordings_are_opened_read_only(tmp_path):
+    """Reading a recording leaves its segments untouched, and can't write to them."""
+    record(tmp_path, [(EventDemographic.GLOBAL_ALL, {'i': i}) for i in range(0, 10)])
+    log = os.path.join(str(tmp_path), os.listdir(str(tmp_path))[0])
+    path = os.path.join(log, sorted(name for name in os.listdir(log) if name.endswith('.seg'))[0])
+
+    with open(path, 'rb') as handle:
+        before = handle.read()
+
+    assert len(list(read_recording(log))) == 10
+
+    with open(path, 'rb') as handle:
+        assert handle.read() == before
+
+    segment = Segment(path, 0, read_only=True)
+
+    try:
+        with pytest.raises(TypeError):
+            segment.append(b'record')
+    finally:
+        segment.close()
+
+
+@pytest.mark.parametrize('threads', [1, 4])
+def test_replays_trigger_every_recorded_event(tmp_path, threads):
+    """Every recorded event is triggered once, and events sent to a node are sent to any single node instead."""
+    record(tmp_path, [('node-1', {'i': i}) for i in range(0, 50)] + [
+        (EventDemographic.GLOBAL_ALL, {'shed': True}), (EventDemographic.GLOBAL_ALL, {'fail': True})])
+    events = FakeEvents()
+
+    summary = Replay(events, str(tmp_path), speed=0, threads=threads).run()
+
+    assert (summary['triggered'], summary['shed'], summary['failed']) == (50, 1, 1)
+    assert sorted(event['i'] for event, _, _ in events.triggered) == list(range(0, 50))
+    assert set(demographic for _, demographic, _ in events.triggered) == {EventDemographic.GLOBAL_SINGLE}
+    assert 'p99' in summary and 'lag_p99' not in summary
+
+
+def test_replays_can_be_limited(tmp_path):
+    """Replays stop after the limit, and keep to the maximum rate."""
+    record(tmp_path, [(EventDemographic.GLOBAL_ALL, {'i': i}) for i in range(0, 50)])
+    events = FakeEvents()
+
+    summary = Replay(events, str(tmp_path), speed=0, max_rate=200, limit=10).run()
+
+    assert [event['i'] for event, _, _ in events.triggered] == list(range(0, 10))
+    assert summary['duration'] >= 9 / 200.0
+    assert 'lag_p99' in summary
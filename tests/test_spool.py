@@ -0,0 +1,186 @@
+"""Tests for the spool module."""
+import time
+import threading
+import pytest
+from nite.spool import Segment, SegmentLog, SpoolFullError
+
+
+def records(count, prefix=b'record'):
+    """Return a list of numbered records."""
+    return [b'%s-%04i' % (prefix, i) for i in range(0, count)]
+
+
+def test_replay_in_order(tmp_path):
+    """Records are replayed in the order they were appended, across segments."""
+    log = SegmentLog(str(tmp_path), segment_size=4096)
+
+    for record in records(1000):
+        log.append(record)
+
+    assert len(log) == 1000
+    assert log.size > 4096
+
+    replayed = []
+    assert log.replay(replayed.append) == 1000
+    assert replayed == records(1000)
+    assert len(log) == 0
+    assert log.stats == {'appended': 1000, 'read': 1000, 'dropped': 0}
+
+
+def test_replay_limit(tmp_path):
+    """Only up to `limit` records are replayed at once."""
+    log = SegmentLog(str(tmp_path), segment_size=4096)
+
+    for record in records(10):
+        log.append(record)
+
+    replayed = []
+    assert log.replay(replayed.append, limit=3) == 3
+    assert log.replay(replayed.append) == 7
+    assert replayed == records(10)
+
+
+def test_failed_records_are_replayed_again(tmp_path):
+    """A record is only read once the callback returns."""
+    log = SegmentLog(str(tmp_path), segment_size=4096)
+
+    for record in records(5):
+        log.append(record)
+
+    def fail(record):
+        if record == b'record-0002':
+            raise ConnectionError()
+
+    with pytest.raises(ConnectionError):
+        log.replay(fail)
+
+    replayed = []
+    log.replay(replayed.append)
+
+    assert replayed == records(5)[2:]
+
+
+def test_uncommitted_batches_are_replayed_again(tmp_path):
+    """Records only count as read once the batch they're in was committed."""
+    log = SegmentLog(str(tmp_path), segment_size=4096)
+
+    for record in records(5):
+        log.append(record)
+
+    def fail():
+        raise ConnectionError()
+
+    with pytest.raises(ConnectionError):
+        log.replay(lambda record: None, commit=fail)
+
+    assert len(log) == 5
+
+    replayed = []
+    log.replay(replayed.append, commit=lambda: None)
+
+    assert replayed == records(5)
+    assert len(log) == 0
+
+
+def test_idle_logs_are_synced(tmp_path, monkeypatch):
+    """Records reach the disk once the fsync interval passed, even if no record is appended after them."""
+    flushed = []
+    monkeypatch.setattr(Segment, 'flush', lambda segment: flushed.append(segment))
+    log = SegmentLog(str(tmp_path), segment_size=4096, fsync_interval=60)
+
+    log.append(b'record')
+    log.sync()
+    assert flushed == []
+
+    log._flushed = time.time() - 60
+    log.sync()
+    log.sync()
+    assert len(flushed) == 1
+
+
+def test_progress_survives_reopening(tmp_path):
+    """Unread records are picked up by the next instance of a log."""
+    log = SegmentLog(str(tmp_path), segment_size=4096)
+
+    for record in records(300):
+        log.append(record)
+
+    log.replay(lambda record: None, limit=100)
+    log.close()
+
+    log = SegmentLog(str(tmp_path), segment_size=4096)
+    replayed = []
+    log.replay(replayed.append)
+
+    assert len(replayed) == 200
+    assert replayed == records(300)[100:]
+
+
+def test_overflow_drops_oldest(tmp_path):
+    """Full logs make room by dropping their oldest segment."""
+    log = SegmentLog(str(tmp_path), segment_size=4096, max_bytes=4096 * 2)
+
+    for record in records(1000):
+        log.append(record)
+
+    replayed = []
+    log.replay(replayed.append)
+
+    assert log.stats['dropped'] > 0
+    assert len(replayed) + log.stats['dropped'] == 1000
+    assert replayed == records(1000)[-len(replayed):]
+
+
+def test_overflow_rejects(tmp_path):
+    """Full logs which don't drop records refuse new ones."""
+    log = SegmentLog(str(tmp_path), segment_size=4096, max_bytes=4096, overflow='reject')
+
+    with pytest.raises(SpoolFullError):
+        for record in records(1000):
+            log.append(record)
+
+
+def test_records_can_be_appended_while_replaying(tmp_path):
+    """Other threads aren't held up by callbacks of a replay."""
+    log = SegmentLog(str(tmp_path), segment_size=4096)
+    log.append(b'first')
+
+    def append(record):
+        thread = threading.Thread(target=log.append, args=(b'second',))
+        thread.start()
+        thread.join(5)
+
+        assert not thread.is_alive()
+
+    assert log.replay(append, limit=1) == 1
+
+    replayed = []
+    log.replay(replayed.append)
+
+    assert replayed == [b'second']
+
+
+def test_segments_dropped_while_replaying(tmp_path):
+    """Records dropped to make room in the middle of a replay are counted once."""
+    log = SegmentLog(str(tmp_path), segment_size=4096, max_bytes=4096 * 2)
+
+    for record in records(200):
+        log.append(record)
+
+    def flood(record):
+        if record == b'record-0004':
+            for appended in records(600, b'flood'):
+                log.append(appended)
+
+    log.replay(flood)
+
+    assert len(log) == 0
+    assert log.stats['read'] + log.stats['dropped'] == log.stats['appended']
+
+
+def test_oversized_records_are_refused(tmp_path):
+    """Records which don't fit into a segment are refused."""
+    log = SegmentLog(str(tmp_path), segment_size=4096)
+
+    with pytest.raises(Exception):
+        log.append(b'x' * 4096)
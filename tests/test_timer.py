@@ -0,0 +1,157 @@
+"""Tests for the timer module."""
+import os
+import time
+import signal
+import calendar
+from datetime import datetime
+import pytest
+from nite.timer import Timer, TimerWheel, TimerScheduler, CronSchedule
+
+
+def timer():
+    """Return a timer which does nothing."""
+    return Timer(0, lambda: None)
+
+
+def advance(wheel, ticks):
+    """Advance a wheel by an amount of ticks and return the ticks at which timers expired, by timer."""
+    expired = {}
+
+    for i in range(0, ticks):
+        for expiring in wheel.advance():
+            expired[expiring] = wheel.tick
+
+    return expired
+
+
+def test_timers_expire_on_their_tick():
+    """Timers expire on the tick they were added for, across wheels."""
+    wheel = TimerWheel()
+    timers = {ticks: timer() for ticks in (1, 5, 255, 256, 257, 1000, 20000)}
+
+    for ticks, pending in timers.items():
+        wheel.add(pending, ticks)
+
+    assert len(wheel) == len(timers)
+
+    expired = advance(wheel, 20000)
+
+    assert expired == {pending: ticks for ticks, pending in timers.items()}
+    assert len(wheel) == 0
+
+
+def test_overdue_timers_expire_on_the_next_tick():
+    """Timers which should already have expired expire right away."""
+    wheel = TimerWheel()
+    advance(wheel, 10)
+
+    overdue = timer()
+    wheel.add(overdue, 3)
+
+    assert wheel.advance() == [overdue]
+
+
+class SmallWheel(TimerWheel):
+
+    """A timing wheel spanning only 2 ** 14 ticks."""
+
+    LEVELS = 2
+
+
+def test_timers_beyond_the_span_expire_on_their_tick():
+    """Timers further away than a wheel spans don't expire early."""
+    wheel = SmallWheel()
+    timers = {ticks: timer() for ticks in (16383, 16384, 20000, 50000)}
+
+    for ticks, pending in timers.items():
+        wheel.add(pending, ticks)
+
+    assert advance(wheel, 50000) == {pending: ticks for ticks, pending in timers.items()}
+    assert len(wheel) == 0
+
+
+def test_removed_timers_dont_expire():
+    """Removed timers are gone, even from wheels other than the first."""
+    wheel = TimerWheel()
+    near, far = timer(), timer()
+    wheel.add(near, 10)
+    wheel.add(far, 5000)
+
+    wheel.remove(near)
+    wheel.remove(far)
+    wheel.remove(far)
+
+    assert len(wheel) == 0
+    assert advance(wheel, 6000) == {}
+
+
+def test_scheduler_lock_is_released_in_forked_children():
+    """Children forked while the timer thread held the lock can still add timers."""
+    scheduler = TimerScheduler()
+    scheduler.add(time.time() + 60, lambda: None)
+
+    with scheduler._lock:
+        pid = os.fork()
+
+        if not pid:
+            scheduler.add(time.time(), lambda: os._exit(0))
+            time.sleep(5)
+            os._exit(1)
+
+    for i in range(0, 50):
+        done, status = os.waitpid(pid, os.WNOHANG)
+
+        if done:
+            break
+
+        time.sleep(0.1)
+    else:
+        os.kill(pid, signal.SIGKILL)
+        os.waitpid(pid, 0)
+        pytest.fail('The child deadlocked on the lock of the timer thread of its parent')
+
+    scheduler.stop()
+
+    assert os.WIFEXITED(status) and os.WEXITSTATUS(status) == 0
+
+
+def timestamp(*moment):
+    """Return the UNIX timestamp of a moment in UTC."""
+    return calendar.timegm(datetime(*moment).utctimetuple())
+
+
+def test_cron_schedule_steps_and_ranges():
+    """Steps and ranges come around when expected."""
+    schedule = CronSchedule('*/15 9-17 * * *')
+
+    assert schedule.next(timestamp(2024, 1, 1, 9, 0)) == timestamp(2024, 1, 1, 9, 15)
+    assert schedule.next(timestamp(2024, 1, 1, 17, 45)) == timestamp(2024, 1, 2, 9, 0)
+
+
+def test_cron_schedule_day_of_month_or_day_of_week():
+    """If both day fields are restricted, either one matching is enough."""
+    schedule = CronSchedule('0 0 13 * 5')
+
+    # Friday the 5th, then Saturday the 13th
+    assert schedule.next(timestamp(2024, 1, 1)) == timestamp(2024, 1, 5)
+    assert schedule.next(timestamp(2024, 1, 12, 12, 0)) == timestamp(2024, 1, 13)
+
+
+def test_cron_schedule_rolls_over_months_and_years():
+    """Schedules find the next matching month, in the next year if needed."""
+    schedule = CronSchedule('30 6 1 3 *')
+
+    assert schedule.next(timestamp(2024, 3, 1, 6, 30)) == timestamp(2025, 3, 1, 6, 30)
+
+
+@pytest.mark.parametrize('expression', ['* * * *', '60 * * * *', '* 5-2 * * *', '*/0 * * * *'])
+def test_cron_schedule_refuses_invalid_expressions(expression):
+    """Expressions with the wrong amount of fields or values out of range are refused."""
+    with pytest.raises(ValueError):
+        CronSchedule(expression)
+
+
+def test_cron_schedule_which_never_matches():
+    """Schedules which never come around say so."""
+    with pytest.raises(ValueError):
+        CronSchedule('0 0 31 2 *').next(timestamp(2024, 1, 1))
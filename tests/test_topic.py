@@ -0,0 +1,56 @@
+"""Tests for the topic module."""
+from nite.topic import TopicTrie, is_pattern
+
+
+def test_is_pattern():
+    """Only topics with wildcard words are patterns."""
+    assert is_pattern('app.*')
+    assert is_pattern('#')
+    assert not is_pattern('app.events.Created')
+    assert not is_pattern('app.events*')
+
+
+def test_star_matches_exactly_one_word():
+    """A star matches a single word."""
+    trie = TopicTrie(['app.*.Created'])
+
+    assert trie.match('app.users.Created') == ('app.*.Created',)
+    assert trie.match('app.Created') == ()
+    assert trie.match('app.users.events.Created') == ()
+
+
+def test_hash_matches_zero_or_more_words():
+    """A hash matches any amount of words, including none."""
+    trie = TopicTrie(['app.#', '#.Created', '#'])
+
+    assert set(trie.match('app')) == {'app.#', '#'}
+    assert set(trie.match('app.users.Created')) == {'app.#', '#.Created', '#'}
+    assert set(trie.match('Created')) == {'#.Created', '#'}
+    assert trie.match('other.Deleted') == ('#',)
+
+
+def test_exact_name_comes_first():
+    """The name itself, if it was added, comes before the patterns matching it."""
+    trie = TopicTrie(['app.#', 'app.Created', 'app.*'])
+
+    assert trie.match('app.Created') == ('app.Created', 'app.#', 'app.*')
+
+
+def test_matches_are_forgotten_when_topics_change():
+    """Memoized matches don't outlive changes to the trie."""
+    trie = TopicTrie(['app.*'])
+    assert 'app.Created' in trie
+
+    trie.remove('app.*')
+    assert 'app.Created' not in trie
+
+    trie.add('app.Created')
+    assert trie.match('app.Created') == ('app.Created',)
+
+
+def test_removing_unknown_topics_does_nothing():
+    """Topics which were never added can be removed."""
+    trie = TopicTrie(['app.*'])
+    trie.remove('other.topic')
+
+    assert trie.match('app.Created') == ('app.*',)
@@ -0,0 +1,122 @@
+"""Tests for the trace module."""
+import os
+import json
+import time
+import pytest
+from nite import event as event_module
+from nite.event import EventManager, BaseEvent
+from nite.trace import Tracer, Span, AbstractSpanExporter
+from tests.fakes import connector, deliver
+
+
+class Traced(BaseEvent):
+
+    """An event whose handling is traced."""
+
+    pass
+
+
+class ListExporter(AbstractSpanExporter):
+
+    """An exporter which keeps spans in a list."""
+
+    def export(self, spans):
+        """Keep a batch of spans."""
+        self.spans.extend(spans)
+
+    def __init__(self):
+        """Constructor."""
+        self.spans = []
+
+
+def traced(sample_rate):
+    """Return an event manager with a tracer exporting to a list."""
+    events = EventManager()
+    events.tracer = Tracer(ListExporter(), sample_rate, batch_size=1000, flush_interval=60)
+    events.register(Traced, lambda event: True)
+
+    return events
+
+
+def test_sampled_traces_are_carried_across_events():
+    """Spans of a sampled trace share its identifier, and are nested as they happened."""
+    events = traced(1)
+    headers = {}
+    events.tracer.inject(headers)
+
+    span = events.tracer.receive(headers, 'consume')
+    events.handle(Traced())
+    events.tracer.pop(span)
+    events.tracer.flush()
+
+    spans = {span['name']: span for span in events.tracer.exporter.spans}
+    assert sorted(spans) == ['consume', 'handler', 'queue']
+    assert set(span['trace_id'] for span in spans.values()) == {headers['x-nite-trace-id']}
+    assert spans['handler']['parent_id'] == spans['consume']['span_id']
+    assert spans['handler']['attributes'] == {'handler': '%s.traced.<locals>.<lambda>' % __name__}
+
+    nested = {}
+    events.tracer.push(Span('trace', None, 'consume'))
+    events.tracer.inject(nested)
+    assert nested['x-nite-trace-id'] == 'trace' and nested['x-nite-sampled'] == 1
+
+
+def test_unsampled_traces_cost_next_to_nothing(monkeypatch):
+    """Handlers of unsampled traces aren't even named, and nothing is exported."""
+    def fail(handler):
+        raise AssertionError('Handlers of unsampled traces were named')
+
+    monkeypatch.setattr(event_module, 'handler_name', fail)
+    events = traced(0)
+    headers = {}
+    events.tracer.inject(headers)
+
+    span = events.tracer.receive(headers, 'consume')
+    events.handle(Traced())
+    events.tracer.pop(span)
+    events.tracer.flush()
+
+    assert headers['x-nite-sampled'] == 0
+    assert events.tracer.exporter.spans == []
+
+
+@pytest.mark.usefixtures('fake_broker')
+def test_spans_are_flushed_periodically(tmp_path):
+    """Buffered spans are exported after the flush interval, even if no other span is finished."""
+    path = os.path.join(str(tmp_path), 'spans.jsonl')
+    events = EventManager()
+    events.register(Traced, lambda event: True)
+    amqp = connector(events, trace_exporter='file', trace_config={'path': path}, trace_sample_rate=1,
+                     trace_batch_size=1000, trace_flush_interval=0.1)
+
+    events.trigger(Traced())
+    amqp.tracer.flush()
+    deliver(amqp, amqp.publish_channel.published[-1])
+
+    for i in range(0, 50):
+        if os.path.exists(path) and os.path.getsize(path):
+            break
+
+        time.sleep(0.02)
+
+    events.timers.stop()
+
+    with open(path) as handle:
+        assert 'consume' in [json.loads(line)['name'] for line in handle]
+
+
+def test_forked_processes_dont_export_spans_of_their_parent():
+    """Spans buffered before forking are only exported by the parent."""
+    tracer = Tracer(ListExporter(), 1, batch_size=1000, flush_interval=60)
+    tracer.finish(Span('trace', None, 'buffered'))
+    pid = os.fork()
+
+    if not pid:
+        tracer.flush()
+        os._exit(1 if tracer.exporter.spans else 0)
+
+    done, status = os.waitpid(pid, 0)
+    tracer.flush()
+
+    assert os.WEXITSTATUS(status) == 0
+    assert [span['name'] for span in tracer.exporter.spans] == ['buffered']
@@ -0,0 +1,75 @@
+"""Tests for the util module."""
+from nite.util import stable_hash, jump_hash, rendezvous_score, percentile
+
+
+def test_stable_hash_is_deterministic():
+    """Hashes don't depend on the interpreter computing them."""
+    assert stable_hash('user-1') == stable_hash('user-1')
+    assert stable_hash('user-1') != stable_hash('user-2')
+    assert 0 <= stable_hash(42) < 1 << 64
+
+
+def test_jump_hash_stays_in_range():
+    """Keys are mapped onto one of the buckets."""
+    for buckets in (1, 2, 7, 64):
+        for key in range(0, 500):
+            assert 0 <= jump_hash(key, buckets) < buckets
+
+
+def test_jump_hash_spreads_keys():
+    """Every bucket gets a fair share of keys."""
+    counts = [0] * 8
+
+    for key in range(0, 8000):
+        counts[jump_hash(key, 8)] += 1
+
+    assert min(counts) > 800
+    assert max(counts) < 1200
+
+
+def test_jump_hash_only_moves_keys_to_new_buckets():
+    """Adding a bucket only moves keys into that bucket, and only about 1 / n of them."""
+    moved = 0
+
+    for key in range(0, 5000):
+        before, after = jump_hash(key, 9), jump_hash(key, 10)
+
+        if before != after:
+            assert after == 9
+            moved += 1
+
+    assert 300 < moved < 700
+
+
+def test_rendezvous_score_stays_in_range():
+    """Scores are within the limit and the same every time."""
+    for key in range(0, 200):
+        score = rendezvous_score('node-a', key, limit=255)
+
+        assert 0 <= score <= 255
+        assert score == rendezvous_score('node-a', key, limit=255)
+
+
+def test_rendezvous_score_only_moves_keys_of_leaving_members():
+    """Only the keys owned by a member which leaves get a new owner."""
+    members = ['node-a', 'node-b', 'node-c', 'node-d']
+
+    def owner(key, members):
+        return max(members, key=lambda member: (rendezvous_score(member, key), member))
+
+    for key in range(0, 1000):
+        before = owner(key, members)
+        after = owner(key, [member for member in members if member != 'node-c'])
+
+        if before != 'node-c':
+            assert after == before
+
+
+def test_percentile():
+    """Percentiles are taken from sorted lists of values, as fractions."""
+    values = list(range(1, 101))
+
+    assert percentile(values, 0) == 1
+    assert percentile(values, 0.5) == 51
+    assert percentile(values, 0.99) == 100
+    assert percentile(values, 1) == 100
@@ -0,0 +1,125 @@
+"""Tests for the worker module."""
+import time
+import multiprocessing
+from nite.worker import WorkerManager, WorkerStatus
+
+
+class FakeProcess:
+
+    """A worker process which only pretends to run."""
+
+    def is_alive(self):
+        """Return whether the process is running."""
+        return self.alive
+
+    def kill(self):
+        """Kill the process."""
+        self.killed = True
+        self.alive = False
+
+    def join(self, timeout=None):
+        """Wait for nothing."""
+        pass
+
+    def __init__(self, name, alive=True):
+        """Constructor."""
+        self.name = name
+        self.alive = alive
+        self.killed = False
+        self.exitcode = None if alive else 1
+        self.events = None
+        self.cpus = None
+        self.pid = 0
+        self.status = WorkerStatus()
+        self.retire = multiprocessing.Value('b', False)
+
+
+def manager(processes, stuck_timeout=None):
+    """Return a worker manager of fake processes, which spawns fake processes."""
+    workers = WorkerManager(None, worker_count=len(processes), stuck_timeout=stuck_timeout)
+    workers.processes = processes
+    workers.spawn = lambda name, events, status=None, cpus=None: FakeProcess(name + ' (replacement)')
+
+    return workers
+
+
+def test_stuck_workers_are_replaced():
+    """Workers handling a single event for too long are killed, and replaced."""
+    stuck, healthy = FakeProcess('stuck'), FakeProcess('healthy')
+    stuck.status.begin('app.Slow')
+    stuck.status._times[1] -= 60
+    healthy.status.begin('app.Fast')
+
+    workers = manager([stuck, healthy], stuck_timeout=30)
+    workers.replace_failed(time.time())
+
+    assert stuck.killed and not healthy.killed
+    assert stuck.status.event is None
+    assert [process.name for process in workers.processes] == ['stuck (replacement)', 'healthy']
+    assert workers.stuck == {'app.Slow': 1}
+
+
+def test_unresponsive_and_dead_workers_are_replaced():
+    """Workers which stopped showing signs of life, or died, are replaced."""
+    unresponsive, dead = FakeProcess('unresponsive'), FakeProcess('dead', alive=False)
+    unresponsive.status._times[0] -= 60
+
+    workers = manager([unresponsive, dead], stuck_timeout=30)
+    workers.replace_failed(time.time())
+
+    assert unresponsive.killed and not dead.killed
+    assert [process.name for process in workers.processes] == ['unresponsive (replacement)', 'dead (replacement)']
+    assert not workers.stuck
+
+
+def test_workers_are_only_replaced_when_dead_without_stuck_timeout():
+    """Without a `stuck_timeout`, busy workers are left alone however long they take."""
+    busy = FakeProcess('busy')
+    busy.status.begin('app.Slow')
+    busy.status._times[:] = [0, 1]
+
+    workers = manager([busy])
+    workers.replace_failed(time.time())
+
+    assert not busy.killed
+    assert workers.processes == [busy]
+
+
+def test_cache_locks_of_replaced_workers_are_recovered():
+    """Cache locks held by worker processes which were killed or died are recovered."""
+    recovered = []
+    stuck, dead = FakeProcess('stuck'), FakeProcess('dead', alive=False)
+    stuck.pid, dead.pid = 100, 101
+    stuck.status.begin('app.Slow')
+    stuck.status._times[1] -= 60
+
+    workers = manager([stuck, dead], stuck_timeout=30)
+    workers.cache = type('Cache', (), {'recover': lambda self, pid: recovered.append(pid)})()
+    workers.replace_failed(time.time())
+
+    assert recovered == [100, 101]
+
+
+def test_restarts_can_happen_in_the_background():
+    """Worker processes can be replaced without waiting for it."""
+    def spawn(name, events, status=None, cpus=None):
+        time.sleep(0.2)
+        return FakeProcess('%s (replacement)' % name)
+
+    workers = manager([FakeProcess('first'), FakeProcess('second')])
+    workers.terminate = multiprocessing.Value('b', False)
+    workers.layout = lambda: [('first', None), ('second', None)]
+    workers.spawn = spawn
+
+    started = time.time()
+    workers.restart(wait=False)
+
+    assert time.time() - started < 0.1
+    assert workers.restarting
+
+    # Stopping waits for the replacement being spawned, but no more are spawned after it
+    time.sleep(0.05)
+    workers.stop()
+
+    assert not workers.restarting
+    assert [process.name for process in workers.processes] == ['first (replacement)']